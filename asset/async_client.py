@@ -0,0 +1,101 @@
+import asyncio
+import time
+import weakref
+
+import pandas as pd
+from django.conf import settings
+
+from core.http_client import provider_client, RETRY_STATUSES
+from core.timing import span
+
+from .quote_cache import quote_cache
+from .price_store import price_store
+
+
+class AsyncMarketData:
+    # Async front for the quote cache, the price store and the JSON news/logo APIs.
+    # yfinance and the on-disk store are blocking, so those calls run in worker
+    # threads, at most `concurrency` at a time per event loop.
+
+    def __init__(self, quotes=None, prices=None, concurrency=16, transport=None):
+        self.quotes = quotes or quote_cache
+        self.prices = prices or price_store
+        self.concurrency = concurrency
+        self.transport = transport  # httpx transport for the HTTP APIs, e.g. a MockTransport
+        # Semaphores and HTTP clients belong to the loop they were created on
+        self._semaphores = weakref.WeakKeyDictionary()
+        self._clients = weakref.WeakKeyDictionary()
+
+    def _semaphore(self):
+        loop = asyncio.get_running_loop()
+        semaphore = self._semaphores.get(loop)
+        if semaphore is None:
+            semaphore = self._semaphores[loop] = asyncio.Semaphore(self.concurrency)
+        return semaphore
+
+    def _client(self):
+        import httpx  # Only the async views need it, keep it off startup
+
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None:
+            client = self._clients[loop] = httpx.AsyncClient(transport=self.transport)
+        return client
+
+    async def _run(self, func, *args):
+        async with self._semaphore():
+            return await asyncio.to_thread(func, *args)
+
+    async def get_info(self, symbol, fields=None):
+        return await self._run(self.quotes.get_info, symbol, fields)
+
+    async def get_infos(self, symbols, fields=None):
+        infos = await asyncio.gather(*(self.get_info(symbol, fields) for symbol in symbols))
+        return dict(zip(symbols, infos))
+
+    async def get_quotes(self, symbols):
+        # Already one batched upstream request for every symbol
+        return await self._run(self.quotes.get_quotes, list(symbols))
+
+    async def get_history(self, ticker, start=None, end=None, adjusted=True):
+        return await self._run(self.prices.history, ticker, start, end, adjusted)
+
+    async def get_closes(self, tickers, start=None, end=None):
+        # Same frame as PriceStore.closes, with the per-ticker reads in parallel
+        tickers = list(dict.fromkeys(ticker.upper() for ticker in tickers))
+        histories = await asyncio.gather(*(self.get_history(ticker, start, end) for ticker in tickers))
+        return pd.DataFrame({ticker: history['Close'] for ticker, history in zip(tickers, histories)}, columns=tickers)
+
+    async def get(self, provider, url, params=None, headers=None):
+        with span(provider):
+            return await self._get(provider, url, params, headers)
+
+    async def _get(self, provider, url, params=None, headers=None):
+        # Same timeouts, retry policy and latency metrics as core.http_client
+        import httpx
+
+        config = provider_client.config(provider)
+        connect, read = config['timeout']
+        timeout = httpx.Timeout(read, connect=connect)
+        retries = config['retries']
+        for attempt in range(retries + 1):
+            started = time.perf_counter()
+            response = error = None
+            try:
+                async with self._semaphore():
+                    response = await self._client().get(url, params=params, headers=headers, timeout=timeout)
+            except httpx.TransportError as e:
+                error = e
+            failed = error is not None or response.status_code in RETRY_STATUSES
+            provider_client.record(provider, time.perf_counter() - started, error=failed, retry=attempt > 0)
+
+            if not failed or attempt == retries:
+                break
+            await asyncio.sleep(provider_client.delay(attempt, response))
+
+        if error is not None:
+            raise error
+        return response
+
+
+market_data = AsyncMarketData(concurrency=getattr(settings, 'MARKET_DATA_CONCURRENCY', 16))
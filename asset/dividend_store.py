@@ -0,0 +1,42 @@
+import threading
+
+import pandas as pd
+
+from .price_store import price_store
+
+
+class DividendStore:
+    # Dividend events are the sparse 'Dividends' column of the price store, so
+    # they are downloaded once per ticker and refreshed with the price tail.
+    def __init__(self, prices):
+        self.prices = prices
+        self._events = {}
+        self._lock = threading.Lock()
+
+    def dividends(self, ticker):
+        key = ticker.upper()
+        records = self.prices.records(ticker)
+        version = (len(records), records['Date'][-1] if len(records) else None)
+
+        with self._lock:
+            cached = self._events.get(key)
+            if cached is not None and cached[0] == version:
+                return cached[1].copy()
+
+        paid = records['Dividends'] > 0
+        events = pd.Series(
+            records['Dividends'][paid],
+            index=pd.DatetimeIndex(records['Date'][paid].astype('datetime64[ns]'), name='Date'),
+            name='Dividends',
+        )
+        with self._lock:
+            self._events[key] = (version, events)
+        return events.copy()
+
+
+dividend_store = DividendStore(price_store)
+
+
+def get_dividends(ticker):
+    # Series of dividend amounts indexed by ex-date
+    return dividend_store.dividends(ticker)
@@ -0,0 +1,206 @@
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+
+from core.metrics import upstream
+from core.timing import span
+
+from .providers import get_provider
+
+COLUMNS = ['Open', 'High', 'Low', 'Close', 'Adj Close', 'Volume', 'Dividends', 'Stock Splits']
+
+# One record per trading day: a sorted date index plus float64 price columns.
+# float32 halved the files but turned 187.32 into 187.32000732 in every response.
+DTYPE = np.dtype([('Date', 'datetime64[D]')] + [(column, np.float64) for column in COLUMNS])
+
+
+def fetch_history(ticker, start=None):
+    # Unadjusted bars plus 'Adj Close' so the stored rows never need rewriting
+    # unless a new dividend or split shifts the adjustment factor.
+    return get_provider().history(ticker, start)
+
+
+def to_date(value):
+    timestamp = pd.Timestamp(value)
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.tz_convert('UTC').tz_localize(None)
+    return np.datetime64(timestamp.normalize(), 'D')
+
+
+def today():
+    return np.datetime64(pd.Timestamp.utcnow().date(), 'D')
+
+
+class PriceStore:
+    def __init__(self, root, refresh_interval=60 * 60, fetch=None, live_ttl=60):
+        self.root = root
+        self.refresh_interval = refresh_interval
+        self.fetch = fetch or fetch_history
+        self.live_ttl = live_ttl
+        self._locks = defaultdict(threading.Lock)
+        # ticker -> (fetched at, bars of the session still trading), kept in memory only
+        self._live = {}
+
+    def path(self, ticker):
+        key = re.sub(r'[^A-Z0-9.^=-]', '_', ticker.upper())
+        return os.path.join(self.root, f'{key}.npy')
+
+    def load(self, ticker):
+        path = self.path(ticker)
+        if not os.path.exists(path):
+            return None
+        records = np.load(path, mmap_mode='r')
+        if records.dtype != DTYPE:
+            return None  # Written in an older layout, fetched again in full
+        return records
+
+    def _write(self, ticker, records):
+        os.makedirs(self.root, exist_ok=True)
+        # Write to a temporary file and swap it in so readers never see a partial file
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            np.save(f, records)
+        os.replace(tmp_path, self.path(ticker))
+
+    def _to_records(self, frame):
+        if frame is None or frame.empty:
+            return np.empty(0, dtype=DTYPE)
+        frame = frame.reindex(columns=COLUMNS).fillna({'Dividends': 0, 'Stock Splits': 0})
+        records = np.empty(len(frame), dtype=DTYPE)
+        index = frame.index
+        if getattr(index, 'tz', None) is not None:
+            index = index.tz_localize(None)
+        records['Date'] = index.normalize().values.astype('datetime64[D]')
+        for column in COLUMNS:
+            records[column] = frame[column].to_numpy(dtype=np.float64)
+        return records
+
+    def _split(self, ticker, records):
+        # Today's bar is still moving, only completed sessions are stored and
+        # the rest is served from memory until it goes stale
+        completed = records['Date'] < today()
+        self._live[ticker.upper()] = (time.time(), records[~completed])
+        return records[completed]
+
+    def fetch_records(self, ticker, start=None):
+        with upstream(get_provider().name):
+            frame = self.fetch(ticker) if start is None else self.fetch(ticker, start=start)
+        return self._to_records(frame)
+
+    def refresh(self, ticker, force=False):
+        with self._locks[ticker.upper()]:
+            path = self.path(ticker)
+            stored = self.load(ticker)
+            if not force and stored is not None and time.time() - os.path.getmtime(path) < self.refresh_interval:
+                return
+
+            if stored is None or len(stored) == 0:
+                records = self._split(ticker, self.fetch_records(ticker))
+                if len(records):
+                    self._write(ticker, records)
+                return
+
+            # Only fetch the tail after the last stored session
+            last_date = stored['Date'][-1]
+            start = pd.Timestamp(last_date + np.timedelta64(1, 'D'))
+            new = self._split(ticker, self.fetch_records(ticker, start=start))
+            new = new[new['Date'] > last_date]
+            if not len(new):
+                os.utime(path)
+                return
+
+            if (new['Dividends'] > 0).any() or (new['Stock Splits'] > 0).any():
+                # Adjusted closes for the whole history change after a dividend or split
+                records = self._split(ticker, self.fetch_records(ticker))
+            else:
+                records = np.concatenate([np.asarray(stored), new])
+            self._write(ticker, records)
+
+    def records(self, ticker):
+        try:
+            self.refresh(ticker)
+        except Exception:
+            # Serve whatever is on disk if the upstream refresh fails
+            if self.load(ticker) is None:
+                raise
+
+        records = self.load(ticker)
+        if records is None:
+            records = np.empty(0, dtype=DTYPE)
+        live = self.live(ticker, records)
+        if len(live):
+            records = np.concatenate([np.asarray(records), live])
+        return records
+
+    def live(self, ticker, stored):
+        # The current session, refetched at most once per live_ttl
+        if not np.is_busday(today()):
+            return np.empty(0, dtype=DTYPE)
+        with self._locks[ticker.upper()]:
+            cached = self._live.get(ticker.upper())
+            if cached is None or time.time() - cached[0] >= self.live_ttl:
+                try:
+                    self._split(ticker, self.fetch_records(ticker, start=pd.Timestamp(today())))
+                except Exception:
+                    # Stored sessions are still served if the live bar can't be fetched
+                    self._live[ticker.upper()] = (time.time(), np.empty(0, dtype=DTYPE))
+                cached = self._live[ticker.upper()]
+        live = cached[1]
+        if len(stored):
+            live = live[live['Date'] > stored['Date'][-1]]
+        return live
+
+    def history(self, ticker, start=None, end=None, adjusted=True):
+        with span('price_store'):
+            return self._history(ticker, start, end, adjusted)
+
+    def _history(self, ticker, start, end, adjusted):
+        records = self.records(ticker)
+
+        # Range read on the sorted date index, end is exclusive like yfinance
+        dates = records['Date']
+        lo = np.searchsorted(dates, to_date(start)) if start is not None else 0
+        hi = np.searchsorted(dates, to_date(end)) if end is not None else len(dates)
+        window = np.array(records[lo:hi])
+
+        data = pd.DataFrame(
+            {column: window[column] for column in COLUMNS},
+            index=pd.DatetimeIndex(window['Date'].astype('datetime64[ns]'), name='Date'),
+        )
+        if adjusted:
+            # Same as yfinance's auto_adjust: scale OHLC by the Adj Close / Close ratio
+            with np.errstate(divide='ignore', invalid='ignore'):
+                ratio = data['Adj Close'] / data['Close']
+            for column in ['Open', 'High', 'Low']:
+                data[column] = data[column] * ratio
+            data['Close'] = data['Adj Close']
+            data = data.drop(columns='Adj Close')
+        return data
+
+    def closes(self, tickers, start=None, end=None):
+        # Adjusted closes for several tickers, one column per ticker
+        tickers = list(dict.fromkeys(ticker.upper() for ticker in tickers))
+        series = {ticker: self.history(ticker, start, end)['Close'] for ticker in tickers}
+        return pd.DataFrame(series, columns=tickers)
+
+
+price_store = PriceStore(
+    os.path.join(getattr(settings, 'MARKET_DATA_DIR', os.path.join(settings.BASE_DIR, 'market_data')), 'prices'),
+    refresh_interval=getattr(settings, 'PRICE_STORE_REFRESH_INTERVAL', 60 * 60),
+    live_ttl=settings.QUOTE_CACHE_TTLS['price'],
+)
+
+
+def get_history(ticker, start=None, end=None, adjusted=True):
+    return price_store.history(ticker, start, end, adjusted)
+
+
+def get_closes(tickers, start=None, end=None):
+    return price_store.closes(tickers, start, end)
@@ -0,0 +1,332 @@
+import hashlib
+import json
+import os
+import pickle
+import random
+import re
+import tempfile
+import threading
+import time
+import zlib
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+
+# Financial statements available from financials()
+STATEMENTS = ('financials', 'balance_sheet', 'cashflow')
+
+# Line items SyntheticProvider puts in each statement, the ones the financial views read
+STATEMENT_ITEMS = {
+    'financials': [
+        'Total Revenue', 'Operating Revenue', 'Cost Of Revenue', 'Gross Profit', 'Operating Income',
+        'Operating Expense', 'Research And Development', 'Selling General And Administration',
+        'Interest Expense', 'Interest Income', 'Net Income', 'EBIT', 'EBITDA',
+    ],
+    'balance_sheet': [
+        'Cash And Cash Equivalents', 'Other Short Term Investments',
+        'Cash Cash Equivalents And Short Term Investments', 'Receivables', 'Inventory',
+        'Other Current Assets', 'Current Assets', 'Properties', 'Machinery Furniture Equipment',
+        'Long Term Equity Investment', 'Other Intangible Assets', 'Total Assets', 'Accounts Payable',
+        'Current Debt', 'Other Current Liabilities', 'Current Liabilities', 'Long Term Debt',
+        'Other Non Current Liabilities', 'Total Non Current Liabilities Net Minority Interest',
+        'Total Liabilities Net Minority Interest', 'Common Stock', 'Retained Earnings', 'Total Equity',
+        'Gross Minority Interest', 'Total Debt', 'Net Debt',
+    ],
+    'cashflow': [
+        'Depreciation And Amortization', 'Operating Cash Flow', 'Net Other Investing Changes',
+        'Capital Expenditure', 'Investing Cash Flow', 'Common Stock Issuance', 'Cash Dividends Paid',
+        'Common Stock Dividend Paid', 'Financing Cash Flow', 'Changes In Cash', 'Free Cash Flow',
+    ],
+}
+
+
+class RecordingNotFound(LookupError):
+    pass
+
+
+def yfinance():
+    # Imported on the first live call, replay and synthetic data never need it
+    import yfinance
+    return yfinance
+
+
+class YFinanceProvider:
+    # Live Yahoo Finance. Every market data call in the app goes through one of
+    # these methods, so other providers only need to implement the same five.
+    name = 'yfinance'
+
+    def info(self, symbol):
+        return yfinance().Ticker(symbol).info
+
+    def history(self, symbol, start=None):
+        # Unadjusted daily bars plus 'Adj Close', with dividend and split actions
+        stock = yfinance().Ticker(symbol)
+        if start is None:
+            return stock.history(period='max', auto_adjust=False, actions=True)
+        return stock.history(start=start.strftime('%Y-%m-%d'), auto_adjust=False, actions=True)
+
+    def dividends(self, symbol):
+        return yfinance().Ticker(symbol).dividends
+
+    def financials(self, symbol, statement):
+        if statement not in STATEMENTS:
+            raise ValueError(f'Unknown statement {statement!r}, expected one of {", ".join(STATEMENTS)}')
+        return getattr(yfinance().Ticker(symbol), statement)
+
+    def download(self, symbols, **kwargs):
+        return yfinance().download(symbols, progress=False, **kwargs)
+
+
+def _normalize(arg):
+    # Symbols are matched case-insensitively, everything else has to be identical
+    if isinstance(arg, str):
+        return arg.upper()
+    if isinstance(arg, (list, tuple)):
+        return [_normalize(item) for item in arg]
+    return arg
+
+
+def recording_path(directory, method, args, kwargs):
+    args = [_normalize(arg) for arg in args]
+    payload = json.dumps([args, sorted(kwargs.items())], default=str)
+    digest = hashlib.sha256(payload.encode()).hexdigest()[:16]
+    label = re.sub(r'[^A-Za-z0-9.^=-]+', '_', str(args[0]) if args else '')[:40]
+    return os.path.join(directory, method, f'{label}-{digest}.pkl')
+
+
+class Latency:
+    # Stands in for the upstream round trip: waits `seconds` plus up to `jitter`
+    # more, seeded so a run is repeatable
+    def __init__(self, seconds=0.0, jitter=0.0, seed=0, sleep=time.sleep):
+        self.seconds = seconds
+        self.jitter = jitter
+        self.sleep = sleep
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            delay = self.seconds + (self._random.uniform(0, self.jitter) if self.jitter else 0)
+        if delay > 0:
+            self.sleep(delay)
+
+
+class RecordingProvider:
+    # Passes calls through to another provider and saves every response to disk
+    # for ReplayProvider. Recordings are pickles, only replay ones you made.
+
+    def __init__(self, provider, directory):
+        self.provider = provider
+        self.directory = directory
+        self.name = provider.name
+
+    def _call(self, method, *args, **kwargs):
+        result = getattr(self.provider, method)(*args, **kwargs)
+        path = recording_path(self.directory, method, args, kwargs)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(result, f)
+        os.replace(tmp_path, path)
+        return result
+
+    def info(self, symbol):
+        return self._call('info', symbol)
+
+    def history(self, symbol, start=None):
+        if start is None:
+            return self._call('history', symbol)
+        return self._call('history', symbol, start=start)
+
+    def dividends(self, symbol):
+        return self._call('dividends', symbol)
+
+    def financials(self, symbol, statement):
+        return self._call('financials', symbol, statement)
+
+    def download(self, symbols, **kwargs):
+        return self._call('download', symbols, **kwargs)
+
+
+class ReplayProvider:
+    # Serves responses saved by RecordingProvider without touching the network,
+    # each call waiting `latency` seconds plus up to `jitter` more
+    name = 'replay'
+
+    def __init__(self, directory, latency=0.0, jitter=0.0, seed=0, sleep=time.sleep):
+        self.directory = directory
+        self.latency = Latency(latency, jitter, seed, sleep)
+
+    def _load(self, method, *args, **kwargs):
+        path = recording_path(self.directory, method, args, kwargs)
+        if not os.path.exists(path):
+            raise RecordingNotFound(f'No recording of {method}{args} at {path}, record it with MARKET_DATA_PROVIDER=record')
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+
+    def _call(self, method, *args, **kwargs):
+        self.latency.wait()
+        return self._load(method, *args, **kwargs)
+
+    def info(self, symbol):
+        return self._call('info', symbol)
+
+    def history(self, symbol, start=None):
+        self.latency.wait()
+        if start is not None:
+            try:
+                return self._load('history', symbol, start=start)
+            except RecordingNotFound:
+                pass
+        frame = self._load('history', symbol)
+        if start is None:
+            return frame
+        # An incremental refresh asks for a tail that was never recorded, cut it
+        # from the full history instead
+        index = frame.index.tz_localize(None) if frame.index.tz is not None else frame.index
+        return frame[index >= pd.Timestamp(start).tz_localize(None).normalize()]
+
+    def dividends(self, symbol):
+        return self._call('dividends', symbol)
+
+    def financials(self, symbol, statement):
+        return self._call('financials', symbol, statement)
+
+    def download(self, symbols, **kwargs):
+        return self._call('download', symbols, **kwargs)
+
+
+class SyntheticProvider:
+    # Made up but stable market data for any symbol: a random walk seeded by the
+    # symbol with quarterly dividends, for benchmarks and load tests that need
+    # neither the network nor recordings. Latency is simulated like ReplayProvider.
+    name = 'synthetic'
+
+    def __init__(self, start='2010-01-04', latency=0.0, jitter=0.0, seed=0, sleep=time.sleep):
+        self.start = pd.Timestamp(start)
+        self.latency = Latency(latency, jitter, seed, sleep)
+
+    def _rng(self, symbol):
+        return np.random.default_rng(zlib.crc32(symbol.upper().encode()))
+
+    def _frame(self, symbol):
+        rng = self._rng(symbol)
+        index = pd.bdate_range(self.start, pd.Timestamp.now().normalize() - pd.Timedelta(days=1), tz='America/New_York', name='Date')
+        close = 20 + 180 * rng.random()
+        close = close * np.cumprod(1 + rng.normal(0.0003, 0.015, len(index)))
+        dividends = np.zeros(len(index))
+        dividends[::63] = np.round(close[::63] * 0.005, 2)  # Roughly quarterly, 2% a year
+        return pd.DataFrame({
+            'Open': close * (1 + rng.normal(0, 0.003, len(index))),
+            'High': close * 1.01,
+            'Low': close * 0.99,
+            'Close': close,
+            'Adj Close': close,
+            'Volume': rng.integers(100_000, 10_000_000, len(index)).astype(float),
+            'Dividends': dividends,
+            'Stock Splits': 0.0,
+        }, index=index)
+
+    def info(self, symbol):
+        self.latency.wait()
+        frame = self._frame(symbol)
+        rng = self._rng(symbol)
+        price = float(frame['Close'].iloc[-1])
+        dividend_rate = float(frame['Dividends'].iloc[-252:].sum())
+        return {
+            'symbol': symbol.upper(),
+            'longName': f'{symbol.upper()} Inc.',
+            'quoteType': 'EQUITY',
+            'exchange': 'NMS',
+            'country': 'United States',
+            'sector': 'Technology',
+            'industry': 'Software',
+            'website': 'https://example.com',
+            'longBusinessSummary': f'Synthetic company for {symbol.upper()}.',
+            'regularMarketOpen': float(frame['Open'].iloc[-1]),
+            'regularMarketPreviousClose': float(frame['Close'].iloc[-2]),
+            'marketCap': int(price * rng.integers(10_000_000, 10_000_000_000)),
+            'trailingPE': round(float(rng.uniform(5, 60)), 2),
+            'forwardPE': round(float(rng.uniform(5, 60)), 2),
+            'trailingEps': round(float(rng.uniform(0.5, 15)), 2),
+            'forwardEps': round(float(rng.uniform(0.5, 15)), 2),
+            'beta': round(float(rng.uniform(0.3, 2)), 2),
+            'dividendRate': dividend_rate,
+            'dividendYield': dividend_rate / price,
+            'trailingAnnualDividendRate': dividend_rate,
+            'trailingAnnualDividendYield': dividend_rate / price,
+            'targetMeanPrice': price * 1.1,
+            'targetHighPrice': price * 1.3,
+            'targetLowPrice': price * 0.8,
+        }
+
+    def history(self, symbol, start=None):
+        self.latency.wait()
+        frame = self._frame(symbol)
+        if start is None:
+            return frame
+        return frame[frame.index.tz_localize(None) >= pd.Timestamp(start).tz_localize(None).normalize()]
+
+    def dividends(self, symbol):
+        self.latency.wait()
+        dividends = self._frame(symbol)['Dividends']
+        return dividends[dividends > 0]
+
+    def financials(self, symbol, statement):
+        self.latency.wait()
+        rng = self._rng(symbol)
+        year = pd.Timestamp.now().year
+        dates = [pd.Timestamp(year=year - i, month=12, day=31) for i in range(1, 5)]
+        items = STATEMENT_ITEMS[statement]
+        return pd.DataFrame(rng.uniform(1e8, 1e11, (len(items), len(dates))), index=items, columns=dates)
+
+    def download(self, symbols, period='1y', **kwargs):
+        # Only what download_quotes asks for: daily bars for the last year, one column per symbol
+        self.latency.wait()
+        frames = {symbol: self._frame(symbol).iloc[-252:] for symbol in symbols}
+        data = pd.concat(frames, axis=1).swaplevel(axis=1).sort_index(axis=1)
+        data.index = data.index.tz_localize(None)
+        return data
+
+
+def provider_from_settings():
+    kind = getattr(settings, 'MARKET_DATA_PROVIDER', 'yfinance')
+    directory = getattr(settings, 'MARKET_DATA_RECORDINGS', os.path.join(settings.BASE_DIR, 'market_data', 'recordings'))
+    if kind == 'yfinance':
+        return YFinanceProvider()
+    if kind == 'record':
+        return RecordingProvider(YFinanceProvider(), directory)
+    if kind == 'replay':
+        return ReplayProvider(
+            directory,
+            latency=getattr(settings, 'MARKET_DATA_REPLAY_LATENCY', 0.0),
+            jitter=getattr(settings, 'MARKET_DATA_REPLAY_JITTER', 0.0),
+        )
+    if kind == 'synthetic':
+        return SyntheticProvider(
+            latency=getattr(settings, 'MARKET_DATA_REPLAY_LATENCY', 0.0),
+            jitter=getattr(settings, 'MARKET_DATA_REPLAY_JITTER', 0.0),
+        )
+    raise ValueError(f'Unknown MARKET_DATA_PROVIDER {kind!r}, expected yfinance, record, replay or synthetic')
+
+
+_provider = None
+_provider_lock = threading.Lock()
+
+
+def get_provider():
+    global _provider
+    with _provider_lock:
+        if _provider is None:
+            _provider = provider_from_settings()
+        return _provider
+
+
+def set_provider(provider):
+    # Swaps the provider for the whole process and returns the previous one,
+    # e.g. for benchmarks and tests
+    global _provider
+    with _provider_lock:
+        previous, _provider = _provider, provider
+    return previous
@@ -0,0 +1,261 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import pandas as pd
+from django.conf import settings
+
+from core.metrics import record_cache, upstream
+
+from .providers import get_provider
+
+# Fields that move with the market and go stale quickly. Anything not listed
+# here (company name, sector, business summary, ...) is treated as metadata.
+PRICE_FIELDS = {
+    'regularMarketOpen', 'regularMarketPreviousClose', 'regularMarketPrice',
+    'regularMarketDayHigh', 'regularMarketDayLow', 'regularMarketVolume',
+    'currentPrice', 'open', 'previousClose', 'dayHigh', 'dayLow', 'volume',
+    'bid', 'ask', 'marketCap', 'trailingPE', 'forwardPE', 'dividendYield',
+    'trailingAnnualDividendYield', 'SandP52WeekChange', '52WeekChange',
+}
+
+# Fields that only change on earnings or dividend announcements.
+FUNDAMENTAL_FIELDS = {
+    'trailingEps', 'forwardEps', 'earningsQuarterlyGrowth', 'revenueGrowth',
+    'grossMargins', 'ebitdaMargins', 'operatingMargins', 'targetMeanPrice',
+    'targetHighPrice', 'targetLowPrice', 'dividendRate', 'payoutRatio',
+    'trailingAnnualDividendRate', 'lastDividendValue', 'lastDividendDate', 'beta',
+}
+
+# Fields returned by the bulk quote API
+QUOTE_FIELDS = ['regularMarketOpen', 'trailingAnnualDividendRate']
+
+def download_quotes(symbols):
+    # One batched request for every symbol: a year of daily bars with dividend
+    # actions gives today's open and the trailing twelve month dividend rate.
+    data = get_provider().download(symbols, period='1y', actions=True, group_by='column', auto_adjust=False)
+    if not isinstance(data.columns, pd.MultiIndex):
+        data.columns = pd.MultiIndex.from_product([data.columns, symbols])
+
+    quotes = {symbol: dict.fromkeys(QUOTE_FIELDS) for symbol in symbols}
+    if data.empty or 'Open' not in data.columns.get_level_values(0):
+        return quotes
+
+    opens = data['Open'].ffill().iloc[-1]
+    if 'Dividends' in data.columns.get_level_values(0):
+        dividends = data['Dividends']
+        dividends = dividends[dividends.index > dividends.index[-1] - pd.Timedelta(days=365)]
+        rates = dividends.sum()
+    else:
+        rates = pd.Series(0.0, index=opens.index)
+
+    for symbol in symbols:
+        price = opens.get(symbol)
+        if price is not None and not pd.isna(price):
+            quotes[symbol]['regularMarketOpen'] = float(price)
+            quotes[symbol]['trailingAnnualDividendRate'] = float(rates.get(symbol, 0.0))
+    return quotes
+
+
+def field_group(field):
+    if field in PRICE_FIELDS:
+        return 'price'
+    if field in FUNDAMENTAL_FIELDS:
+        return 'fundamental'
+    return 'metadata'
+
+
+class QuoteCache:
+    def __init__(self, max_size, ttls, fetch=None, fetch_quotes=None):
+        # ttls maps each field group (price, fundamental, metadata) to seconds
+        self.max_size = max_size
+        self.ttls = dict(ttls)
+        self.fetch = fetch or (lambda symbol: get_provider().info(symbol))
+        self.fetch_quotes = fetch_quotes or download_quotes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        # Fetches under way, (kind, symbol) -> Future. Concurrent misses for the
+        # same symbol wait on the first caller's fetch instead of repeating it.
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def ttl(self, field):
+        return self.ttls[field_group(field)]
+
+    def _is_fresh(self, entry, fields, now):
+        # With no explicit fields the caller wants the whole info dict, so the
+        # shortest TTL applies.
+        if fields is None:
+            max_age = min(self.ttls.values())
+            return entry['full_at'] is not None and now - entry['full_at'] <= max_age
+        for field in fields:
+            stamp = entry['stamps'].get(field, entry['full_at'])
+            if stamp is None or now - stamp > self.ttl(field):
+                return False
+        return True
+
+    def get_info(self, symbol, fields=None):
+        key = symbol.upper()
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._is_fresh(entry, fields, now):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                info = dict(entry['info'])
+            else:
+                info = None
+                future, owner = self._claim(('info', key))
+                # Waiting on another caller's fetch doesn't go to the provider
+                if owner:
+                    self.misses += 1
+                else:
+                    self.hits += 1
+        if info is not None:
+            record_cache('quotes', hits=1)
+            return info
+        if not owner:
+            record_cache('quotes', hits=1)
+            return dict(future.result())
+        record_cache('quotes', misses=1)
+
+        # Fetch outside the lock so one slow ticker doesn't block the others
+        try:
+            with upstream(get_provider().name):
+                info = self.fetch(symbol)
+            if info:
+                self.put(key, info, full=True)
+        except Exception as e:
+            self._release({('info', key): future}, error=e)
+            raise
+        self._release({('info', key): future}, {('info', key): info})
+        return dict(info)
+
+    def get_quotes(self, symbols):
+        symbols = list(dict.fromkeys(symbol.upper() for symbol in symbols))
+        now = time.monotonic()
+        quotes = {}
+        owned = {}
+        waiting = {}
+        with self._lock:
+            for symbol in symbols:
+                entry = self._entries.get(symbol)
+                if entry is not None and self._is_fresh(entry, QUOTE_FIELDS, now):
+                    self._entries.move_to_end(symbol)
+                    self.hits += 1
+                    quotes[symbol] = {field: entry['info'].get(field) for field in QUOTE_FIELDS}
+                else:
+                    future, owner = self._claim(('quote', symbol))
+                    (owned if owner else waiting)[symbol] = future
+            self.hits += len(waiting)
+            self.misses += len(owned)
+        record_cache('quotes', hits=len(quotes) + len(waiting), misses=len(owned))
+
+        # Fetch what nobody else is fetching before waiting on the rest, so two
+        # callers waiting on each other's symbols can't block each other
+        if owned:
+            futures = {('quote', symbol): future for symbol, future in owned.items()}
+            try:
+                with upstream(get_provider().name):
+                    fetched = self.fetch_quotes(list(owned))
+                self._store_quotes(fetched)
+            except Exception as e:
+                self._release(futures, error=e)
+                raise
+            results = {('quote', symbol): fetched.get(symbol, dict.fromkeys(QUOTE_FIELDS)) for symbol in owned}
+            self._release(futures, results)
+            quotes.update({symbol: results['quote', symbol] for symbol in owned})
+        for symbol, future in waiting.items():
+            quotes[symbol] = future.result()
+
+        frame = pd.DataFrame.from_dict(quotes, orient='index', columns=QUOTE_FIELDS)
+        return frame.reindex(symbols).astype(float)
+
+    def _claim(self, key):
+        # Called with the lock held. Returns the fetch to wait on and whether
+        # the caller is the one who has to run it.
+        future = self._inflight.get(key)
+        if future is not None:
+            return future, False
+        future = self._inflight[key] = Future()
+        return future, True
+
+    def _release(self, futures, results=None, error=None):
+        # Entries are stored before the fetch is released, so later callers find them
+        with self._lock:
+            for key in futures:
+                self._inflight.pop(key, None)
+        for key, future in futures.items():
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(results[key])
+
+    def _store_quotes(self, fetched):
+        # A quote without a price is a failed fetch, it isn't cached for the price TTL
+        for symbol, quote in fetched.items():
+            if quote.get('regularMarketOpen') is not None:
+                self.put(symbol, quote)
+
+    def refresh_quotes(self, symbols):
+        # Fetches the bulk quote fields whether or not they are still fresh, so the
+        # background refresher can renew them before requests find them stale
+        symbols = list(dict.fromkeys(symbol.upper() for symbol in symbols))
+        with upstream(get_provider().name):
+            fetched = self.fetch_quotes(symbols)
+        self._store_quotes(fetched)
+        return fetched
+
+    def put(self, symbol, info, full=False):
+        key = symbol.upper()
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or full:
+                entry = {'info': {}, 'stamps': {}, 'full_at': None}
+                self._entries[key] = entry
+            entry['info'].update(info)
+            entry['stamps'].update(dict.fromkeys(info, now))
+            if full:
+                entry['full_at'] = now
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, symbol=None):
+        with self._lock:
+            if symbol is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(symbol.upper(), None)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_ratio': round(self.hits / lookups, 3) if lookups else 0,
+            }
+
+
+quote_cache = QuoteCache(
+    max_size=settings.QUOTE_CACHE_MAX_SIZE,
+    ttls=settings.QUOTE_CACHE_TTLS,
+)
+
+
+def get_info(symbol, fields=None):
+    return quote_cache.get_info(symbol, fields)
+
+
+def get_quotes(symbols):
+    # Returns a DataFrame indexed by upper-cased symbol with QUOTE_FIELDS columns
+    return quote_cache.get_quotes(symbols)
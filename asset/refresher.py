@@ -0,0 +1,146 @@
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection
+
+from .dividend_store import dividend_store
+from .price_store import price_store
+from .quote_cache import quote_cache
+
+logger = logging.getLogger(__name__)
+
+# Not held by anyone but read by the S&P 500 metrics on every dashboard
+BENCHMARK_TICKERS = ('^GSPC',)
+
+
+def held_tickers():
+    # Every ticker held in any portfolio, upper-cased like the caches key them
+    from portfolio.models import Asset
+
+    tickers = Asset.objects.values_list('ticker', flat=True).distinct()
+    return sorted({ticker.upper() for ticker in tickers if ticker})
+
+
+def refresh_quotes(tickers, batch_size=100):
+    # A few bulk downloads instead of one request per ticker. Returns how many
+    # tickers were refreshed, a failed batch is logged and skipped.
+    refreshed = 0
+    for i in range(0, len(tickers), batch_size):
+        batch = tickers[i:i + batch_size]
+        try:
+            quote_cache.refresh_quotes(batch)
+        except Exception:
+            logger.exception('Refreshing quotes for %d tickers failed', len(batch))
+            continue
+        refreshed += len(batch)
+    return refreshed
+
+
+def refresh_history(tickers):
+    # Appends the sessions missing from the price store, which also carries the
+    # dividends, then warms the dividend events read from it
+    refreshed = 0
+    for ticker in tickers:
+        try:
+            price_store.refresh(ticker, force=True)
+            dividend_store.dividends(ticker)
+        except Exception:
+            logger.exception('Refreshing history for %s failed', ticker)
+            continue
+        refreshed += 1
+    return refreshed
+
+
+class Refresher:
+    # Renews quotes every quotes_every seconds and history and dividends every
+    # history_every seconds (None turns either off) on a daemon thread, so
+    # request handlers read warm caches instead of waiting on Yahoo.
+
+    def __init__(self, quotes_every, history_every, batch_size, max_quotes, tickers=held_tickers):
+        self.quotes_every = quotes_every
+        self.history_every = history_every
+        self.batch_size = batch_size
+        self.max_quotes = max_quotes
+        self.tickers = tickers
+        self.quotes_at = None
+        self.history_at = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def due(self, last, every, now):
+        return every is not None and (last is None or now - last >= every)
+
+    def run_once(self):
+        now = time.monotonic()
+        quotes_due = self.due(self.quotes_at, self.quotes_every, now)
+        history_due = self.due(self.history_at, self.history_every, now)
+        if not quotes_due and not history_due:
+            return
+
+        try:
+            tickers = [*BENCHMARK_TICKERS, *self.tickers()]
+        finally:
+            connection.close()  # This thread's connection, idle until the next cycle
+        if quotes_due:
+            self.quotes_at = now
+            # More than the cache holds would evict the quotes refreshed first
+            quoted = tickers[:self.max_quotes]
+            if len(quoted) < len(tickers):
+                logger.warning('Refreshing quotes for %d of %d tickers, the quote cache holds no more', len(quoted), len(tickers))
+            started = time.perf_counter()
+            refreshed = refresh_quotes(quoted, self.batch_size)
+            logger.info('Refreshed quotes for %d/%d tickers in %.1fs', refreshed, len(quoted), time.perf_counter() - started)
+        if history_due:
+            self.history_at = now
+            started = time.perf_counter()
+            refreshed = refresh_history(tickers)
+            logger.info('Refreshed history for %d/%d tickers in %.1fs', refreshed, len(tickers), time.perf_counter() - started)
+
+    def sleep_for(self):
+        # Until the next refresh is due
+        now = time.monotonic()
+        waits = [
+            last + every - now
+            for last, every in ((self.quotes_at, self.quotes_every), (self.history_at, self.history_every))
+            if every is not None and last is not None
+        ]
+        return max(min(waits, default=60), 1)
+
+    def run(self):
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception:
+                logger.exception('Market data refresh failed')
+            self._stop.wait(self.sleep_for())
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._stop.clear()
+                self._thread = threading.Thread(target=self.run, name='market-data-refresher', daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        with self._lock:
+            self._stop.set()
+            if self._thread is not None:
+                self._thread.join()
+                self._thread = None
+
+
+refresher = Refresher(
+    quotes_every=settings.MARKET_DATA_REFRESH_QUOTES_EVERY,
+    history_every=settings.MARKET_DATA_REFRESH_HISTORY_EVERY if settings.MARKET_DATA_REFRESHER_HISTORY else None,
+    batch_size=settings.MARKET_DATA_REFRESH_BATCH_SIZE,
+    max_quotes=settings.QUOTE_CACHE_MAX_SIZE,
+)
+
+
+def start_refresher(**kwargs):
+    # request_started receiver (see portfolio/apps.py): each worker process starts
+    # its own refresher on its first request, management commands never do
+    refresher.start()
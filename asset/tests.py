@@ -1,3 +1,260 @@
-from django.test import TestCase
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+import pandas as pd
+from django.test import SimpleTestCase
+
+from .price_store import COLUMNS, PriceStore
+from .quote_cache import QUOTE_FIELDS, QuoteCache
+from .refresher import Refresher
+
+
+def bars(dates, close=187.32, dividends=None):
+    index = pd.DatetimeIndex(dates, name='Date')
+    frame = pd.DataFrame({column: close for column in COLUMNS}, index=index)
+    frame['Volume'] = 1000
+    frame['Dividends'] = dividends or 0.0
+    frame['Stock Splits'] = 0.0
+    return frame
+
+
+class PriceStoreTests(SimpleTestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.calls = []
+        self.frames = {None: bars(['2024-01-02', '2024-01-03'])}
+
+        def fetch(ticker, start=None):
+            self.calls.append(start)
+            return self.frames[start]
+
+        self.store = PriceStore(self.root, fetch=fetch)
+        # A Saturday, so reads don't look for a live session unless a test moves it
+        self.today = mock.patch('asset.price_store.today', return_value=np.datetime64('2024-01-06'))
+        self.today.start()
+        self.addCleanup(self.today.stop)
+
+    def test_prices_come_back_exactly(self):
+        history = self.store.history('AAPL', adjusted=False)
+        self.assertEqual(history['Close'].tolist(), [187.32, 187.32])
+
+    def test_refresh_only_fetches_the_missing_tail(self):
+        self.store.history('AAPL')
+        self.frames[pd.Timestamp('2024-01-04')] = bars(['2024-01-04'], close=190.5)
+
+        self.store.refresh('AAPL', force=True)
+        self.assertEqual(self.calls, [None, pd.Timestamp('2024-01-04')])
+        self.assertEqual(self.store.history('AAPL')['Close'].tolist(), [187.32, 187.32, 190.5])
+
+    def test_fresh_store_is_not_refetched(self):
+        self.store.history('AAPL')
+        self.store.history('AAPL')
+        self.assertEqual(self.calls, [None])
+
+    def test_new_dividend_refetches_the_whole_history(self):
+        self.store.history('AAPL')
+        self.frames[pd.Timestamp('2024-01-04')] = bars(['2024-01-04'], dividends=0.24)
+        self.frames[None] = bars(['2024-01-02', '2024-01-03', '2024-01-04'], close=186.0)
+
+        self.store.refresh('AAPL', force=True)
+        self.assertEqual(self.calls, [None, pd.Timestamp('2024-01-04'), None])
+        self.assertEqual(self.store.history('AAPL')['Close'].tolist(), [186.0] * 3)
+
+    def test_files_in_the_old_float32_layout_are_fetched_again(self):
+        dtype = np.dtype([('Date', 'datetime64[D]')] + [(column, np.float32) for column in COLUMNS])
+        old = np.zeros(1, dtype=dtype)
+        old['Date'] = np.datetime64('2024-01-02')
+        np.save(self.store.path('AAPL'), old)
+
+        self.assertEqual(self.store.history('AAPL')['Close'].tolist(), [187.32, 187.32])
+        self.assertEqual(self.calls, [None])
+
+    def test_todays_session_is_served_but_not_stored(self):
+        self.today.stop()
+        with mock.patch('asset.price_store.today', return_value=np.datetime64('2024-01-03')):
+            history = self.store.history('AAPL')
+        self.assertEqual(history.index.strftime('%Y-%m-%d').tolist(), ['2024-01-02', '2024-01-03'])
+        self.assertEqual(self.store.load('AAPL')['Date'].tolist(), [np.datetime64('2024-01-02')])
+        self.today.start()
+
+    def test_live_session_is_refetched_after_its_ttl(self):
+        self.today.stop()
+        self.store.live_ttl = 0
+        self.frames[None] = bars(['2024-01-02'])
+        self.frames[pd.Timestamp('2024-01-03')] = bars(['2024-01-03'], close=190.5)
+        with mock.patch('asset.price_store.today', return_value=np.datetime64('2024-01-03')):
+            self.store.history('AAPL')
+            self.frames[pd.Timestamp('2024-01-03')] = bars(['2024-01-03'], close=191.0)
+            history = self.store.history('AAPL')
+        self.assertEqual(history['Close'].tolist(), [187.32, 191.0])
+        self.assertEqual(self.calls, [None, pd.Timestamp('2024-01-03'), pd.Timestamp('2024-01-03')])
+        self.today.start()
+
+
+class QuoteCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.fetched = []
+        self.quoted = []
+        self.cache = QuoteCache(
+            max_size=2,
+            ttls={'price': 60, 'fundamental': 3600, 'metadata': 86400},
+            fetch=lambda symbol: self.fetched.append(symbol) or {'regularMarketOpen': 10.0, 'beta': 1.2, 'longName': symbol},
+            fetch_quotes=lambda symbols: self.quoted.append(symbols) or {
+                symbol: {'regularMarketOpen': 10.0, 'trailingAnnualDividendRate': 0.5} for symbol in symbols
+            },
+        )
+        patcher = mock.patch('asset.quote_cache.time.monotonic', return_value=1000)
+        self.now = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_each_field_group_expires_after_its_own_ttl(self):
+        self.cache.get_info('AAPL')
+        self.now.return_value = 1000 + 61
+        self.cache.get_info('aapl', ['beta', 'longName'])
+        self.assertEqual(self.fetched, ['AAPL'])
+
+        self.cache.get_info('AAPL', ['regularMarketOpen'])
+        self.assertEqual(self.fetched, ['AAPL', 'AAPL'])
+
+    def test_whole_info_dict_uses_the_shortest_ttl(self):
+        self.cache.get_info('AAPL')
+        self.now.return_value = 1000 + 60
+        self.cache.get_info('AAPL')
+        self.now.return_value = 1000 + 61
+        self.cache.get_info('AAPL')
+        self.assertEqual(self.fetched, ['AAPL', 'AAPL'])
+
+    def test_least_recently_used_symbol_is_evicted(self):
+        self.cache.get_info('AAPL')
+        self.cache.get_info('MSFT')
+        self.cache.get_info('AAPL')  # MSFT is now the oldest
+        self.cache.get_info('TSLA')
+
+        self.assertEqual(self.cache.stats()['evictions'], 1)
+        self.cache.get_info('AAPL')
+        self.cache.get_info('MSFT')
+        self.assertEqual(self.fetched, ['AAPL', 'MSFT', 'TSLA', 'MSFT'])
+
+    def test_bulk_quotes_only_fetch_missing_symbols(self):
+        self.cache.get_quotes(['AAPL'])
+        quotes = self.cache.get_quotes(['aapl', 'MSFT'])
+
+        self.assertEqual(self.quoted, [['AAPL'], ['MSFT']])
+        self.assertEqual(list(quotes.index), ['AAPL', 'MSFT'])
+        self.assertEqual(quotes.loc['MSFT', 'trailingAnnualDividendRate'], 0.5)
+
+    def test_quotes_without_a_price_are_not_cached(self):
+        self.cache.fetch_quotes = lambda symbols: self.quoted.append(symbols) or {symbol: dict.fromkeys(QUOTE_FIELDS) for symbol in symbols}
+        self.assertTrue(self.cache.get_quotes(['AAPL']).isna().all(axis=None))
+        self.cache.get_quotes(['AAPL'])
+        self.assertEqual(self.quoted, [['AAPL'], ['AAPL']])
+
+    def test_concurrent_misses_fetch_once(self):
+        fetch = self.cache.fetch
+        release = threading.Event()
+        self.cache.fetch = lambda symbol: release.wait(5) and fetch(symbol)
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            futures = [pool.submit(self.cache.get_info, 'AAPL') for _ in range(4)]
+            time.sleep(0.1)
+            release.set()
+            results = [future.result() for future in futures]
+
+        self.assertEqual(self.fetched, ['AAPL'])
+        self.assertEqual({result['longName'] for result in results}, {'AAPL'})
+        self.assertEqual((self.cache.stats()['misses'], self.cache.stats()['hits']), (1, 3))
+
+    def test_concurrent_bulk_misses_fetch_each_symbol_once(self):
+        fetch_quotes = self.cache.fetch_quotes
+        release = threading.Event()
+        self.cache.fetch_quotes = lambda symbols: release.wait(5) and fetch_quotes(symbols)
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            futures = [pool.submit(self.cache.get_quotes, ['AAPL', 'MSFT']) for _ in range(4)]
+            time.sleep(0.1)
+            release.set()
+            frames = [future.result() for future in futures]
+
+        self.assertEqual(sorted(symbol for symbols in self.quoted for symbol in symbols), ['AAPL', 'MSFT'])
+        for frame in frames:
+            self.assertEqual(frame['regularMarketOpen'].tolist(), [10.0, 10.0])
+
+    def test_waiters_get_the_fetch_error_and_the_next_call_retries(self):
+        release = threading.Event()
+
+        def failing(symbol):
+            release.wait(5)
+            self.fetched.append(symbol)
+            raise ConnectionError('Yahoo is down')
+
+        fetch = self.cache.fetch
+        self.cache.fetch = failing
+        with ThreadPoolExecutor(max_workers=3) as pool:
+            futures = [pool.submit(self.cache.get_info, 'AAPL') for _ in range(3)]
+            time.sleep(0.1)
+            release.set()
+            for future in futures:
+                self.assertRaises(ConnectionError, future.result)
+        self.assertEqual(self.fetched, ['AAPL'])
+
+        self.cache.fetch = fetch
+        self.assertEqual(self.cache.get_info('AAPL')['longName'], 'AAPL')
+
+
+class RefresherTests(SimpleTestCase):
+    def setUp(self):
+        self.refresher = Refresher(quotes_every=45, history_every=1800, batch_size=2, max_quotes=3, tickers=lambda: ['AAPL', 'MSFT'])
+        self.quoted = []
+        self.histories = []
+        patchers = [
+            mock.patch('asset.refresher.time.monotonic', return_value=1000),
+            mock.patch('asset.refresher.refresh_quotes', side_effect=lambda tickers, batch_size: self.quoted.append(tickers) or len(tickers)),
+            mock.patch('asset.refresher.refresh_history', side_effect=lambda tickers: self.histories.append(tickers) or len(tickers)),
+        ]
+        self.now = patchers[0].start()
+        for patcher in patchers[1:]:
+            patcher.start()
+        for patcher in patchers:
+            self.addCleanup(patcher.stop)
+
+    def test_due(self):
+        self.assertTrue(self.refresher.due(None, 45, 1000))
+        self.assertFalse(self.refresher.due(980, 45, 1000))
+        self.assertTrue(self.refresher.due(955, 45, 1000))
+        self.assertFalse(self.refresher.due(None, None, 1000))
+
+    def test_run_once_only_refreshes_what_is_due(self):
+        self.refresher.run_once()
+        self.assertEqual(self.quoted, [['^GSPC', 'AAPL', 'MSFT']])
+        self.assertEqual(self.histories, [['^GSPC', 'AAPL', 'MSFT']])
+
+        self.now.return_value = 1000 + 45
+        self.refresher.run_once()
+        self.assertEqual(len(self.quoted), 2)
+        self.assertEqual(len(self.histories), 1)
+
+    def test_sleep_for_waits_until_the_next_refresh(self):
+        self.assertEqual(self.refresher.sleep_for(), 60)  # Nothing ran yet
+        self.refresher.run_once()
+        self.now.return_value = 1000 + 30
+        self.assertEqual(self.refresher.sleep_for(), 15)
+        self.now.return_value = 1000 + 45
+        self.assertEqual(self.refresher.sleep_for(), 1)
+
+    def test_history_can_be_left_to_the_management_command(self):
+        self.refresher.history_every = None
+        self.refresher.run_once()
+        self.assertEqual(self.histories, [])
+        self.now.return_value = 1000 + 40
+        self.assertEqual(self.refresher.sleep_for(), 5)
+
+    def test_quotes_are_capped_at_the_cache_size(self):
+        self.refresher.tickers = lambda: ['AAPL', 'MSFT', 'TSLA', 'NVDA']
+        with self.assertLogs('asset.refresher', 'WARNING'):
+            self.refresher.run_once()
+        self.assertEqual(self.quoted, [['^GSPC', 'AAPL', 'MSFT']])
+        self.assertEqual(len(self.histories[0]), 5)
@@ -1,8 +1,9 @@
 from django.urls import path
-from .views import StockDataView, DividendData,DividendSummary, DividendYield, IncomeStatement, BalanceSheet, CashFlow ,PriceHistory, AssetSummary, AssetNews, LogoImage
+from .views import StockDataView, AsyncStockDataView, DividendData,DividendSummary, DividendYield, IncomeStatement, BalanceSheet, CashFlow ,PriceHistory, AssetSummary, AssetNews, LogoImage
 
 urlpatterns = [
     path('asset/', StockDataView.as_view()),
+    path('asset/async/', AsyncStockDataView.as_view()),
     path('asset/price-history/', PriceHistory.as_view()),
     path('asset/summary/', AssetSummary.as_view()),
     path('asset/news/', AssetNews.as_view()),
@@ -1,37 +1,56 @@
 import pandas as pd
-import yfinance as yf
-import requests
+from core import http_client
 from django.http import HttpResponseServerError, JsonResponse, HttpResponseBadRequest
 from django.views import View
 import os
 import math
 import numpy as np
 from dotenv import load_dotenv
+from .quote_cache import get_info
+from .price_store import get_history
+from .dividend_store import get_dividends
+from .async_client import market_data
+from .providers import get_provider
+from core.metrics import upstream
 
 load_dotenv()
 
+def stock_data(info):
+    return {
+        'company_name': info.get('longName'),
+        'price': f"{info.get('regularMarketOpen'):.2f}",
+        'previous_close': f"{info.get('regularMarketPreviousClose'):.2f}",
+        'ticker': info.get('symbol'),
+        'country': info.get('country'),
+        'sector': info.get('sector'),
+        'website': info.get('website'),
+        'about': info.get('longBusinessSummary'),
+        'trailingPE': info.get('trailingPE'),
+        'trailingEps': info.get('trailingEps'),
+        'dividendYield': info.get('dividendYield'),
+        'marketCap': info.get('marketCap'),
+        'quoteType': info.get('quoteType'),
+    }
+
+
 class StockDataView(View):
     def get(self, request, *args, **kwargs):
         symbol = request.GET.get('symbol')
         if symbol is None:
             return HttpResponseBadRequest("The 'symbol' parameter is required.")
-        stock = yf.Ticker(symbol)
-        info = stock.info
-        data = {
-            'company_name': info.get('longName'),
-            'price': f"{info.get('regularMarketOpen'):.2f}",
-            'previous_close': f"{info.get('regularMarketPreviousClose'):.2f}",
-            'ticker': info.get('symbol'),
-            'country': info.get('country'),
-            'sector': info.get('sector'),
-            'website': info.get('website'),
-            'about': info.get('longBusinessSummary'),
-            'trailingPE': info.get('trailingPE'),
-            'trailingEps': info.get('trailingEps'),
-            'dividendYield': info.get('dividendYield'),
-            'marketCap': info.get('marketCap'),
-            'quoteType': info.get('quoteType'),
-        }
+        data = stock_data(get_info(symbol))
+        response = JsonResponse(data)  # Create the JsonResponse
+        response["Access-Control-Allow-Origin"] = "*"  # Add the header to the response
+        return response
+
+
+class AsyncStockDataView(View):
+    # Same response as StockDataView, the upstream fetch doesn't hold a worker under ASGI
+    async def get(self, request, *args, **kwargs):
+        symbol = request.GET.get('symbol')
+        if symbol is None:
+            return HttpResponseBadRequest("The 'symbol' parameter is required.")
+        data = stock_data(await market_data.get_info(symbol))
         response = JsonResponse(data)  # Create the JsonResponse
         response["Access-Control-Allow-Origin"] = "*"  # Add the header to the response
         return response
@@ -42,10 +61,9 @@ class DividendData(View):
         symbol = request.GET.get('symbol')
         if symbol is None:
             return HttpResponseBadRequest("The 'symbol' parameter is required.")
-        stock = yf.Ticker(symbol)
-        data = stock.dividends  # Fetch stock dividends
+        data = get_dividends(symbol)  # Read stock dividends from the local dividend store
 
-        data.index = [date.isoformat() for date in data.index.to_pydatetime()]
+        data.index = data.index.strftime('%Y-%m-%d')  # Convert Timestamp to string
 
         data_dict = {date: f"{value:.3f}" for date, value in data.items()}  # Convert the values to strings with 3 decimal places 
 
@@ -54,20 +72,21 @@ class DividendData(View):
         return response
     
 class DividendSummary(View):
+    fields = [
+        'dividendRate',
+        'dividendYield',
+        'payoutRatio',
+        'trailingAnnualDividendRate',
+        'trailingAnnualDividendYield',
+        'lastDividendValue',
+    ]
+
     def get(self, request, *args, **kwargs):
         symbol = request.GET.get('symbol')
         if symbol is None:
             return HttpResponseBadRequest("The 'symbol' parameter is required.")
-        stock = yf.Ticker(symbol)
-        info = stock.info
-        data = {
-            'dividendRate': info.get('dividendRate'),
-            'dividendYield': info.get('dividendYield'),
-            'payoutRatio': info.get('payoutRatio'),
-            'trailingAnnualDividendRate': info.get('trailingAnnualDividendRate'),
-            'trailingAnnualDividendYield': info.get('trailingAnnualDividendYield'),
-            'lastDividendValue': info.get('lastDividendValue'),
-        }
+        info = get_info(symbol, self.fields)
+        data = {field: info.get(field) for field in self.fields}
         response = JsonResponse(data)  # Create the JsonResponse
         response["Access-Control-Allow-Origin"] = "*"  # Add the header to the response
         return response
@@ -78,12 +97,10 @@ class DividendYield(View):
         symbol = request.GET.get('symbol')
         if symbol is None:
             return HttpResponseBadRequest("The 'symbol' parameter is required.")
-        stock = yf.Ticker(symbol)
-
-        data = stock.history(period='max')  # Fetch stock dividends
-        data = data[data['Dividends'] > 0]
+        dividends = get_dividends(symbol)  # Read stock dividends from the local dividend store
+        closes = get_history(symbol)['Close']  # Closing prices on each ex-dividend date
+        data = pd.DataFrame({'Close': closes.reindex(dividends.index), 'Dividends': dividends})
         data.reset_index(inplace=True)
-        data = data[['Date', 'Close', 'Dividends']]
         data['Yield'] = (data['Dividends'] / data['Close'] * 100).round(2)  # Calculate dividend yield
         data = data.drop(['Close', 'Dividends'], axis=1) # Drop unnecessary columns
 
@@ -99,8 +116,9 @@ class IncomeStatement(View):
         if symbol is None:
             return HttpResponseBadRequest("The 'symbol' parameter is required.")
         # Fetch the data
-        stock = yf.Ticker(symbol)
-        data = stock.financials
+        provider = get_provider()
+        with upstream(provider.name):
+            data = provider.financials(symbol, 'financials')
 
         # Extract the metrics we want
         selected_rows = data.loc[[
@@ -147,8 +165,9 @@ class BalanceSheet(View):
         if symbol is None:
             return HttpResponseBadRequest("The 'symbol' parameter is required.")
         # Fetch the data
-        stock = yf.Ticker(symbol)
-        data = stock.balance_sheet
+        provider = get_provider()
+        with upstream(provider.name):
+            data = provider.financials(symbol, 'balance_sheet')
 
         # Define the keys
         keys = [
@@ -204,8 +223,9 @@ class CashFlow(View):
         if symbol is None:
             return HttpResponseBadRequest("The 'symbol' parameter is required.")
         # Fetch the data
-        stock = yf.Ticker(symbol)
-        data = stock.cashflow
+        provider = get_provider()
+        with upstream(provider.name):
+            data = provider.financials(symbol, 'cashflow')
 
         # Extract the metrics we want
         keys = [
@@ -252,8 +272,7 @@ class PriceHistory(View):
         symbol = request.GET.get('symbol')
         if symbol is None:
             return HttpResponseBadRequest("The 'symbol' parameter is required.")
-        stock = yf.Ticker(symbol)
-        data = stock.history(period='max')  # Fetch Price History
+        data = get_history(symbol)  # Read the full price history from the local store
         data = data[['Close']]  # Only want to keep the closing price information
         data.index = data.index.strftime('%Y-%m-%d')  # Convert Timestamp to string
 
@@ -263,40 +282,41 @@ class PriceHistory(View):
 
 
 class AssetSummary(View):
+    fields = [
+        'trailingPE',
+        'forwardPE',
+        'trailingEps',
+        'forwardEps',
+        'earningsQuarterlyGrowth',
+        'revenueGrowth',
+        'grossMargins',
+        'ebitdaMargins',
+        'operatingMargins',
+        'targetMeanPrice',
+        'targetHighPrice',
+        'targetLowPrice',
+        'SandP52WeekChange',
+        'dividendRate',
+        'dividendYield',
+        'payoutRatio',
+        'trailingAnnualDividendRate',
+        'trailingAnnualDividendYield',
+        'lastDividendValue',
+        'lastDividendDate',
+        'beta',
+        'auditRisk',
+        'boardRisk',
+        'compensationRisk',
+        'shareHolderRightsRisk',
+        'overallRisk',
+    ]
+
     def get(self, request, *args, **kwargs):
         symbol = request.GET.get('symbol')
         if symbol is None:
             return HttpResponseBadRequest("The 'symbol' parameter is required.")
-        stock = yf.Ticker(symbol)
-        info = stock.info
-        data = {
-            'trailingPE': info.get('trailingPE'),
-            'forwardPE': info.get('forwardPE'),
-            'trailingEps': info.get('trailingEps'),
-            'forwardEps': info.get('forwardEps'),
-            'earningsQuarterlyGrowth': info.get('earningsQuarterlyGrowth'),
-            'revenueGrowth': info.get('revenueGrowth'),
-            'grossMargins': info.get('grossMargins'),
-            'ebitdaMargins': info.get('ebitdaMargins'),
-            'operatingMargins': info.get('operatingMargins'),
-            'targetMeanPrice': info.get('targetMeanPrice'),
-            'targetHighPrice': info.get('targetHighPrice'),
-            'targetLowPrice': info.get('targetLowPrice'),
-            'SandP52WeekChange': info.get('SandP52WeekChange'),
-            'dividendRate': info.get('dividendRate'),
-            'dividendYield': info.get('dividendYield'),
-            'payoutRatio': info.get('payoutRatio'),
-            'trailingAnnualDividendRate': info.get('trailingAnnualDividendRate'),
-            'trailingAnnualDividendYield': info.get('trailingAnnualDividendYield'),
-            'lastDividendValue': info.get('lastDividendValue'),
-            'lastDividendDate': info.get('lastDividendDate'),
-            'beta': info.get('beta'),
-            'auditRisk': info.get('auditRisk'),
-            'boardRisk': info.get('boardRisk'),
-            'compensationRisk': info.get('compensationRisk'),
-            'shareHolderRightsRisk': info.get('shareHolderRightsRisk'),
-            'overallRisk': info.get('overallRisk')
-        }
+        info = get_info(symbol, self.fields)
+        data = {field: info.get(field) for field in self.fields}
         response = JsonResponse(data)  # Create the JsonResponse
         response["Access-Control-Allow-Origin"] = "*"  # Add the header to the response
         return response
@@ -312,7 +332,7 @@ class AssetNews(View):
         if api_key is None:
             return HttpResponseServerError("NEWS_API_KEY is not set.")
 
-        response = requests.get('https://api.marketaux.com/v1/news/all', params={'symbols': symbol, 'language': 'en', "api_token": api_key, "filter_entities":"true"})
+        response = http_client.get('marketaux', 'https://api.marketaux.com/v1/news/all', params={'symbols': symbol, 'language': 'en', "api_token": api_key, "filter_entities":"true"})
         if response.status_code == 200:
             data = response.json()
             response = JsonResponse(data)  # Create the JsonResponse
@@ -333,7 +353,7 @@ class LogoImage(View):
             return HttpResponseServerError("LOGO_API_KEY is not set.")
 
         headers = {'x-api-key': api_key}
-        response = requests.get('https://api.api-ninjas.com/v1/logo', params={'ticker': symbol}, headers=headers)
+        response = http_client.get('api_ninjas', 'https://api.api-ninjas.com/v1/logo', params={'ticker': symbol}, headers=headers)
         if response.status_code == 200:
             data = response.json()
             response = JsonResponse(data, safe=False)  # Create the JsonResponse
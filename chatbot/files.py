@@ -0,0 +1,68 @@
+import os
+
+from django.db import transaction
+from django.db.models import Max
+
+from core.metrics import upstream
+
+from .models import OpenAIFile
+
+# Superseded files deleted from OpenAI per garbage collection pass
+GC_BATCH_SIZE = 20
+
+
+def sync_portfolio_file(client, assistant_id, pid, file_path, content_hash):
+    # Makes the assistant use the portfolio's context file, only calling OpenAI
+    # for what actually changed. Returns (openai_file, uploaded, attached).
+    openai_file = OpenAIFile.objects.filter(content_hash=content_hash).order_by('-id').first()
+    uploaded = openai_file is None
+    if uploaded:
+        with open(file_path, 'rb') as f, upstream('openai'):
+            file = client.files.create(file=f, purpose="assistants")
+        openai_file = OpenAIFile.objects.create(
+            file_id=file.id,
+            portfolio_id=pid,
+            content_hash=content_hash,
+            size=os.path.getsize(file_path),
+        )
+
+    attached = not openai_file.attached
+    if attached:
+        with upstream('openai'):
+            client.beta.assistants.update(assistant_id, file_ids=[openai_file.file_id])
+        with transaction.atomic():
+            OpenAIFile.objects.filter(attached=True).update(attached=False)
+            OpenAIFile.objects.filter(id=openai_file.id).update(attached=True)
+        openai_file.attached = True
+    return openai_file, uploaded, attached
+
+
+def superseded_files():
+    # Everything except the attached file and the newest upload of each portfolio,
+    # which is kept so switching back to a portfolio doesn't need a new upload
+    latest = (
+        OpenAIFile.objects.filter(portfolio__isnull=False)
+        .values('portfolio')
+        .annotate(latest=Max('id'))
+        .values('latest')
+    )
+    return OpenAIFile.objects.filter(attached=False).exclude(id__in=latest).order_by('id')
+
+
+def collect_garbage(client, batch_size=GC_BATCH_SIZE):
+    # Deletes up to batch_size superseded files from OpenAI storage and returns how many went
+    from openai import NotFoundError  # Only loaded once there is something to collect
+
+    files = list(superseded_files()[:batch_size])
+    deleted = []
+    try:
+        for openai_file in files:
+            try:
+                client.files.delete(openai_file.file_id)
+            except NotFoundError:
+                pass  # Already gone upstream
+            deleted.append(openai_file.id)
+    finally:
+        # Forget whatever was deleted even if a later call in the batch failed
+        OpenAIFile.objects.filter(id__in=deleted).delete()
+    return len(deleted)
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from chatbot.files import GC_BATCH_SIZE, collect_garbage
+
+
+class Command(BaseCommand):
+    help = 'Delete superseded portfolio context files from OpenAI storage, one batch at a time'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=GC_BATCH_SIZE)
+        parser.add_argument('--all', action='store_true', help='Keep going until nothing superseded is left')
+
+    def handle(self, *args, **options):
+        from chatbot.views import get_client
+
+        client = get_client()
+        total = 0
+        while True:
+            deleted = collect_garbage(client, options['batch_size'])
+            total += deleted
+            if not options['all'] or deleted < options['batch_size']:
+                break
+        self.stdout.write(f'Deleted {total} superseded file(s).')
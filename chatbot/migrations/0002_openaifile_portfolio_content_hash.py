@@ -0,0 +1,30 @@
+# Generated by Django 5.0.1 on 2026-10-18 08:04
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chatbot", "0001_initial"),
+        ("portfolio", "0008_asset_unique_name_transaction_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="openaifile",
+            name="content_hash",
+            field=models.CharField(blank=True, db_index=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name="openaifile",
+            name="portfolio",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                to="portfolio.portfolio",
+            ),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.0.1 on 2026-10-18 08:05
+
+from django.db import migrations, models
+
+
+def mark_attached(apps, schema_editor):
+    # Every upload used to replace the assistant's files, so the newest one is attached
+    OpenAIFile = apps.get_model("chatbot", "OpenAIFile")
+    latest = OpenAIFile.objects.order_by("-id").first()
+    if latest is not None:
+        latest.attached = True
+        latest.save(update_fields=["attached"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chatbot", "0002_openaifile_portfolio_content_hash"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="openaifile",
+            name="attached",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name="openaifile",
+            name="size",
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.RunPython(mark_attached, migrations.RunPython.noop),
+    ]
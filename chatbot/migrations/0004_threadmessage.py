@@ -0,0 +1,41 @@
+# Generated by Django 5.0.1 on 2026-10-18 08:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chatbot", "0003_openaifile_size_attached"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ThreadMessage",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("thread_id", models.CharField(max_length=100)),
+                ("message_id", models.CharField(max_length=100, unique=True)),
+                ("role", models.CharField(max_length=20)),
+                ("content", models.TextField(blank=True)),
+                ("hidden", models.BooleanField(default=False)),
+                ("created_at", models.IntegerField()),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["thread_id", "id"],
+                        name="chatbot_thr_thread__0fd787_idx",
+                    )
+                ],
+            },
+        ),
+    ]
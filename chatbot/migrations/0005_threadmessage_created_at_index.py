@@ -0,0 +1,24 @@
+# Generated by Django 5.0.1 on 2026-10-18 08:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chatbot", "0004_threadmessage"),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="threadmessage",
+            name="chatbot_thr_thread__0fd787_idx",
+        ),
+        migrations.AddIndex(
+            model_name="threadmessage",
+            index=models.Index(
+                fields=["thread_id", "created_at", "id"],
+                name="chatbot_thr_thread__3cbc2d_idx",
+            ),
+        ),
+    ]
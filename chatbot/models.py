@@ -1,4 +1,38 @@
 from django.db import models
+from portfolio.models import Portfolio
 
 class OpenAIFile(models.Model):
-    file_id = models.CharField(max_length=200, unique=True)
\ No newline at end of file
+    file_id = models.CharField(max_length=200, unique=True)
+    # Which portfolio's context file this is and the sha256 of what was uploaded,
+    # an unchanged file isn't uploaded again
+    portfolio = models.ForeignKey(Portfolio, on_delete=models.SET_NULL, null=True, blank=True)
+    content_hash = models.CharField(max_length=64, blank=True, db_index=True)
+    size = models.PositiveBigIntegerField(default=0)
+    # The file currently attached to the assistant
+    attached = models.BooleanField(default=False)
+
+
+class ThreadMessage(models.Model):
+    # Local copy of an assistant thread's messages, so each turn only fetches
+    # the messages after the newest one stored here
+    thread_id = models.CharField(max_length=100)
+    message_id = models.CharField(max_length=100, unique=True)
+    role = models.CharField(max_length=20)
+    content = models.TextField(blank=True)
+    hidden = models.BooleanField(default=False)
+    created_at = models.IntegerField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['thread_id', 'created_at', 'id']),
+        ]
+
+    def as_dict(self):
+        return {
+            "content": self.content,
+            "role": self.role,
+            "hidden": self.hidden,
+            "id": self.message_id,
+            "created_at": self.created_at,
+            "thread_id": self.thread_id,
+        }
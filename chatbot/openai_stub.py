@@ -0,0 +1,202 @@
+import asyncio
+import itertools
+import json
+import re
+import time
+
+import httpx
+
+
+class OpenAIStub:
+    # In-process stand-in for the Assistants REST API, served through an
+    # httpx.MockTransport. Every run replies with `reply`; if `tool_calls` is set
+    # the first run of each thread asks for them before replying. Runs finish as
+    # soon as they are created, streamed or not, after `latency` seconds per call.
+
+    def __init__(self, reply='Hello! How can I help?', tool_calls=None, status='completed', chunk_size=4, latency=0.0):
+        self.reply = reply
+        self.tool_calls = tool_calls or []
+        self.status = status
+        self.chunk_size = chunk_size
+        self.latency = latency
+        self.threads = {}
+        self.runs = {}
+        self.files = {}
+        self.submitted = []
+        self.requests = []
+        self._ids = itertools.count(1)
+
+    def transport(self):
+        return httpx.MockTransport(self.handle)
+
+    def async_transport(self):
+        # Same as transport() but waits without blocking the event loop
+        async def handle(request):
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            return self.respond(request)
+        return httpx.MockTransport(handle)
+
+    def new_id(self, prefix):
+        return f'{prefix}_{next(self._ids)}'
+
+    def handle(self, request):
+        if self.latency:
+            time.sleep(self.latency)
+        return self.respond(request)
+
+    def respond(self, request):
+        self.requests.append(request)
+        is_json = request.headers.get('content-type', '').startswith('application/json')
+        body = json.loads(request.content) if request.content and is_json else {}
+        path = request.url.path
+        if request.method == 'POST' and re.fullmatch(r'.*/threads', path):
+            thread_id = self.new_id('thread')
+            self.threads[thread_id] = {'messages': [], 'runs': 0}
+            return httpx.Response(200, json={'id': thread_id, 'object': 'thread'})
+
+        match = re.fullmatch(r'.*/threads/([^/]+)/messages', path)
+        if request.method == 'POST' and match:
+            message = self.message(match.group(1), 'user', body['content'], body.get('metadata', {}))
+            return httpx.Response(200, json=message)
+        if request.method == 'GET' and match:
+            return httpx.Response(200, json=self.message_page(match.group(1), request.url.params))
+
+        match = re.fullmatch(r'.*/threads/([^/]+)/runs', path)
+        if request.method == 'POST' and match and not body.get('stream'):
+            return httpx.Response(200, json=self.start_run(match.group(1)))
+        if request.method == 'POST' and match:
+            thread = self.threads.setdefault(match.group(1), {'messages': [], 'runs': 0})
+            thread['runs'] += 1
+            run_id = self.new_id('run')
+            events = [('thread.run.created', self.run(run_id, match.group(1), 'queued'))]
+            if self.tool_calls and thread['runs'] == 1:
+                events.append(('thread.run.requires_action', self.run(run_id, match.group(1), 'requires_action')))
+            else:
+                events += self.reply_events(run_id, match.group(1))
+            return self.event_stream(events)
+
+        match = re.fullmatch(r'.*/threads/([^/]+)/runs/([^/]+)', path)
+        if request.method == 'GET' and match:
+            return httpx.Response(200, json=self.runs[match.group(2)])
+
+        match = re.fullmatch(r'.*/threads/([^/]+)/runs/([^/]+)/submit_tool_outputs', path)
+        if request.method == 'POST' and match and not body.get('stream'):
+            self.submitted.append(body['tool_outputs'])
+            return httpx.Response(200, json=self.finish_run(match.group(2), match.group(1)))
+        if request.method == 'POST' and match:
+            self.submitted.append(body['tool_outputs'])
+            return self.event_stream(self.reply_events(match.group(2), match.group(1)))
+
+        if request.method == 'POST' and re.fullmatch(r'.*/files', path):
+            file_id = self.new_id('file')
+            self.files[file_id] = len(request.content)
+            return httpx.Response(200, json={
+                'id': file_id, 'object': 'file', 'bytes': len(request.content), 'created_at': int(time.time()),
+                'filename': 'upload', 'purpose': 'assistants', 'status': 'processed',
+            })
+
+        match = re.fullmatch(r'.*/files/([^/]+)', path)
+        if request.method == 'DELETE' and match:
+            self.files.pop(match.group(1), None)
+            return httpx.Response(200, json={'id': match.group(1), 'object': 'file', 'deleted': True})
+
+        match = re.fullmatch(r'.*/assistants/([^/]+)/files/([^/]+)', path)
+        if request.method == 'DELETE' and match:
+            return httpx.Response(200, json={'id': match.group(2), 'object': 'assistant.file.deleted', 'deleted': True})
+
+        match = re.fullmatch(r'.*/assistants/([^/]+)', path)
+        if request.method == 'POST' and match:
+            return httpx.Response(200, json={
+                'id': match.group(1), 'object': 'assistant', 'created_at': int(time.time()), 'model': 'stub',
+                'name': None, 'description': None, 'instructions': None, 'tools': [], 'metadata': {},
+                'file_ids': body.get('file_ids', []),
+            })
+
+        return httpx.Response(404, json={'error': {'message': f'No stub for {request.method} {path}'}})
+
+    def message(self, thread_id, role, content, metadata=None):
+        message = {
+            'id': self.new_id('msg'),
+            'object': 'thread.message',
+            'created_at': int(time.time()),
+            'thread_id': thread_id,
+            'role': role,
+            'content': [{'type': 'text', 'text': {'value': content, 'annotations': []}}],
+            'metadata': metadata or {},
+        }
+        self.threads.setdefault(thread_id, {'messages': [], 'runs': 0})['messages'].append(message)
+        return message
+
+    def start_run(self, thread_id):
+        thread = self.threads.setdefault(thread_id, {'messages': [], 'runs': 0})
+        thread['runs'] += 1
+        run_id = self.new_id('run')
+        if self.tool_calls and thread['runs'] == 1:
+            self.runs[run_id] = self.run(run_id, thread_id, 'requires_action')
+            return self.runs[run_id]
+        return self.finish_run(run_id, thread_id)
+
+    def finish_run(self, run_id, thread_id):
+        if self.status == 'completed':
+            self.message(thread_id, 'assistant', self.reply)
+        self.runs[run_id] = self.run(run_id, thread_id, self.status)
+        return self.runs[run_id]
+
+    def message_page(self, thread_id, params):
+        # Cursor pagination like the real list endpoint, newest first by default
+        messages = list(self.threads.get(thread_id, {'messages': []})['messages'])
+        if params.get('order', 'desc') == 'desc':
+            messages.reverse()
+        if params.get('after'):
+            ids = [message['id'] for message in messages]
+            messages = messages[ids.index(params['after']) + 1:] if params['after'] in ids else []
+        limit = int(params.get('limit', 20))
+        page = messages[:limit]
+        return {
+            'object': 'list',
+            'data': page,
+            'first_id': page[0]['id'] if page else None,
+            'last_id': page[-1]['id'] if page else None,
+            'has_more': len(messages) > limit,
+        }
+
+    def run(self, run_id, thread_id, status):
+        run = {'id': run_id, 'object': 'thread.run', 'thread_id': thread_id, 'status': status}
+        if status == 'requires_action':
+            run['required_action'] = {
+                'type': 'submit_tool_outputs',
+                'submit_tool_outputs': {
+                    'tool_calls': [
+                        {
+                            'id': f'call_{i}',
+                            'type': 'function',
+                            'function': {'name': call['name'], 'arguments': json.dumps(call.get('arguments', {}))},
+                        }
+                        for i, call in enumerate(self.tool_calls, 1)
+                    ],
+                },
+            }
+        return run
+
+    def reply_events(self, run_id, thread_id):
+        if self.status != 'completed':
+            return [(f'thread.run.{self.status}', self.run(run_id, thread_id, self.status))]
+
+        message = self.message(thread_id, 'assistant', self.reply)
+        events = [('thread.message.created', {**message, 'content': []})]
+        for start in range(0, len(self.reply), self.chunk_size):
+            chunk = self.reply[start:start + self.chunk_size]
+            events.append(('thread.message.delta', {
+                'id': message['id'],
+                'object': 'thread.message.delta',
+                'delta': {'content': [{'index': 0, 'type': 'text', 'text': {'value': chunk}}]},
+            }))
+        events.append(('thread.message.completed', message))
+        events.append(('thread.run.completed', self.run(run_id, thread_id, 'completed')))
+        return events
+
+    def event_stream(self, events):
+        body = ''.join(f'event: {event}\ndata: {json.dumps(data)}\n\n' for event, data in events)
+        body += 'event: done\ndata: [DONE]\n\n'
+        return httpx.Response(200, headers={'content-type': 'text/event-stream'}, content=body.encode())
@@ -0,0 +1,134 @@
+import json
+import os
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+# The installed openai SDK predates run streaming, so the streamed endpoints are
+# called over plain HTTP. Tests swap TRANSPORT for the stub in openai_stub.py.
+TRANSPORT = None
+
+
+def base_url():
+    return getattr(settings, 'OPENAI_BASE_URL', 'https://api.openai.com/v1')
+
+
+def async_client(transport=None):
+    import httpx  # Only the streamed endpoints need it, keep it off startup
+
+    return httpx.AsyncClient(
+        base_url=base_url(),
+        headers={
+            'Authorization': f'Bearer {os.getenv("OPENAI_API_KEY")}',
+            'OpenAI-Beta': 'assistants=v1',
+        },
+        # Runs can go quiet for a while between events, only connecting is bounded tightly
+        timeout=httpx.Timeout(120, connect=10),
+        transport=transport or TRANSPORT,
+    )
+
+
+def sse(event, data):
+    # One server-sent event for the browser
+    return f'event: {event}\ndata: {json.dumps(data)}\n\n'
+
+
+async def iter_events(response):
+    # Parses an upstream text/event-stream body into (event, data) pairs
+    event, data = None, []
+    async for line in response.aiter_lines():
+        if line == '':
+            if event is not None or data:
+                payload = '\n'.join(data)
+                yield event, (json.loads(payload) if payload and payload != '[DONE]' else payload)
+            event, data = None, []
+        elif line.startswith('event:'):
+            event = line[len('event:'):].strip()
+        elif line.startswith('data:'):
+            data.append(line[len('data:'):].strip())
+    if event is not None or data:
+        payload = '\n'.join(data)
+        yield event, (json.loads(payload) if payload and payload != '[DONE]' else payload)
+
+
+class OpenAIError(Exception):
+    # A request that isn't streamed failed, the views report it as an SSE error event
+    pass
+
+
+async def post(client, path, body):
+    import httpx
+
+    try:
+        response = await client.post(path, json=body)
+    except httpx.HTTPError as e:
+        raise OpenAIError(f'OpenAI request failed: {e}') from e
+    if response.status_code != 200:
+        raise OpenAIError(f'OpenAI request failed with status {response.status_code}.')
+    return response.json()
+
+
+async def create_thread(client):
+    return (await post(client, '/threads', {}))['id']
+
+
+async def add_message(client, thread_id, content, metadata=None):
+    body = {'role': 'user', 'content': content}
+    if metadata:
+        body['metadata'] = metadata
+    return await post(client, f'/threads/{thread_id}/messages', body)
+
+
+async def stream_run(client, thread_id, assistant_id, call_tools):
+    # Starts a run and relays it to the browser as SSE, tokens are forwarded as
+    # they arrive. call_tools(tool_calls) is a sync function returning the tool
+    # outputs; it runs off the event loop and its outputs are streamed back in.
+    request = client.stream('POST', f'/threads/{thread_id}/runs', json={'assistant_id': assistant_id, 'stream': True})
+    while request is not None:
+        async with request as response:
+            if response.status_code != 200:
+                await response.aread()
+                yield sse('error', {'message': f'OpenAI request failed with status {response.status_code}.'})
+                return
+
+            request = None
+            async for event, data in iter_events(response):
+                if event == 'thread.run.created':
+                    yield sse('run', {'run_id': data['id'], 'thread_id': thread_id})
+
+                elif event == 'thread.message.delta':
+                    for part in data['delta'].get('content', []):
+                        if part.get('type') == 'text':
+                            yield sse('token', {'message_id': data['id'], 'text': part['text']['value']})
+
+                elif event == 'thread.message.completed':
+                    yield sse('message', {
+                        'id': data['id'],
+                        'role': data['role'],
+                        'content': ''.join(part['text']['value'] for part in data['content'] if part.get('type') == 'text'),
+                        'created_at': data.get('created_at'),
+                        'thread_id': thread_id,
+                    })
+
+                elif event == 'thread.run.requires_action':
+                    required_actions = data['required_action']['submit_tool_outputs']
+                    yield sse('tool_calls', required_actions)
+                    # Not thread_sensitive, slow tools would otherwise queue behind every
+                    # other sync view on the one shared thread
+                    tool_outputs = await sync_to_async(call_tools, thread_sensitive=False)(required_actions['tool_calls'])
+                    # The rest of the run continues on the stream returned by the submission
+                    request = client.stream(
+                        'POST',
+                        f'/threads/{thread_id}/runs/{data["id"]}/submit_tool_outputs',
+                        json={'tool_outputs': tool_outputs, 'stream': True},
+                    )
+                    break
+
+                elif event == 'thread.run.completed':
+                    yield sse('done', {'run_id': data['id'], 'status': data['status']})
+
+                elif event in ('thread.run.failed', 'thread.run.cancelled', 'thread.run.expired'):
+                    yield sse('error', {'run_id': data['id'], 'status': data['status'], 'message': f'Run {data["status"]}.'})
+
+                elif event == 'error':
+                    yield sse('error', {'message': data.get('message', 'OpenAI stream error.') if isinstance(data, dict) else str(data)})
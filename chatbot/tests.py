@@ -1,3 +1,410 @@
+import io
+import json
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from unittest import mock
+
+# chatbot.views builds its OpenAI client from the environment on first use
+os.environ.setdefault('OPENAI_API_KEY', 'test-key')
+
+import httpx
+import requests
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.management import call_command
 from django.test import TestCase
+from django.utils import timezone
+
+from portfolio.models import Portfolio
+from portfolio.views import create_transaction, portfolio_ledger_hash
+
+from . import streaming, views
+from .files import sync_portfolio_file, collect_garbage
+from .models import OpenAIFile, ThreadMessage
+from .openai_stub import OpenAIStub
+from .tool_cache import ToolError
+
+
+def json_response(status, data):
+    response = requests.Response()
+    response.status_code = status
+    response._content = json.dumps(data).encode()
+    return response
+
+
+def parse_events(body):
+    events = []
+    for block in body.strip().split('\n\n'):
+        lines = dict(line.split(': ', 1) for line in block.split('\n'))
+        events.append((lines['event'], json.loads(lines['data'])))
+    return events
+
+
+class StreamingChatTests(TestCase):
+    def setUp(self):
+        caches['tools'].clear()
+
+    async def stream(self, path, stub, data=None):
+        with mock.patch.object(streaming, 'TRANSPORT', stub.transport()):
+            response = await self.async_client.post(path, data or {}, content_type='application/json')
+            body = b''.join([chunk async for chunk in response.streaming_content])
+        return response, parse_events(body.decode())
+
+    async def test_chat_streams_tokens(self):
+        stub = OpenAIStub(reply='The market is up today.')
+        response, events = await self.stream('/api/stream/chat/thread_1', stub, {'content': 'How is the market?'})
+
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        names = [event for event, _ in events]
+        self.assertEqual(names[0], 'run')
+        self.assertEqual(names[-1], 'done')
+        tokens = [data['text'] for event, data in events if event == 'token']
+        self.assertGreater(len(tokens), 1)
+        self.assertEqual(''.join(tokens), 'The market is up today.')
+
+        message = next(data for event, data in events if event == 'message')
+        self.assertEqual(message['content'], 'The market is up today.')
+        self.assertEqual(message['role'], 'assistant')
+
+        user_message = stub.threads['thread_1']['messages'][0]
+        self.assertEqual(user_message['content'][0]['text']['value'], 'How is the market?')
+
+    async def test_new_thread_sends_hidden_greeting(self):
+        stub = OpenAIStub(reply='Hi, I am BucksBuddy.')
+        response, events = await self.stream('/api/stream/new', stub)
+
+        self.assertEqual(events[0][0], 'thread')
+        thread_id = events[0][1]['thread_id']
+        greeting = stub.threads[thread_id]['messages'][0]
+        self.assertEqual(greeting['metadata'], {'type': 'hidden'})
+        self.assertEqual(''.join(data['text'] for event, data in events if event == 'token'), 'Hi, I am BucksBuddy.')
+
+    async def test_tool_calls_are_run_and_submitted(self):
+        stub = OpenAIStub(reply='Apple opened at 123.45 USD.', tool_calls=[{'name': 'get_asset_price', 'arguments': {'symbol': 'AAPL'}}])
+        with mock.patch('chatbot.views.get_info', return_value={'regularMarketOpen': 123.45}) as get_info:
+            response, events = await self.stream('/api/stream/chat/thread_1', stub, {'content': 'Price of Apple?'})
+
+        get_info.assert_called_once_with('AAPL', ['regularMarketOpen'])
+        self.assertEqual(stub.submitted, [[{'tool_call_id': 'call_1', 'output': '123.45 USD'}]])
+
+        tool_calls = next(data for event, data in events if event == 'tool_calls')
+        self.assertEqual(tool_calls['tool_calls'][0]['function']['name'], 'get_asset_price')
+        self.assertEqual(''.join(data['text'] for event, data in events if event == 'token'), 'Apple opened at 123.45 USD.')
+        self.assertEqual(events[-1][0], 'done')
+
+    async def test_failed_run_reports_error(self):
+        stub = OpenAIStub(status='failed')
+        response, events = await self.stream('/api/stream/chat/thread_1', stub, {'content': 'Hello'})
+
+        self.assertEqual(events[-1][0], 'error')
+        self.assertEqual(events[-1][1]['status'], 'failed')
+        self.assertFalse(any(event == 'token' for event, _ in events))
+
+    async def test_failed_requests_before_the_run_report_an_error(self):
+        stub = OpenAIStub()
+        stub.transport = lambda: httpx.MockTransport(lambda request: httpx.Response(500))
+        for path in ['/api/stream/new', '/api/stream/chat/thread_1']:
+            with self.subTest(path=path):
+                response, events = await self.stream(path, stub, {'content': 'Hello'})
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(events, [('error', {'message': 'OpenAI request failed with status 500.'})])
+
+    async def test_unreachable_openai_reports_an_error(self):
+        def unreachable(request):
+            raise httpx.ConnectError('Connection refused')
+
+        stub = OpenAIStub()
+        stub.transport = lambda: httpx.MockTransport(unreachable)
+        response, events = await self.stream('/api/stream/chat/thread_1', stub, {'content': 'Hello'})
+        self.assertEqual(events, [('error', {'message': 'OpenAI request failed: Connection refused'})])
+
+    async def test_only_post_allowed(self):
+        response = await self.async_client.get('/api/stream/chat/thread_1')
+        self.assertEqual(response.status_code, 405)
+
+
+class CallToolsTests(TestCase):
+    def tool_calls(self, *names):
+        return [
+            {'id': f'call_{i}', 'type': 'function', 'function': {'name': name, 'arguments': json.dumps({'delay': 0.3})}}
+            for i, name in enumerate(names, 1)
+        ]
+
+    def test_tools_run_concurrently_and_time_out(self):
+        def slow(delay):
+            time.sleep(delay)
+            return {'slept': delay}
+
+        def failing(delay):
+            raise ValueError('bad ticker')
+
+        tools = {'slow_a': slow, 'slow_b': slow, 'too_slow': slow, 'failing': failing}
+        with mock.patch.dict(views.FUNCTION_DISPATCH_TABLE, tools), \
+                mock.patch.dict(views.TOOL_TIMEOUTS, {'too_slow': 0.1}):
+            started = time.monotonic()
+            outputs = views.call_tools(self.tool_calls('slow_a', 'slow_b', 'too_slow', 'failing', 'missing'))
+            elapsed = time.monotonic() - started
+
+        # As long as the slowest tool, not the sum
+        self.assertLess(elapsed, 0.55)
+        self.assertEqual([output['tool_call_id'] for output in outputs], ['call_1', 'call_2', 'call_3', 'call_4', 'call_5'])
+        self.assertEqual(json.loads(outputs[0]['output']), {'slept': 0.3})
+        self.assertEqual(json.loads(outputs[1]['output']), {'slept': 0.3})
+        self.assertIn('timed out', json.loads(outputs[2]['output'])['error'])
+        self.assertIn('bad ticker', json.loads(outputs[3]['output'])['error'])
+        self.assertIn('Unknown function', json.loads(outputs[4]['output'])['error'])
+
+    def test_timed_out_calls_still_queued_are_cancelled(self):
+        ran = []
+
+        def slow(delay):
+            ran.append(delay)
+            time.sleep(delay)
+            return {'slept': delay}
+
+        pool = ThreadPoolExecutor(max_workers=1)
+        self.addCleanup(pool.shutdown)
+        with mock.patch.dict(views.FUNCTION_DISPATCH_TABLE, {'slow': slow, 'queued': slow}), \
+                mock.patch.dict(views.TOOL_TIMEOUTS, {'queued': 0.1}), \
+                mock.patch.object(views, 'TOOL_POOL', pool), \
+                self.assertLogs('chatbot.views', 'WARNING') as logs:
+            outputs = views.call_tools(self.tool_calls('slow', 'queued'))
+
+        # The only worker was busy with the first call, the second never started
+        self.assertEqual(ran, [0.3])
+        self.assertEqual(json.loads(outputs[0]['output']), {'slept': 0.3})
+        self.assertIn('timed out', json.loads(outputs[1]['output'])['error'])
+        self.assertEqual(logs.output, ['WARNING:chatbot.views:Tool queued timed out after 0.1s'])
+
+
+class ToolCacheTests(TestCase):
+    def setUp(self):
+        caches['tools'].clear()
+
+    def test_results_are_cached_per_normalized_arguments(self):
+        with mock.patch('chatbot.views.get_info', return_value={'regularMarketOpen': 10.5}) as get_info:
+            self.assertEqual(views.get_asset_price('AAPL'), '10.5 USD')
+            self.assertEqual(views.get_asset_price(symbol=' aapl'), '10.5 USD')
+            self.assertEqual(get_info.call_count, 1)
+
+            views.get_asset_price('MSFT')
+            self.assertEqual(get_info.call_count, 2)
+
+    def test_skip_cache_refreshes_the_result(self):
+        with mock.patch('chatbot.views.get_info', return_value={'regularMarketOpen': 10.5}) as get_info:
+            views.get_asset_price('AAPL')
+            get_info.return_value = {'regularMarketOpen': 11.0}
+            self.assertEqual(views.get_asset_price('AAPL'), '10.5 USD')
+            self.assertEqual(views.get_asset_price('AAPL', skip_cache=True), '11.0 USD')
+            self.assertEqual(views.get_asset_price('AAPL'), '11.0 USD')
+
+    def test_results_expire_after_the_tool_ttl(self):
+        with mock.patch('chatbot.views.get_info', return_value={'regularMarketOpen': 10.5}) as get_info, \
+                self.settings(CHATBOT_TOOL_CACHE_TTLS={'get_asset_price': 60}), \
+                mock.patch('django.core.cache.backends.locmem.time.time') as now:
+            now.return_value = 1000
+            views.get_asset_price('AAPL')
+            now.return_value = 1059
+            views.get_asset_price('AAPL')
+            self.assertEqual(get_info.call_count, 1)
+            now.return_value = 1061
+            views.get_asset_price('AAPL')
+            self.assertEqual(get_info.call_count, 2)
+
+    def test_missing_prices_are_not_cached(self):
+        with mock.patch('chatbot.views.get_info', return_value={}) as get_info:
+            for _ in range(2):
+                with self.assertRaises(ToolError):
+                    views.get_asset_price('AAPL')
+            self.assertEqual(get_info.call_count, 2)
+
+    def test_provider_errors_are_not_cached(self):
+        error = json_response(200, {'Error Message': 'Invalid API KEY.'})
+        sectors = json_response(200, [{'sector': 'Technology', 'changesPercentage': '1.2%'}])
+        with mock.patch('chatbot.views.http_client.get', side_effect=[error, sectors, sectors]) as get:
+            with self.assertRaisesMessage(ToolError, 'Invalid API KEY.'):
+                views.get_sector_performance()
+            self.assertEqual(views.get_sector_performance(), sectors.json())
+            self.assertEqual(views.get_sector_performance(), sectors.json())
+            self.assertEqual(get.call_count, 2)
+
+    def test_empty_results_are_not_cached(self):
+        responses = [json_response(200, {}), json_response(200, {'answer_box': {'title': 'Apple'}})]
+        with mock.patch('chatbot.views.http_client.get', side_effect=responses):
+            self.assertEqual(views.google_search('apple'), {})
+            self.assertEqual(views.google_search('apple')['answer_box']['title'], 'Apple')
+
+
+class PortfolioFileSyncTests(TestCase):
+    def setUp(self):
+        user = get_user_model().objects.create_user(email='user@example.com', username='user', password='password')
+        self.portfolios = [Portfolio.objects.create(user=user, name=f'Portfolio {i}') for i in range(2)]
+        self.client_mock = mock.MagicMock()
+        self.uploads = iter(range(1, 100))
+        self.client_mock.files.create.side_effect = lambda **kwargs: mock.Mock(id=f'file-{next(self.uploads)}')
+        self.tmp = tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False)
+        self.tmp.write('portfolio context')
+        self.tmp.close()
+        self.addCleanup(os.remove, self.tmp.name)
+
+    def sync(self, portfolio, content_hash):
+        return sync_portfolio_file(self.client_mock, 'asst_1', portfolio.id, self.tmp.name, content_hash)
+
+    def test_repeat_sync_makes_no_upstream_calls(self):
+        openai_file, uploaded, attached = self.sync(self.portfolios[0], 'a' * 64)
+        self.assertTrue(uploaded)
+        self.assertTrue(attached)
+        self.assertEqual(openai_file.size, len('portfolio context'))
+
+        self.client_mock.reset_mock()
+        openai_file, uploaded, attached = self.sync(self.portfolios[0], 'a' * 64)
+        self.assertFalse(uploaded)
+        self.assertFalse(attached)
+        self.assertEqual(self.client_mock.mock_calls, [])
+
+    def test_switching_back_reattaches_without_uploading(self):
+        first, _, _ = self.sync(self.portfolios[0], 'a' * 64)
+        self.sync(self.portfolios[1], 'b' * 64)
+
+        self.client_mock.reset_mock()
+        openai_file, uploaded, attached = self.sync(self.portfolios[0], 'a' * 64)
+        self.assertEqual(openai_file.file_id, first.file_id)
+        self.assertFalse(uploaded)
+        self.assertTrue(attached)
+        self.client_mock.files.create.assert_not_called()
+        self.client_mock.beta.assistants.update.assert_called_once_with('asst_1', file_ids=[first.file_id])
+        self.assertEqual(list(OpenAIFile.objects.filter(attached=True).values_list('file_id', flat=True)), [first.file_id])
+
+    def test_superseded_files_are_collected_in_batches(self):
+        for i in range(5):
+            self.sync(self.portfolios[0], str(i) * 64)
+        self.sync(self.portfolios[1], 'b' * 64)
+
+        # Portfolio 0's newest upload and the attached file are kept
+        self.assertEqual(collect_garbage(self.client_mock, batch_size=3), 3)
+        self.assertEqual(collect_garbage(self.client_mock, batch_size=3), 1)
+        self.assertEqual(collect_garbage(self.client_mock, batch_size=3), 0)
+        self.assertEqual(
+            [call.args[0] for call in self.client_mock.files.delete.call_args_list],
+            ['file-1', 'file-2', 'file-3', 'file-4'],
+        )
+        self.assertEqual(sorted(OpenAIFile.objects.values_list('file_id', flat=True)), ['file-5', 'file-6'])
+
+    def test_command_builds_its_own_client(self):
+        for i in range(5):
+            self.sync(self.portfolios[0], str(i) * 64)
+
+        out = io.StringIO()
+        # A fresh process, nothing has built the OpenAI client yet
+        with mock.patch.object(views, 'client', None), mock.patch('openai.OpenAI', return_value=self.client_mock):
+            call_command('gc_openai_files', '--all', '--batch-size', '3', stdout=out)
+        self.assertIn('Deleted 4 superseded file(s).', out.getvalue())
+
+
+class PortfolioFileHashTests(TestCase):
+    def setUp(self):
+        user = get_user_model().objects.create_user(email='user@example.com', username='user', password='password')
+        self.portfolio = Portfolio.objects.create(user=user, name='Portfolio')
+        create_transaction(self.portfolio.id, 'buy', 'Apple', 'AAPL', 'Stock', 'Tech', 10, 100, 0, '2024-01-02T00:00:00Z')
+
+    def test_hash_only_changes_with_the_ledger(self):
+        first = portfolio_ledger_hash(self.portfolio.id)
+        with mock.patch('portfolio.views.get_quotes') as get_quotes:
+            self.assertEqual(portfolio_ledger_hash(self.portfolio.id), first)
+        get_quotes.assert_not_called()
+
+        create_transaction(self.portfolio.id, 'sell', 'Apple', 'AAPL', 'Stock', 'Tech', 4, 120, 0, '2024-01-03T00:00:00Z')
+        self.assertNotEqual(portfolio_ledger_hash(self.portfolio.id), first)
+
+    def test_file_is_only_built_for_a_new_ledger(self):
+        with mock.patch('chatbot.views.write_view_outputs_to_file') as write:
+            _, content_hash = views.create_portfolio_info_file(self.portfolio.id)
+            self.assertEqual(write.call_count, 1)
+
+            OpenAIFile.objects.create(file_id='file-1', portfolio=self.portfolio, content_hash=content_hash)
+            views.create_portfolio_info_file(self.portfolio.id)
+            self.assertEqual(write.call_count, 1)
+
+    def test_a_new_day_builds_a_new_file(self):
+        today = timezone.now()
+        with mock.patch('chatbot.views.write_view_outputs_to_file') as write:
+            _, content_hash = views.create_portfolio_info_file(self.portfolio.id)
+            OpenAIFile.objects.create(file_id='file-1', portfolio=self.portfolio, content_hash=content_hash)
+
+            with mock.patch('portfolio.views.timezone.now', return_value=today + timedelta(days=1)):
+                _, next_hash = views.create_portfolio_info_file(self.portfolio.id)
+        self.assertNotEqual(next_hash, content_hash)
+        self.assertEqual(write.call_count, 2)
+
+
+class ThreadMessageStoreTests(TestCase):
+    def setUp(self):
+        self.upstream = []
+        self.calls = []
+        client = mock.MagicMock()
+        client.beta.threads.messages.list.side_effect = self.list_messages
+        patcher = mock.patch.object(views, 'client', client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def add(self, role, text, hidden=False):
+        message_id = f'msg_{len(self.upstream) + 1}'
+        self.upstream.append(mock.Mock(
+            id=message_id,
+            role=role,
+            created_at=1700000000 + len(self.upstream),
+            metadata={'type': 'hidden'} if hidden else {},
+            content=[mock.Mock(type='text', text=mock.Mock(value=text))],
+        ))
+        return message_id
+
+    def list_messages(self, thread_id, order, limit, after=None):
+        self.calls.append(after)
+        ids = [message.id for message in self.upstream]
+        start = ids.index(after) + 1 if after else 0
+        return self.upstream[start:]
+
+    def test_only_new_messages_are_fetched(self):
+        self.add('user', 'Greet the user', hidden=True)
+        self.add('assistant', 'Hi!')
+        messages = views.get_messages('thread_1')
+        self.assertEqual([m['content'] for m in messages], ['Hi!', 'Greet the user'])
+        self.assertTrue(messages[1]['hidden'])
+
+        self.add('user', 'What is AAPL at?')
+        self.add('assistant', 'About 180 USD.')
+        messages = views.get_messages('thread_1')
+        self.assertEqual(self.calls, [None, 'msg_2'])
+        self.assertEqual([m['id'] for m in messages], ['msg_4', 'msg_3', 'msg_2', 'msg_1'])
+        self.assertEqual(ThreadMessage.objects.count(), 4)
+
+    def test_after_returns_only_the_delta(self):
+        self.add('assistant', 'Hi!')
+        last_seen = self.add('user', 'Hello')
+        views.get_messages('thread_1')
+        self.add('assistant', 'How can I help?')
+
+        messages = views.get_messages('thread_1', after=last_seen)
+        self.assertEqual([m['content'] for m in messages], ['How can I help?'])
+        self.assertEqual(messages[0]['thread_id'], 'thread_1')
+
+    def test_messages_are_ordered_by_creation_time(self):
+        # Stored out of order, e.g. by two syncs racing each other
+        for message_id, created_at in [('msg_2', 1700000002), ('msg_1', 1700000001), ('msg_3', 1700000003)]:
+            ThreadMessage.objects.create(thread_id='thread_1', message_id=message_id, role='user', created_at=created_at)
+        self.upstream = [mock.Mock(id=f'msg_{i}') for i in range(1, 4)]
+
+        self.assertEqual([m['id'] for m in views.get_messages('thread_1')], ['msg_3', 'msg_2', 'msg_1'])
+        self.assertEqual([m['id'] for m in views.get_messages('thread_1', after='msg_1')], ['msg_3', 'msg_2'])
+        self.assertEqual(self.calls, ['msg_3', 'msg_3'])
 
-# Create your tests here.
+    def test_only_the_newest_page_is_returned(self):
+        for i in range(5):
+            self.add('user', f'Message {i}')
+        with self.settings(CHATBOT_MESSAGE_PAGE_SIZE=3):
+            messages = views.get_messages('thread_1')
+        self.assertEqual([m['content'] for m in messages], ['Message 4', 'Message 3', 'Message 2'])
+        self.assertEqual(len(views.get_messages('thread_1', limit=4)), 4)
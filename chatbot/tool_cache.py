@@ -0,0 +1,67 @@
+import functools
+import hashlib
+import inspect
+import json
+
+from django.conf import settings
+from django.core.cache import caches
+
+from core.metrics import record_cache
+
+class ToolError(Exception):
+    # Raised by a tool whose provider answered with an error or nothing usable,
+    # call_tools reports it to the assistant and it is never cached
+    pass
+
+
+def tool_ttl(name):
+    # Seconds a tool's result stays fresh, tools without a TTL aren't cached
+    return settings.CHATBOT_TOOL_CACHE_TTLS.get(name)
+
+
+def normalize(value):
+    # "aapl " and "AAPL" or "Tech Stocks" and "tech stocks" are the same question
+    if isinstance(value, str):
+        return value.strip().casefold()
+    if isinstance(value, dict):
+        return {key: normalize(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [normalize(item) for item in value]
+    return value
+
+
+def cache_key(name, arguments):
+    payload = json.dumps(normalize(arguments), sort_keys=True, default=str)
+    return f'tool:{name}:{hashlib.sha256(payload.encode()).hexdigest()}'
+
+
+def cached_tool(func):
+    # Caches the tool's result per normalized arguments for its TTL. Callers can
+    # pass skip_cache=True to go to the provider and refresh the cached value.
+    # Only successful results are kept: a tool raises ToolError (or anything
+    # else) on failure, and empty results are passed through uncached.
+    signature = inspect.signature(func)
+
+    @functools.wraps(func)
+    def wrapper(*args, skip_cache=False, **kwargs):
+        ttl = tool_ttl(func.__name__)
+        if not ttl:
+            return func(*args, **kwargs)
+
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        key = cache_key(func.__name__, bound.arguments)
+        cache = caches[settings.CHATBOT_TOOL_CACHE]
+        if not skip_cache:
+            result = cache.get(key)
+            if result is not None:
+                record_cache('tools', hits=1)
+                return result
+            record_cache('tools', misses=1)
+
+        result = func(*args, **kwargs)
+        if result:
+            cache.set(key, result, ttl)
+        return result
+
+    return wrapper
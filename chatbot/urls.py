@@ -4,6 +4,8 @@ from . import views
 urlpatterns = [
     path('new', views.post_new),
     path('chat/<str:thread_id>', views.chat),
+    path('stream/new', views.stream_new),
+    path('stream/chat/<str:thread_id>', views.stream_chat),
     path('uploadfile/<str:pid>',views.uploadfile_and_update),
     path('deletefile', views.delete_file),
 ]
\ No newline at end of file
@@ -1,30 +1,56 @@
 # views.py
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.conf import settings
 from django.core.exceptions import ObjectDoesNotExist
 import time
 import os
-import requests
+import logging
+from core import http_client
+from core.metrics import upstream
+from core.timing import span, wrap
 import json
 from collections import OrderedDict
-from portfolio.views import write_view_outputs_to_file
-from .models import OpenAIFile 
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from django.db import connections
+from django.db.models import Q
+from portfolio.views import portfolio_ledger_hash, write_view_outputs_to_file
+from .models import OpenAIFile, ThreadMessage
+from . import streaming
+from .tool_cache import cached_tool, ToolError
+from .files import sync_portfolio_file, collect_garbage
 from portfolio.models import Portfolio, Asset
 from portfolio.views import create_portfolio, create_transaction
-from openai import OpenAI
-import yfinance as yf
-from pypfopt import risk_models
-from pypfopt import expected_returns
-from pypfopt import EfficientFrontier
+from asset.quote_cache import get_info
+from asset.price_store import get_closes
 from dotenv import load_dotenv
 
 load_dotenv()
 
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# Built by get_client() on first use, importing openai takes about half a second
+client = None
 ASSISTANT_ID = os.getenv("ASSISTANT_ID")
 SERPAPI_API_KEY = os.getenv("SERPAPI_API_KEY")
 FMP_APIKEY = os.getenv("FMP_APIKEY")
+SERPAPI_URL = 'https://serpapi.com/search'
+
+def get_client():
+    global client
+    if client is None:
+        from openai import OpenAI
+        client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    return client
+
+
+logger = logging.getLogger(__name__)
+
+# Tool calls from one requires_action step run side by side on this pool. A tool
+# that times out is reported to the assistant straight away, but a thread can't
+# be stopped: if it had already started it keeps its worker until it returns.
+# The tools' own HTTP timeouts (core.http_client) bound how long that can be.
+TOOL_POOL = ThreadPoolExecutor(max_workers=getattr(settings, 'CHATBOT_TOOL_WORKERS', 8), thread_name_prefix='chatbot-tool')
+DEFAULT_TOOL_TIMEOUT = 20
+TOOL_TIMEOUTS = getattr(settings, 'CHATBOT_TOOL_TIMEOUTS', {})
 
 
 @csrf_exempt
@@ -32,9 +58,9 @@ def post_new(request):
     print("Received request")
     if request.method == 'POST':
         print("Processing POST request")
-        thread = client.beta.threads.create()
+        thread = get_client().beta.threads.create()
         print(f"Created thread with ID: {thread.id}")
-        client.beta.threads.messages.create(
+        get_client().beta.threads.messages.create(
             thread_id=thread.id,
             content="Greet the user and tell it about yourself and ask it what it is looking for.",
             role="user",
@@ -44,7 +70,7 @@ def post_new(request):
         )
         print("Created message in thread")
         
-        run = client.beta.threads.runs.create(
+        run = get_client().beta.threads.runs.create(
             thread_id=thread.id,
             assistant_id=ASSISTANT_ID
         )
@@ -71,19 +97,10 @@ def post_new(request):
 def chat(request, thread_id):
     if request.method == 'POST':
 
-        # Define your function dispatch table here
-        function_dispatch_table = {
-            'get_asset_price': get_asset_price,
-            'get_asset_info': get_asset_info,
-            'get_news': get_news,
-            'get_markettrends_and_news': get_markettrends_and_news,
-            'google_search': google_search,
-            "get_sector_performance": get_sector_performance,
-            "optimise_portfolio": optimise_portfolio,
-            "add_optimised_portfolio_to_app": add_optimised_portfolio_to_app,
-        }
-
-        content = json.loads(request.body)['content']
+        data = json.loads(request.body)
+        content = data['content']
+        # Id of the newest message the client already has, only newer ones are returned
+        after = data.get('after')
         run = submit_message(ASSISTANT_ID, thread_id, content)
         
         all_required_actions = []
@@ -92,40 +109,20 @@ def chat(request, thread_id):
             run = wait_on_run(run, thread_id)
 
             if run.status == "completed":
-                messages = get_messages(thread_id)
+                messages = get_messages(thread_id, after)
                 return JsonResponse({"required_actions": all_required_actions, "messages": messages})
 
             elif run.status == "requires_action":
                 required_actions = run.required_action.submit_tool_outputs.model_dump()
                 all_required_actions.append(required_actions)
-                tool_outputs = []
-                for action in required_actions["tool_calls"]:
-                    func_name = action["function"]["name"]
-                    print("Calling function: ", func_name)
-                    
-                    try:
-                        arguments = json.loads(action["function"]["arguments"])
-                    except json.JSONDecodeError:
-                        arguments = {}
-
-                    func = function_dispatch_table.get(func_name)
-                    if func:
-                        result = func(**arguments)  # ** unpacks the dictionary into keyword arguments
-                        output = json.dumps(result) if not isinstance(result, str) else result
-                        tool_outputs.append(
-                            {
-                                "tool_call_id": action["id"],
-                                "output": output,
-                            }
-                        )
-                    else:
-                        print(f"Function {func_name} not found in dispatch table")
-
-                run = client.beta.threads.runs.submit_tool_outputs(
-                    thread_id=thread_id,
-                    run_id=run.id,
-                    tool_outputs=tool_outputs
-                )
+                tool_outputs = call_tools(required_actions["tool_calls"])
+
+                with upstream('openai'):
+                    run = get_client().beta.threads.runs.submit_tool_outputs(
+                        thread_id=thread_id,
+                        run_id=run.id,
+                        tool_outputs=tool_outputs
+                    )
                 continue
 
             elif run.status == "cancelled":
@@ -141,41 +138,88 @@ def chat(request, thread_id):
 
     return JsonResponse({"error": "Only POST requests are allowed."}, status=405)
 
+
+@csrf_exempt
+async def stream_new(request):
+    # Streamed version of post_new: the greeting is relayed over SSE as it is generated
+    if request.method != 'POST':
+        return JsonResponse({"error": "Only POST requests are allowed."}, status=405)
+
+    async def events():
+        async with streaming.async_client() as openai:
+            try:
+                thread_id = await streaming.create_thread(openai)
+                yield streaming.sse('thread', {'thread_id': thread_id})
+                await streaming.add_message(
+                    openai, thread_id,
+                    "Greet the user and tell it about yourself and ask it what it is looking for.",
+                    metadata={"type": "hidden"},
+                )
+            except streaming.OpenAIError as e:
+                yield streaming.sse('error', {'message': str(e)})
+                return
+            async for event in streaming.stream_run(openai, thread_id, ASSISTANT_ID, call_tools):
+                yield event
+
+    return event_stream_response(events())
+
+
+@csrf_exempt
+async def stream_chat(request, thread_id):
+    # Streamed version of chat: no polling, the worker is free while the run is in progress
+    if request.method != 'POST':
+        return JsonResponse({"error": "Only POST requests are allowed."}, status=405)
+
+    content = json.loads(request.body)['content']
+
+    async def events():
+        async with streaming.async_client() as openai:
+            try:
+                await streaming.add_message(openai, thread_id, content)
+            except streaming.OpenAIError as e:
+                yield streaming.sse('error', {'message': str(e)})
+                return
+            async for event in streaming.stream_run(openai, thread_id, ASSISTANT_ID, call_tools):
+                yield event
+
+    return event_stream_response(events())
+
+
+def event_stream_response(events):
+    response = StreamingHttpResponse(events, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # Stop nginx from buffering the stream
+    return response
+
 @csrf_exempt
 def uploadfile_and_update(request, pid):
     if request.method == 'POST':
-        create_portfolio_info_file(pid)
-
-        #Upload the file to OpenAI
-        file = client.files.create(
-            file=open('chatbot/data/portfolio_data.txt', 'rb'), 
-            purpose = "assistants"
-        )
+        file_path, content_hash = create_portfolio_info_file(pid)
 
-        # Save the file ID in the database
-        openai_file = OpenAIFile(file_id=file.id)
-        openai_file.save()
+        # Upload only new content and update the assistant only if it isn't already using this file
+        openai_file, uploaded, attached = sync_portfolio_file(get_client(), ASSISTANT_ID, pid, file_path, content_hash)
 
-        #Update Assistant
-        assistant = client.beta.assistants.update(
-            ASSISTANT_ID,
-            file_ids=[file.id]
-        )
+        if uploaded:
+            # Remove a batch of the files this upload superseded from OpenAI storage
+            collect_garbage(get_client())
+            message = "File created successfully."
+        else:
+            message = "File unchanged, reusing the last upload."
 
-        return JsonResponse({"success": "File created successfully."})
+        return JsonResponse({"success": message, "file_id": openai_file.file_id, "uploaded": uploaded, "attached": attached})
     return JsonResponse({"error": "Unable to upload file."}, status=405)
 
 @csrf_exempt
 def delete_file(request):
     if OpenAIFile.objects.exists():
-        file = OpenAIFile.objects.last()
+        file = OpenAIFile.objects.filter(attached=True).last() or OpenAIFile.objects.last()
         fid = file.file_id
         if request.method == 'POST':
-            file_deletion_status = client.beta.assistants.files.delete(
+            file_deletion_status = get_client().beta.assistants.files.delete(
                 assistant_id=ASSISTANT_ID,
                 file_id=fid
             ) #Delete the file from the assistant
-            client.files.delete(fid)  # Delete the file from OpenAI storage
+            get_client().files.delete(fid)  # Delete the file from OpenAI storage
             file.delete()  # Delete the file ID from the database
             return JsonResponse({"success": "File deleted successfully: " + fid}, status=200)
     else:
@@ -184,11 +228,12 @@ def delete_file(request):
     return JsonResponse({"No files in database"}, status=200)
 
 
+@upstream('openai')
 def submit_message(assistant_id, thread_id, user_message):
-    client.beta.threads.messages.create(
+    get_client().beta.threads.messages.create(
         thread_id=thread_id, role="user", content=user_message
     )
-    return client.beta.threads.runs.create(
+    return get_client().beta.threads.runs.create(
         thread_id=thread_id,
         assistant_id=assistant_id,
     )
@@ -197,39 +242,146 @@ def submit_message(assistant_id, thread_id, user_message):
 def wait_on_run(run, thread_id):
     while run.status == "queued" or run.status == "in_progress":
         print("Inside wait on run")
-        run = client.beta.threads.runs.retrieve(
-            thread_id=thread_id,
-            run_id=run.id,
-        )
+        # Each poll is one upstream call, the sleeps between them aren't OpenAI's time
+        with upstream('openai'):
+            run = get_client().beta.threads.runs.retrieve(
+                thread_id=thread_id,
+                run_id=run.id,
+            )
         time.sleep(0.5)
     return run
 
 
-def get_messages(thread_id):
-    messages = client.beta.threads.messages.list(thread_id=thread_id)
-    result = [
-        {
-            "content": message.content[0].text.value,
-            "role": message.role,
-            "hidden": "type" in message.metadata and message.metadata["type"] == "hidden",
-            "id": message.id,
-            "created_at": message.created_at,
-            "thread_id": thread_id
-        }
-        for message in messages.data
+def sync_messages(thread_id):
+    # Pages forward from the newest stored message and stores what is new
+    last = ThreadMessage.objects.filter(thread_id=thread_id).order_by('-created_at', '-id').first()
+    params = {"order": "asc", "limit": 100}
+    if last is not None:
+        params["after"] = last.message_id
+    with upstream('openai'):
+        # Iterating follows the cursor through every page
+        messages = list(get_client().beta.threads.messages.list(thread_id=thread_id, **params))
+    new_messages = [
+        ThreadMessage(
+            thread_id=thread_id,
+            message_id=message.id,
+            role=message.role,
+            content=message.content[0].text.value if message.content and message.content[0].type == "text" else "",
+            hidden="type" in message.metadata and message.metadata["type"] == "hidden",
+            created_at=message.created_at,
+        )
+        for message in messages
     ]
+    # Another request may have stored some of these already
+    ThreadMessage.objects.bulk_create(new_messages, ignore_conflicts=True)
+
+
+def get_messages(thread_id, after=None, limit=None):
+    # Newest first like messages.list, at most `limit` of them (a page of
+    # CHATBOT_MESSAGE_PAGE_SIZE by default). With `after` (a message id the
+    # caller already has) only the messages since then are returned.
+    sync_messages(thread_id)
+    messages = ThreadMessage.objects.filter(thread_id=thread_id)
+    if after:
+        anchor = messages.filter(message_id=after).first()
+        if anchor is not None:
+            # Local ids only break ties, rows stored by separate syncs can interleave
+            messages = messages.filter(
+                Q(created_at__gt=anchor.created_at) | Q(created_at=anchor.created_at, id__gt=anchor.id)
+            )
+    messages = messages.order_by('-created_at', '-id')[:limit or settings.CHATBOT_MESSAGE_PAGE_SIZE]
+    return [message.as_dict() for message in messages]
+
+
+def run_tool(func, arguments):
+    try:
+        with span(f'tool.{func.__name__}'):
+            return func(**arguments)  # ** unpacks the dictionary into keyword arguments
+    finally:
+        # Tools run on pool threads, don't leave their database connections open
+        connections.close_all()
+
+
+def call_tools(tool_calls):
+    # Runs the assistant's tool calls concurrently and returns every output once
+    # they have all finished (or timed out), ready for a single submit_tool_outputs
+    started = time.monotonic()
+    pending = []
+    tool_outputs = []
+    for action in tool_calls:
+        func_name = action["function"]["name"]
+        print("Calling function: ", func_name)
+        
+        try:
+            arguments = json.loads(action["function"]["arguments"])
+        except json.JSONDecodeError:
+            arguments = {}
+
+        func = FUNCTION_DISPATCH_TABLE.get(func_name)
+        if func:
+            pending.append((action, TOOL_POOL.submit(wrap(run_tool), func, arguments)))
+        else:
+            print(f"Function {func_name} not found in dispatch table")
+            tool_outputs.append({"tool_call_id": action["id"], "output": json.dumps({"error": f"Unknown function {func_name}."})})
+
+    # Every tool's clock started when the batch was submitted. Collecting in deadline
+    # order means a tool is only ever checked before or at its own deadline.
+    pending.sort(key=lambda item: TOOL_TIMEOUTS.get(item[0]["function"]["name"], DEFAULT_TOOL_TIMEOUT))
+    for action, future in pending:
+        func_name = action["function"]["name"]
+        timeout = TOOL_TIMEOUTS.get(func_name, DEFAULT_TOOL_TIMEOUT)
+        try:
+            result = future.result(timeout=max(0, started + timeout - time.monotonic()))
+            output = json.dumps(result) if not isinstance(result, str) else result
+        except FutureTimeoutError:
+            # Only drops the call if it is still queued behind busy workers
+            cancelled = future.cancel()
+            logger.warning('Tool %s timed out after %ss%s', func_name, timeout, '' if cancelled else ', still holding a worker')
+            output = json.dumps({"error": f"{func_name} timed out."})
+        except Exception as e:
+            logger.warning('Tool %s failed: %s', func_name, e)
+            output = json.dumps({"error": f"{func_name} failed: {e}"})
+        tool_outputs.append(
+            {
+                "tool_call_id": action["id"],
+                "output": output,
+            }
+        )
 
-    return result
-
-
+    # Same order as the assistant asked for them
+    order = {action["id"]: i for i, action in enumerate(tool_calls)}
+    return sorted(tool_outputs, key=lambda output: order[output["tool_call_id"]])
 
 #########################################################################################################
 
 def create_portfolio_info_file(pid):
+    # One file per portfolio, returns its path and content hash
     dir_path = os.path.join(settings.BASE_DIR, 'chatbot', 'data')
-    file_path = os.path.join(dir_path, 'portfolio_data.txt')
-    write_view_outputs_to_file(pid, file_path)
+    file_path = os.path.join(dir_path, f'portfolio_{pid}.txt')
+    content_hash = portfolio_ledger_hash(pid)
+    # Building the file fetches market data, skip it when this ledger was uploaded before
+    if not OpenAIFile.objects.filter(content_hash=content_hash).exists():
+        write_view_outputs_to_file(pid, file_path)
+    return file_path, content_hash
+
+def provider_json(provider, url, params):
+    # SerpAPI and FMP report bad keys, quotas and unknown queries as an error
+    # body, sometimes with a 200, raise so the error isn't cached as an answer
+    response = http_client.get(provider, url, params=params)
+    try:
+        data = response.json()
+    except ValueError:
+        raise ToolError(f'{provider} returned status {response.status_code}.')
+    if isinstance(data, dict):
+        error = data.get('error') or data.get('Error Message')
+        if error:
+            raise ToolError(f'{provider}: {error}')
+    if not response.ok:
+        raise ToolError(f'{provider} returned status {response.status_code}.')
+    return data
 
+
+@cached_tool
 def get_news(topic):
     params = {
         "engine": "google",
@@ -237,8 +389,7 @@ def get_news(topic):
         "q": topic,
         "api_key": SERPAPI_API_KEY,
     }
-    response = requests.get('http://serpapi.com/search', params=params)
-    data = response.json()
+    data = provider_json('serpapi', SERPAPI_URL, params)
     news = data.get('news_results')
     news_string = ""
     for news_item in news:
@@ -255,6 +406,7 @@ def get_news(topic):
             print("Encountered None value in news data.")
     return news_string
 
+@cached_tool
 def get_markettrends_and_news(topic):
     # Topics:
         #indexes
@@ -271,8 +423,7 @@ def get_markettrends_and_news(topic):
         "trend": topic,
         "api_key": SERPAPI_API_KEY,
     }
-    response = requests.get('http://serpapi.com/search', params=params)
-    data = response.json()
+    data = provider_json('serpapi', SERPAPI_URL, params)
     
     if topic == "Market-indexes":
         market_trends = data.get('market_trends')
@@ -302,9 +453,9 @@ def get_markettrends_and_news(topic):
     
     return market_trends_and_news
 
+@cached_tool
 def get_asset_info(symbol):
-    stock = yf.Ticker(symbol)
-    info = stock.info
+    info = get_info(symbol)
     data = {
         "General": {
             'company_name': info.get('longName'),
@@ -358,13 +509,16 @@ def get_asset_info(symbol):
 
     return data
 
+@cached_tool
 def get_asset_price(symbol):
-    stock = yf.Ticker(symbol)
-    info = stock.info
+    info = get_info(symbol, ['regularMarketOpen'])
     price=info.get('regularMarketOpen')
+    if price is None:
+        raise ToolError(f'No price for {symbol}.')
     data = str(price) + " USD"
     return data
 
+@cached_tool
 def google_search(query):
     params = {
         "engine": "google",
@@ -373,8 +527,7 @@ def google_search(query):
         "hl": "en",
         "api_key": SERPAPI_API_KEY,
     }
-    response = requests.get('http://serpapi.com/search', params=params)
-    data = response.json()
+    data = provider_json('serpapi', SERPAPI_URL, params)
 
     result = {}
 
@@ -397,14 +550,13 @@ def google_search(query):
 
     return result
 
+@cached_tool
 def get_sector_performance():
     url = "https://financialmodelingprep.com/api/v3/sector-performance?"
     params = {
         "apikey": FMP_APIKEY
     }
-    response = requests.get(url, params=params)
-
-    return response.json()
+    return provider_json('fmp', url, params)
 
 def optimise_portfolio(pid, method = "max_sharpe" ):
     try:
@@ -421,7 +573,7 @@ def optimise_portfolio(pid, method = "max_sharpe" ):
     price_dict = {}
     tickers = []
     for asset in assets:
-        price = yf.Ticker(asset.ticker).info.get('regularMarketOpen')
+        price = get_info(asset.ticker, ['regularMarketOpen']).get('regularMarketOpen')
         value = round(float(price) * float(asset.units), 2)
         portfolio_value += value
         price_dict[asset.ticker.upper()] = price  # Convert key to uppercase directly
@@ -432,9 +584,10 @@ def optimise_portfolio(pid, method = "max_sharpe" ):
     price_dict = OrderedDict(sorted(price_dict.items()))
     
     # Perform Mean Variance Optimisation
-    ohlc = yf.download(tickers, period="max")
-    prices = ohlc["Adj Close"].dropna()
-    prices = prices.dropna()
+    prices = get_closes(tickers).dropna()
+
+    # pypfopt pulls in cvxpy and scipy, only load them when a portfolio is optimised
+    from pypfopt import risk_models, expected_returns, EfficientFrontier
 
     S = risk_models.CovarianceShrinkage(prices).ledoit_wolf()
     mu = expected_returns.capm_return(prices)
@@ -478,8 +631,7 @@ def add_optimised_portfolio_to_app(allocations, uid):
         # Iterate over allocations and create a transaction for each asset
         for allocation in allocations:
             # Get stock information
-            stock = yf.Ticker(allocation['asset_ticker'])
-            info = stock.info
+            info = get_info(allocation['asset_ticker'])
             asset_name = info.get('longName')
             asset_ticker = allocation['asset_ticker']
             asset_type = info.get('quoteType', 'Others')
@@ -501,3 +653,16 @@ def add_optimised_portfolio_to_app(allocations, uid):
         # If something went wrong, return the error message
         print(f"Caught exception: {str(e)}")
         return f"Something went wrong: {str(e)}"
+
+
+# Functions the assistant can call
+FUNCTION_DISPATCH_TABLE = {
+    'get_asset_price': get_asset_price,
+    'get_asset_info': get_asset_info,
+    'get_news': get_news,
+    'get_markettrends_and_news': get_markettrends_and_news,
+    'google_search': google_search,
+    "get_sector_performance": get_sector_performance,
+    "optimise_portfolio": optimise_portfolio,
+    "add_optimised_portfolio_to_app": add_optimised_portfolio_to_app,
+}
@@ -0,0 +1,366 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import timedelta
+from urllib.parse import urlsplit
+
+import httpx
+from openai import OpenAI
+import requests
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.urls import URLResolver, get_resolver
+from django.utils import timezone
+
+from asset.async_client import market_data
+from asset.price_store import price_store
+from asset.providers import SyntheticProvider, set_provider
+from asset.quote_cache import quote_cache
+from chatbot import streaming
+from chatbot import views as chatbot_views
+from chatbot.models import OpenAIFile
+from chatbot.openai_stub import OpenAIStub
+from portfolio.importer import import_transactions
+from portfolio.models import Portfolio
+from portfolio.views import create_transaction
+
+from .http_client import provider_client
+
+# Shared by the benchmark_endpoints and loadtest commands: synthetic data, fake
+# upstreams and one request recipe per route.
+
+SCALES = {
+    'small': {'assets': 10, 'transactions': 100},
+    'medium': {'assets': 100, 'transactions': 10_000},
+    'large': {'assets': 1000, 'transactions': 100_000},
+}
+
+# Apps whose routes are benchmarked
+URLCONFS = ('portfolio.urls', 'asset.urls', 'chatbot.urls')
+
+# API keys the views refuse to run without
+STUB_ENV = ('NEWS_API_KEY', 'LOGO_API_KEY', 'SERPAPI_API_KEY', 'FMP_APIKEY')
+
+# Canned JSON per upstream host, shaped like the parts the views read
+UPSTREAM_PAYLOADS = {
+    'api.marketaux.com': {
+        'meta': {'found': 1, 'returned': 1, 'limit': 3, 'page': 1},
+        'data': [{'uuid': 'stub', 'title': 'Stub headline', 'description': '', 'url': 'https://example.com/news',
+                  'published_at': '2024-01-02T00:00:00.000000Z', 'entities': []}],
+    },
+    'api.api-ninjas.com': [{'name': 'Stub Inc.', 'ticker': 'STUB', 'image': 'https://example.com/logo.png'}],
+    'serpapi.com': {
+        'news_results': [{'title': 'Stub headline', 'snippet': '', 'link': 'https://example.com/news', 'date': '1 hour ago'}],
+        'market_trends': [{'title': 'Market indexes', 'results': [{'stock': 'STUB', 'name': 'Stub', 'price': '100.00'}]}],
+        'answer_box': {'title': 'Stub', 'answer': 'Stub answer'},
+    },
+    'financialmodelingprep.com': [{'sector': 'Technology', 'changesPercentage': '0.5000%'}],
+}
+
+
+class UpstreamStub:
+    # Answers every news, logo, search and sector call with UPSTREAM_PAYLOADS after
+    # `latency` seconds, for the requests session and the async httpx client alike.
+    # Counts calls per host so duplicate fetches show up.
+
+    def __init__(self, latency=0.0, payloads=None):
+        self.latency = latency
+        self.payloads = payloads or UPSTREAM_PAYLOADS
+        self.calls = Counter()
+        self._lock = threading.Lock()
+
+    def payload(self, url):
+        host = urlsplit(str(url)).hostname
+        with self._lock:
+            self.calls[host] += 1
+        return self.payloads.get(host, {})
+
+    def adapter(self):
+        return StubAdapter(self)
+
+    def transport(self):
+        async def handle(request):
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            return httpx.Response(200, json=self.payload(request.url))
+        return httpx.MockTransport(handle)
+
+
+class StubAdapter(requests.adapters.BaseAdapter):
+    def __init__(self, stub):
+        super().__init__()
+        self.stub = stub
+
+    def send(self, request, **kwargs):
+        if self.stub.latency:
+            time.sleep(self.stub.latency)
+        response = requests.Response()
+        response.status_code = 200
+        response._content = json.dumps(self.stub.payload(request.url)).encode()
+        response.headers['Content-Type'] = 'application/json'
+        response.encoding = 'utf-8'
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+
+@dataclass
+class Upstreams:
+    http: UpstreamStub
+    openai: OpenAIStub
+    market_data: SyntheticProvider
+
+
+@contextmanager
+def stub_upstreams(latency=0.0, seed=0):
+    # Points Yahoo Finance, the HTTP APIs and OpenAI at in-process fakes and gives
+    # the price store an empty scratch directory. Everything is put back on exit.
+    upstreams = Upstreams(UpstreamStub(latency), OpenAIStub(latency=latency), SyntheticProvider(latency=latency, seed=seed))
+
+    previous_provider = set_provider(upstreams.market_data)
+    previous_root = price_store.root
+    price_store.root = tempfile.mkdtemp(prefix='bench-prices-')
+    quote_cache.invalidate()
+    previous_adapters = dict(provider_client.session.adapters)
+    for prefix in ('https://', 'http://'):
+        provider_client.session.mount(prefix, upstreams.http.adapter())
+    previous_transport = market_data.transport
+    market_data.transport = upstreams.http.transport()
+    market_data._clients.clear()
+    previous_client, previous_stream_transport = chatbot_views.client, streaming.TRANSPORT
+    previous_assistant = chatbot_views.ASSISTANT_ID
+    chatbot_views.ASSISTANT_ID = previous_assistant or 'asst_stub'
+    chatbot_views.client = OpenAI(api_key='stub', http_client=httpx.Client(transport=upstreams.openai.transport()))
+    streaming.TRANSPORT = upstreams.openai.async_transport()
+    previous_env = {key: os.environ.get(key) for key in STUB_ENV}
+    for key in STUB_ENV:
+        os.environ.setdefault(key, 'stub')
+
+    try:
+        yield upstreams
+    finally:
+        for key, value in previous_env.items():
+            if value is None:
+                os.environ.pop(key, None)
+        chatbot_views.client, streaming.TRANSPORT = previous_client, previous_stream_transport
+        chatbot_views.ASSISTANT_ID = previous_assistant
+        market_data.transport = previous_transport
+        market_data._clients.clear()
+        provider_client.session.adapters.clear()
+        provider_client.session.adapters.update(previous_adapters)
+        shutil.rmtree(price_store.root, ignore_errors=True)
+        price_store.root = previous_root
+        quote_cache.invalidate()
+        set_provider(previous_provider)
+
+
+def synthetic_rows(n_assets, n_transactions, seed=0, years=5):
+    # Date ordered buys and sells over `years`, never selling more than is held
+    rng = random.Random(seed)
+    start = timezone.now() - timedelta(days=365 * years)
+    minutes = sorted(rng.randrange(365 * years * 24 * 60) for _ in range(n_transactions))
+    held = [0] * n_assets
+    rows = []
+    for i, minute in enumerate(minutes):
+        # Every asset gets a buy first, then trades pick assets at random
+        index = i if i < n_assets else rng.randrange(n_assets)
+        if held[index] > 1 and rng.random() < 0.25:
+            transaction_type, units = 'sell', rng.randint(1, held[index] // 2)
+            held[index] -= units
+        else:
+            transaction_type, units = 'buy', rng.randint(1, 100)
+            held[index] += units
+        rows.append({
+            'transaction_type': transaction_type,
+            'asset_name': f'Synthetic {index}',
+            'asset_ticker': f'T{index:04d}',
+            'asset_type': 'Stock',
+            'asset_sector': 'Technology',
+            'units': units,
+            'price': round(rng.uniform(10, 500), 2),
+            'fee': round(rng.uniform(0, 5), 2),
+            'transaction_date': (start + timedelta(minutes=minute)).isoformat(),
+        })
+    return rows
+
+
+def seed_portfolio(user, n_assets, n_transactions, seed=0, name='Benchmark'):
+    # Goes through the CSV/JSON importer so assets, lots and the snapshot are consistent
+    portfolio = Portfolio.objects.create(user=user, name=name)
+    import_transactions(portfolio, synthetic_rows(n_assets, n_transactions, seed))
+    return portfolio
+
+
+@dataclass
+class Request:
+    method: str
+    path: str
+    body: object = None
+
+    def data(self):
+        return json.dumps(self.body) if self.body is not None else None
+
+
+@dataclass
+class Fixture:
+    # What the route recipes need: a seeded portfolio and its owner, plus
+    # throwaway objects for the routes that delete something
+    user: object
+    portfolio: object
+    symbol: str = 'T0000'
+    thread_id: str = 'thread_bench'
+    counter: int = field(default=0)
+
+    def next(self):
+        self.counter += 1
+        return self.counter
+
+    def scratch_portfolio(self):
+        return Portfolio.objects.create(user=self.user, name=f'Scratch {self.next()}')
+
+    def scratch_transaction(self):
+        return create_transaction(self.portfolio.id, 'buy', 'Synthetic 0', self.symbol, 'Stock', 'Technology', 1, 100)
+
+    def scratch_file(self):
+        return OpenAIFile.objects.create(file_id=f'file_scratch_{self.next()}', attached=True)
+
+
+def transaction_body(fixture):
+    return {
+        'pid': fixture.portfolio.id, 'transaction_type': 'buy', 'asset_name': 'Synthetic 0',
+        'asset_ticker': fixture.symbol, 'asset_type': 'Stock', 'asset_sector': 'Technology',
+        'units': 1, 'price': 100, 'fee': 1,
+    }
+
+
+def delete_file_request(fixture):
+    fixture.scratch_file()  # delete_file removes the attached upload
+    return Request('POST', '/api/deletefile')
+
+
+# Route pattern -> function building a request against the fixture. Setup such
+# as creating the row a DELETE removes happens here, outside the timed call.
+ROUTES = {
+    'portfolio/create/': lambda f: Request('POST', '/portfolio/create/', {'user_id': f.user.id, 'name': f'Created {f.next()}'}),
+    'portfolio/get-all/<int:user_id>/': lambda f: Request('GET', f'/portfolio/get-all/{f.user.id}/'),
+    'portfolio/update/<int:portfolio_id>/': lambda f: Request('PUT', f'/portfolio/update/{f.portfolio.id}/', {'remarks': f'Updated {f.next()}'}),
+    'portfolio/delete/<int:portfolio_id>/': lambda f: Request('DELETE', f'/portfolio/delete/{f.scratch_portfolio().id}/'),
+    'portfolio/create-transaction/': lambda f: Request('POST', '/portfolio/create-transaction/', transaction_body(f)),
+    'portfolio/<int:portfolio_id>/import-transactions/': lambda f: Request(
+        'POST', f'/portfolio/{f.scratch_portfolio().id}/import-transactions/', synthetic_rows(10, 100, seed=f.next()),
+    ),
+    'portfolio/<int:portfolio_id>/assets/': lambda f: Request('GET', f'/portfolio/{f.portfolio.id}/assets/'),
+    'portfolio/<int:portfolio_id>/assets/async/': lambda f: Request('GET', f'/portfolio/{f.portfolio.id}/assets/async/'),
+    'portfolio/<int:portfolio_id>/transactions/': lambda f: Request('GET', f'/portfolio/{f.portfolio.id}/transactions/'),
+    'portfolio/transaction/<int:transaction_id>/delete/': lambda f: Request('DELETE', f'/portfolio/transaction/{f.scratch_transaction().id}/delete/'),
+    'portfolio/portfolio-value/<int:portfolio_id>/': lambda f: Request('GET', f'/portfolio/portfolio-value/{f.portfolio.id}/'),
+    'portfolio/portfolio-value/<int:portfolio_id>/async/': lambda f: Request('GET', f'/portfolio/portfolio-value/{f.portfolio.id}/async/'),
+    'portfolio/<int:portfolio_id>/dividends/': lambda f: Request('GET', f'/portfolio/{f.portfolio.id}/dividends/'),
+    'portfolio/<int:portfolio_id>/portfoliovalue/': lambda f: Request('GET', f'/portfolio/{f.portfolio.id}/portfoliovalue/'),
+    'portfolio/<int:portfolio_id>/portfolionews/': lambda f: Request('GET', f'/portfolio/{f.portfolio.id}/portfolionews/'),
+    'portfolio/<int:portfolio_id>/portfolionews/async/': lambda f: Request('GET', f'/portfolio/{f.portfolio.id}/portfolionews/async/'),
+    'portfolio/<int:portfolio_id>/portfoliometrics/': lambda f: Request('GET', f'/portfolio/{f.portfolio.id}/portfoliometrics/'),
+    'portfolio/<int:portfolio_id>/portfoliometrics/async/': lambda f: Request('GET', f'/portfolio/{f.portfolio.id}/portfoliometrics/async/'),
+    'portfolio/spmetrics/': lambda f: Request('GET', '/portfolio/spmetrics/'),
+
+    'public/asset/': lambda f: Request('GET', f'/public/asset/?symbol={f.symbol}'),
+    'public/asset/async/': lambda f: Request('GET', f'/public/asset/async/?symbol={f.symbol}'),
+    'public/asset/price-history/': lambda f: Request('GET', f'/public/asset/price-history/?symbol={f.symbol}'),
+    'public/asset/summary/': lambda f: Request('GET', f'/public/asset/summary/?symbol={f.symbol}'),
+    'public/asset/news/': lambda f: Request('GET', f'/public/asset/news/?symbol={f.symbol}'),
+    'public/asset/logo/': lambda f: Request('GET', f'/public/asset/logo/?symbol={f.symbol}'),
+    'public/asset/dividend/': lambda f: Request('GET', f'/public/asset/dividend/?symbol={f.symbol}'),
+    'public/asset/dividend/summary/': lambda f: Request('GET', f'/public/asset/dividend/summary/?symbol={f.symbol}'),
+    'public/asset/dividend/yield/': lambda f: Request('GET', f'/public/asset/dividend/yield/?symbol={f.symbol}'),
+    'public/asset/financials/income-statement/': lambda f: Request('GET', f'/public/asset/financials/income-statement/?symbol={f.symbol}'),
+    'public/asset/financials/balance-sheet/': lambda f: Request('GET', f'/public/asset/financials/balance-sheet/?symbol={f.symbol}'),
+    'public/asset/financials/cash-flow/': lambda f: Request('GET', f'/public/asset/financials/cash-flow/?symbol={f.symbol}'),
+
+    'api/new': lambda f: Request('POST', '/api/new'),
+    'api/chat/<str:thread_id>': lambda f: Request('POST', f'/api/chat/{f.thread_id}', {'content': 'How is my portfolio doing?'}),
+    'api/stream/new': lambda f: Request('POST', '/api/stream/new'),
+    'api/stream/chat/<str:thread_id>': lambda f: Request('POST', f'/api/stream/chat/{f.thread_id}', {'content': 'How is my portfolio doing?'}),
+    'api/uploadfile/<str:pid>': lambda f: Request('POST', f'/api/uploadfile/{f.portfolio.id}'),
+    'api/deletefile': lambda f: delete_file_request(f),
+}
+
+# What one simulated user does per loadtest iteration, as routes from ROUTES.
+# The dashboard loads its panels one after the other.
+SCENARIOS = {
+    'dashboard': (
+        'portfolio/<int:portfolio_id>/assets/',
+        'portfolio/portfolio-value/<int:portfolio_id>/',
+        'portfolio/<int:portfolio_id>/portfoliovalue/',
+        'portfolio/<int:portfolio_id>/portfoliometrics/',
+        'portfolio/<int:portfolio_id>/dividends/',
+        'portfolio/<int:portfolio_id>/portfolionews/',
+    ),
+    'transaction': ('portfolio/create-transaction/',),
+    'chat': ('api/chat/<str:thread_id>',),
+}
+
+
+@contextmanager
+def test_database(on_disk=False):
+    # The real database is never touched, a test database is created for the run
+    # and dropped after. SQLite's in-memory test database fails concurrent writes
+    # straight away instead of waiting on the lock, pass on_disk to get a file.
+    setup_test_environment()
+    test_settings = connection.settings_dict['TEST']
+    previous_name = test_settings.get('NAME')
+    scratch = None
+    if on_disk and connection.vendor == 'sqlite' and not previous_name:
+        scratch = tempfile.mkdtemp(prefix='bench-db-')
+        test_settings['NAME'] = os.path.join(scratch, 'db.sqlite3')
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    # One log line per request would drown the report
+    timing_logger = logging.getLogger('core.timing')
+    log_level = timing_logger.level
+    timing_logger.setLevel(logging.WARNING)
+    try:
+        yield
+    finally:
+        timing_logger.setLevel(log_level)
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        test_settings['NAME'] = previous_name
+        if scratch:
+            shutil.rmtree(scratch, ignore_errors=True)
+        teardown_test_environment()
+
+
+def app_routes():
+    # Every route of the benchmarked apps, prefixed the way core/urls.py mounts them
+    routes = []
+    for resolver in get_resolver().url_patterns:
+        # include() stores the imported module
+        if isinstance(resolver, URLResolver) and getattr(resolver.urlconf_name, '__name__', None) in URLCONFS:
+            routes += [str(resolver.pattern) + str(pattern.pattern) for pattern in resolver.url_patterns]
+    return routes
+
+
+def consume(response):
+    # Streamed responses are only produced as they are read
+    if response.streaming:
+        return b''.join(response)
+    return response.content
+
+
+def db_queries(response):
+    # Query count from the Server-Timing header set by ServerTimingMiddleware
+    for metric in response.get('Server-Timing', '').split(', '):
+        name, _, rest = metric.partition(';')
+        if name == 'db':
+            return int(rest.rsplit('desc="', 1)[1].rstrip('x"'))
+    return 0
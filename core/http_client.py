@@ -0,0 +1,76 @@
+import random
+import time
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+from . import metrics
+from .timing import span
+
+# Throttling and transient upstream errors, anything else is returned as is
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class ProviderClient:
+    # One keep-alive session shared by every provider call, so repeated calls to
+    # the same host reuse the pooled connection instead of a fresh TCP+TLS handshake.
+
+    def __init__(self, providers, pool_size=20, backoff=0.25, max_backoff=4, sleep=time.sleep):
+        # providers maps a provider name to its (connect, read) timeouts in seconds and
+        # how many times a failed request is retried, 'default' covers the rest
+        self.providers = providers
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.sleep = sleep
+        self.session = requests.Session()
+        # Retries are done here rather than by urllib3 so they show up in the upstream metrics
+        adapter = HTTPAdapter(pool_connections=len(self.providers), pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def config(self, provider):
+        return self.providers.get(provider, self.providers['default'])
+
+    def delay(self, attempt, response=None):
+        # Full jitter exponential backoff, unless the provider says when to come back
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), self.max_backoff)
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def get(self, provider, url, **kwargs):
+        with span(provider):
+            return self._get(provider, url, **kwargs)
+
+    def _get(self, provider, url, **kwargs):
+        config = self.config(provider)
+        kwargs.setdefault('timeout', config['timeout'])
+        retries = config['retries']
+        for attempt in range(retries + 1):
+            started = time.perf_counter()
+            response = error = None
+            try:
+                response = self.session.get(url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+            failed = error is not None or response.status_code in RETRY_STATUSES
+            metrics.record_upstream(provider, time.perf_counter() - started, error=failed, retry=attempt > 0)
+
+            if not failed or attempt == retries:
+                break
+            self.sleep(self.delay(attempt, response))
+
+        if error is not None:
+            raise error
+        return response
+
+
+provider_client = ProviderClient(
+    providers=settings.HTTP_PROVIDERS,
+    pool_size=settings.HTTP_POOL_SIZE,
+)
+
+
+def get(provider, url, **kwargs):
+    return provider_client.get(provider, url, **kwargs)
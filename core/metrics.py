@@ -0,0 +1,206 @@
+import atexit
+import glob
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from .timing import span
+
+# Histogram upper bounds in seconds, +Inf is implied
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# Everything the app reports, name -> (type, help)
+METRICS = {
+    'http_requests_total': ('counter', 'Requests handled, by route and status.'),
+    'http_request_duration_seconds': ('histogram', 'Time to produce the response, by route.'),
+    'db_queries_total': ('counter', 'Database queries run while handling requests, by route.'),
+    'db_query_seconds_total': ('counter', 'Time spent in database queries while handling requests, by route.'),
+    'upstream_requests_total': ('counter', 'Calls to market data, news, search and OpenAI providers, retries included.'),
+    'upstream_errors_total': ('counter', 'Upstream calls that failed or came back with a retryable status.'),
+    'upstream_retries_total': ('counter', 'Upstream calls that retried a failed one, by provider.'),
+    'upstream_request_duration_seconds': ('histogram', 'Upstream call latency, by provider.'),
+    'cache_hits_total': ('counter', 'Lookups served from cache, by cache.'),
+    'cache_misses_total': ('counter', 'Lookups that had to go to the provider, by cache.'),
+}
+
+
+def _key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels, **extra):
+    pairs = [*labels, *extra.items()]
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format(value):
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Registry:
+    # Counters and histograms of this process, written to <directory>/<pid>.json at
+    # most every flush_interval seconds. render() adds up the files of every worker,
+    # so whichever worker serves /metrics reports for all of them.
+    #
+    # Files of workers that exited are kept so their counts don't go backwards;
+    # clear the directory when deploying.
+
+    def __init__(self, directory, flush_interval=1.0):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._counters = defaultdict(float)
+        self._histograms = {}
+        self._lock = threading.Lock()
+        self._flushed_at = 0.0
+
+    @property
+    def path(self):
+        return os.path.join(self.directory, f'{os.getpid()}.json')
+
+    def inc(self, name, value=1, **labels):
+        with self._lock:
+            self._counters[name, _key(labels)] += value
+        self.maybe_flush()
+
+    def observe(self, name, value, **labels):
+        with self._lock:
+            histogram = self._histograms.get((name, _key(labels)))
+            if histogram is None:
+                histogram = self._histograms[name, _key(labels)] = {
+                    'buckets': [0] * (len(LATENCY_BUCKETS) + 1), 'sum': 0.0, 'count': 0,
+                }
+            index = next((i for i, bound in enumerate(LATENCY_BUCKETS) if value <= bound), len(LATENCY_BUCKETS))
+            histogram['buckets'][index] += 1
+            histogram['sum'] += value
+            histogram['count'] += 1
+        self.maybe_flush()
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'counters': [[name, list(labels), value] for (name, labels), value in self._counters.items()],
+                'histograms': [
+                    [name, list(labels), {**histogram, 'buckets': list(histogram['buckets'])}]
+                    for (name, labels), histogram in self._histograms.items()
+                ],
+            }
+
+    def maybe_flush(self):
+        if time.monotonic() - self._flushed_at >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        self._flushed_at = time.monotonic()
+        snapshot = self.snapshot()
+        if not snapshot['counters'] and not snapshot['histograms']:
+            return  # Nothing recorded, e.g. a management command
+        os.makedirs(self.directory, exist_ok=True)
+        # Write then rename so a reader never sees half a file
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(snapshot, f)
+        os.replace(tmp_path, self.path)
+
+    def collect(self):
+        # Adds up the snapshots of every worker
+        self.flush()
+        counters = defaultdict(float)
+        histograms = {}
+        for path in glob.glob(os.path.join(self.directory, '*.json')):
+            try:
+                with open(path) as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError):
+                continue  # Replaced or removed while reading
+            for name, labels, value in snapshot['counters']:
+                counters[name, tuple(map(tuple, labels))] += value
+            for name, labels, histogram in snapshot['histograms']:
+                key = (name, tuple(map(tuple, labels)))
+                total = histograms.setdefault(key, {'buckets': [0] * (len(LATENCY_BUCKETS) + 1), 'sum': 0.0, 'count': 0})
+                total['buckets'] = [a + b for a, b in zip(total['buckets'], histogram['buckets'])]
+                total['sum'] += histogram['sum']
+                total['count'] += histogram['count']
+        return counters, histograms
+
+    def render(self):
+        # Prometheus text exposition format
+        counters, histograms = self.collect()
+        lines = []
+        for name, (kind, help_text) in METRICS.items():
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            if kind == 'counter':
+                for (metric, labels), value in sorted(counters.items()):
+                    if metric == name:
+                        lines.append(f'{name}{_labels(labels)} {_format(value)}')
+            else:
+                for (metric, labels), histogram in sorted(histograms.items()):
+                    if metric != name:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip((*LATENCY_BUCKETS, '+Inf'), histogram['buckets']):
+                        cumulative += count
+                        lines.append(f'{name}_bucket{_labels(labels, le=bound)} {cumulative}')
+                    lines.append(f'{name}_sum{_labels(labels)} {_format(histogram["sum"])}')
+                    lines.append(f'{name}_count{_labels(labels)} {histogram["count"]}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry(
+    directory=settings.METRICS_DIR,
+    flush_interval=settings.METRICS_FLUSH_INTERVAL,
+)
+atexit.register(registry.flush)
+
+
+def inc(name, value=1, **labels):
+    registry.inc(name, value, **labels)
+
+
+def observe(name, value, **labels):
+    registry.observe(name, value, **labels)
+
+
+def record_upstream(provider, seconds, error=False, retry=False):
+    inc('upstream_requests_total', provider=provider)
+    if error:
+        inc('upstream_errors_total', provider=provider)
+    if retry:
+        inc('upstream_retries_total', provider=provider)
+    observe('upstream_request_duration_seconds', seconds, provider=provider)
+
+
+def record_cache(cache, hits=0, misses=0):
+    if hits:
+        inc('cache_hits_total', hits, cache=cache)
+    if misses:
+        inc('cache_misses_total', misses, cache=cache)
+
+
+@contextmanager
+def upstream(provider):
+    # Times a provider call that doesn't go through core.http_client (yfinance,
+    # OpenAI) for both the request's Server-Timing and the upstream metrics.
+    # Also works as a decorator.
+    started = time.perf_counter()
+    error = False
+    try:
+        with span(provider):
+            yield
+    except Exception:
+        error = True
+        raise
+    finally:
+        record_upstream(provider, time.perf_counter() - started, error=error)
@@ -0,0 +1,66 @@
+import json
+import logging
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from . import metrics, timing
+
+logger = logging.getLogger('core.timing')
+
+
+class ServerTimingMiddleware:
+    # Adds a Server-Timing header with the request's spans (database queries,
+    # provider calls, compute sections) and logs the same breakdown as one JSON line.
+    # For streamed responses only the time until the response starts is covered.
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+        timing.install()
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        timings, token = timing.begin()
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            timing.end(token)
+        return self.finish(request, response, timings, time.perf_counter() - started)
+
+    async def __acall__(self, request):
+        timings, token = timing.begin()
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            timing.end(token)
+        return self.finish(request, response, timings, time.perf_counter() - started)
+
+    def finish(self, request, response, timings, total):
+        response['Server-Timing'] = timings.header(total)
+        self.record(request, response, timings, total)
+        logger.info(json.dumps({
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'total_ms': round(total * 1000, 1),
+            'spans': timings.as_dict(),
+        }))
+        return response
+
+    def record(self, request, response, timings, total):
+        # Labelled by URL pattern rather than path so ids don't make a series each
+        route = getattr(request.resolver_match, 'route', None) or 'unmatched'
+        metrics.inc('http_requests_total', method=request.method, route=route, status=response.status_code)
+        metrics.observe('http_request_duration_seconds', total, method=request.method, route=route)
+        seconds, count = timings.spans.get('db', (0.0, 0))
+        if count:
+            metrics.inc('db_queries_total', count, route=route)
+            metrics.inc('db_query_seconds_total', seconds, route=route)
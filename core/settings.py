@@ -1,6 +1,7 @@
 from datetime import timedelta
 from pathlib import Path
 import os
+import tempfile
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -38,6 +39,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "core.middleware.ServerTimingMiddleware",
     'corsheaders.middleware.CorsMiddleware',
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
@@ -87,6 +89,9 @@ DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": BASE_DIR / "db.sqlite3",
+        # Writes to a portfolio queue on the database lock, see portfolio.models.lock_portfolio,
+        # wait for it longer than sqlite's default 5 seconds under load
+        "OPTIONS": {"timeout": 20},
     }
 }
 
@@ -181,4 +186,109 @@ REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": (
         "rest_framework_simplejwt.authentication.JWTAuthentication",
     ),
-}
\ No newline at end of file
+}
+
+# Market data
+# TTLs are in seconds and apply per field group (see asset/quote_cache.py)
+QUOTE_CACHE_MAX_SIZE = 512
+QUOTE_CACHE_TTLS = {
+    "price": 60,
+    "fundamental": 60 * 60,
+    "metadata": 24 * 60 * 60,
+}
+
+# Local on-disk store for price history and other end-of-day market data
+MARKET_DATA_DIR = BASE_DIR / "market_data"
+PRICE_STORE_REFRESH_INTERVAL = 60 * 60
+
+# Where market data comes from (see asset/providers.py): "yfinance", "record" to
+# also save every response under MARKET_DATA_RECORDINGS, or "replay" to serve the
+# saved responses offline with the given per-call latency and jitter in seconds
+MARKET_DATA_PROVIDER = os.getenv("MARKET_DATA_PROVIDER", "yfinance")
+MARKET_DATA_RECORDINGS = os.getenv("MARKET_DATA_RECORDINGS", str(MARKET_DATA_DIR / "recordings"))
+MARKET_DATA_REPLAY_LATENCY = float(os.getenv("MARKET_DATA_REPLAY_LATENCY", "0"))
+MARKET_DATA_REPLAY_JITTER = float(os.getenv("MARKET_DATA_REPLAY_JITTER", "0"))
+
+# Upstream calls the async views may have in flight at once, per event loop
+MARKET_DATA_CONCURRENCY = 16
+
+# Background refresh of the quotes of every held ticker (see asset/refresher.py),
+# started by each web worker on its first request. Keep the interval under the
+# price TTL so requests find them fresh. Price history and dividends live in the
+# shared price store: `manage.py refresh_market_data --loop` renews them every
+# MARKET_DATA_REFRESH_HISTORY_EVERY seconds. MARKET_DATA_REFRESHER_HISTORY makes
+# every worker do it too, only for single-worker setups, they'd write the same files.
+MARKET_DATA_REFRESHER = os.getenv("MARKET_DATA_REFRESHER", "0") == "1"
+MARKET_DATA_REFRESHER_HISTORY = os.getenv("MARKET_DATA_REFRESHER_HISTORY", "0") == "1"
+MARKET_DATA_REFRESH_QUOTES_EVERY = 45
+MARKET_DATA_REFRESH_HISTORY_EVERY = 30 * 60
+MARKET_DATA_REFRESH_BATCH_SIZE = 100
+
+# Outbound API calls (see core/http_client.py), timeouts are (connect, read) seconds
+HTTP_POOL_SIZE = 20
+HTTP_PROVIDERS = {
+    "marketaux": {"timeout": (3.05, 10), "retries": 2},
+    "api_ninjas": {"timeout": (3.05, 5), "retries": 2},
+    "serpapi": {"timeout": (3.05, 20), "retries": 1},
+    "fmp": {"timeout": (3.05, 10), "retries": 2},
+    "default": {"timeout": (3.05, 10), "retries": 1},
+}
+
+# Assistant tool calls: worker threads and per-tool timeouts in seconds (default 20)
+CHATBOT_TOOL_WORKERS = 8
+CHATBOT_TOOL_TIMEOUTS = {
+    "get_asset_price": 10,
+    "get_sector_performance": 15,
+    "optimise_portfolio": 60,
+    "add_optimised_portfolio_to_app": 60,
+}
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    # Results of the assistant's tool calls, see chatbot/tool_cache.py
+    "tools": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "chatbot-tools",
+        "OPTIONS": {"MAX_ENTRIES": 1000},
+    },
+}
+# Messages returned per chat response, the newest first
+CHATBOT_MESSAGE_PAGE_SIZE = 100
+
+CHATBOT_TOOL_CACHE = "tools"
+CHATBOT_TOOL_CACHE_TTLS = {
+    "get_asset_price": 60,
+    "get_asset_info": 24 * 60 * 60,
+    "get_news": 15 * 60,
+    "get_markettrends_and_news": 5 * 60,
+    "google_search": 60 * 60,
+    "get_sector_performance": 15 * 60,
+}
+
+# One JSON line per request with its Server-Timing breakdown (see core/middleware.py)
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {
+        "console": {"class": "logging.StreamHandler"},
+    },
+    "loggers": {
+        "core.timing": {
+            "handlers": ["console"],
+            "level": os.getenv("TIMING_LOG_LEVEL", "INFO"),
+            "propagate": False,
+        },
+    },
+}
+
+# Each worker process writes its metrics here and /metrics adds them up. Clear it on deploy.
+METRICS_DIR = os.getenv("METRICS_DIR", os.path.join(tempfile.gettempdir(), "bucksbuddy-metrics"))
+METRICS_FLUSH_INTERVAL = 1.0
+# /metrics only answers scrapers on these addresses, or anywhere with "Authorization: Bearer <METRICS_TOKEN>"
+METRICS_ALLOWED_IPS = os.getenv("METRICS_ALLOWED_IPS", "127.0.0.1,::1").split(",")
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+# Startup budget checked by `manage.py check_import_time`: django.setup() plus every URLconf and view
+IMPORT_TIME_BUDGET_MS = int(os.getenv("IMPORT_TIME_BUDGET_MS", 1500))
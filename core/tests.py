@@ -0,0 +1,165 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+import requests
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, TestCase
+
+from . import metrics, timing
+from .http_client import ProviderClient
+
+PROVIDERS = {
+    'flaky': {'timeout': (1, 1), 'retries': 2},
+    'default': {'timeout': (1, 1), 'retries': 0},
+}
+
+
+def response(status, headers=None):
+    result = requests.Response()
+    result.status_code = status
+    result.headers.update(headers or {})
+    return result
+
+
+class ProviderClientTests(SimpleTestCase):
+    def setUp(self):
+        self.sleeps = []
+        self.client = ProviderClient(PROVIDERS, sleep=self.sleeps.append)
+
+    def get(self, provider, *outcomes):
+        with mock.patch.object(self.client.session, 'get', side_effect=outcomes) as get, \
+                mock.patch('core.http_client.metrics.record_upstream') as self.recorded:
+            try:
+                return self.client.get(provider, 'https://example.com'), get
+            except requests.RequestException as e:
+                return e, get
+
+    def test_retryable_statuses_are_retried_until_success(self):
+        result, get = self.get('flaky', response(503), response(429), response(200))
+
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual(get.call_count, 3)
+        self.assertEqual(len(self.sleeps), 2)
+        # Each attempt is an upstream call in the metrics
+        flags = [(call.kwargs['error'], call.kwargs['retry']) for call in self.recorded.call_args_list]
+        self.assertEqual(flags, [(True, False), (True, True), (False, True)])
+
+    def test_retry_after_is_honoured_up_to_the_max_backoff(self):
+        self.get('flaky', response(429, {'Retry-After': '2'}), response(429, {'Retry-After': '60'}), response(200))
+        self.assertEqual(self.sleeps, [2.0, 4])
+
+    def test_backoff_without_retry_after_is_jittered_and_capped(self):
+        with mock.patch('core.http_client.random.uniform', side_effect=lambda low, high: high):
+            self.get('flaky', response(500), response(500), response(500))
+        self.assertEqual(self.sleeps, [0.25, 0.5])
+
+    def test_last_response_is_returned_when_retries_run_out(self):
+        result, get = self.get('flaky', response(502), response(502), response(502))
+        self.assertEqual(result.status_code, 502)
+        self.assertEqual(get.call_count, 3)
+
+    def test_client_errors_are_not_retried(self):
+        result, get = self.get('flaky', response(404))
+        self.assertEqual(result.status_code, 404)
+        self.assertEqual(get.call_count, 1)
+
+    def test_connection_errors_are_raised_after_the_last_retry(self):
+        result, get = self.get('flaky', requests.ConnectionError(), requests.Timeout(), requests.ConnectionError())
+        self.assertIsInstance(result, requests.ConnectionError)
+        self.assertEqual(get.call_count, 3)
+
+    def test_unknown_providers_use_the_default_config(self):
+        result, get = self.get('other', response(503))
+        self.assertEqual(result.status_code, 503)
+        self.assertEqual(get.call_args.kwargs['timeout'], (1, 1))
+        self.assertEqual(self.sleeps, [])
+
+
+class TimingTests(SimpleTestCase):
+    def setUp(self):
+        self.timings, token = timing.begin()
+        self.addCleanup(timing.end, token)
+
+    def test_spans_add_up_per_name(self):
+        with mock.patch('core.timing.time.perf_counter', side_effect=[1.0, 1.25, 2.0, 2.5, 3.0, 3.001]):
+            with timing.span('db'):
+                pass
+            with timing.span('db'):
+                pass
+            with timing.span('compute'):
+                pass
+
+        self.assertEqual(self.timings.as_dict(), {'db': {'ms': 750.0, 'count': 2}, 'compute': {'ms': 1.0, 'count': 1}})
+        self.assertEqual(self.timings.header(0.8), 'db;dur=750.0;desc="2x", compute;dur=1.0;desc="1x", total;dur=800.0')
+
+    def test_span_is_recorded_when_the_code_raises(self):
+        with self.assertRaises(ValueError), timing.span('tool'):
+            raise ValueError
+        self.assertEqual(self.timings.as_dict()['tool']['count'], 1)
+
+    def test_spans_outside_a_request_are_not_recorded(self):
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            pool.submit(timing.span('lost').__enter__).result()
+            pool.submit(timing.wrap(timing.timed('kept')(lambda: None))).result()
+        self.assertEqual(list(self.timings.as_dict()), ['kept'])
+
+
+class ServerTimingMiddlewareTests(TestCase):
+    def setUp(self):
+        # The test case opened its connection before any handler loaded the middleware
+        timing.install()
+
+    def test_sync_views_report_their_queries(self):
+        user = get_user_model().objects.create_user(email='user@example.com', username='user', password='password')
+        with self.assertLogs('core.timing', 'INFO') as logs:
+            response = self.client.get(f'/portfolio/get-all/{user.id}/')
+
+        self.assertIn('db;dur=', response['Server-Timing'])
+        self.assertIn('total;dur=', response['Server-Timing'])
+        line = json.loads(logs.records[-1].getMessage())
+        self.assertEqual((line['method'], line['path'], line['status']), ('GET', f'/portfolio/get-all/{user.id}/', 200))
+        self.assertGreaterEqual(line['spans']['db']['count'], 1)
+
+    async def test_async_views_are_timed(self):
+        with self.assertLogs('core.timing', 'INFO') as logs:
+            response = await self.async_client.get('/portfolio/999/assets/async/')
+
+        self.assertEqual(response.status_code, 404)
+        self.assertIn('db;dur=', response['Server-Timing'])
+        self.assertEqual(json.loads(logs.records[-1].getMessage())['status'], 404)
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        metrics.inc('upstream_requests_total', provider='test')
+
+    def test_local_scrapers_are_allowed(self):
+        response = self.client.get('/metrics', REMOTE_ADDR='127.0.0.1')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('upstream_requests_total{provider="test"}', response.content.decode())
+
+    def test_other_addresses_are_forbidden(self):
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='203.0.113.5').status_code, 403)
+
+    def test_token_allows_any_address(self):
+        with self.settings(METRICS_TOKEN='secret'):
+            allowed = self.client.get('/metrics', REMOTE_ADDR='203.0.113.5', HTTP_AUTHORIZATION='Bearer secret')
+            wrong = self.client.get('/metrics', REMOTE_ADDR='203.0.113.5', HTTP_AUTHORIZATION='Bearer guess')
+        self.assertEqual(allowed.status_code, 200)
+        self.assertEqual(wrong.status_code, 403)
+
+    def test_each_poll_of_a_run_is_one_upstream_call(self):
+        from chatbot import views
+
+        runs = iter([mock.Mock(id='run_1', status='in_progress'), mock.Mock(id='run_1', status='completed')])
+        client = mock.Mock()
+        client.beta.threads.runs.retrieve.side_effect = lambda **kwargs: next(runs)
+        with mock.patch.object(views, 'client', client), \
+                mock.patch('chatbot.views.time.sleep') as sleep, \
+                mock.patch('chatbot.views.upstream', wraps=metrics.upstream) as upstream:
+            run = views.wait_on_run(mock.Mock(id='run_1', status='queued'), 'thread_1')
+
+        self.assertEqual(run.status, 'completed')
+        self.assertEqual(upstream.call_count, 2)
+        self.assertEqual(sleep.call_count, 2)
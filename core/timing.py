@@ -0,0 +1,99 @@
+import contextvars
+import functools
+import threading
+import time
+from contextlib import contextmanager
+
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+# Timings of the request being handled. Context variables follow the request
+# into sync_to_async and asyncio.to_thread; use wrap() for other thread pools.
+_current = contextvars.ContextVar('request_timings', default=None)
+
+
+class RequestTimings:
+    def __init__(self):
+        self.spans = {}
+        self._lock = threading.Lock()
+
+    def add(self, name, seconds):
+        # Spans are inclusive, a span around code that calls the database or a
+        # provider also contains that time
+        with self._lock:
+            total, count = self.spans.get(name, (0.0, 0))
+            self.spans[name] = (total + seconds, count + 1)
+
+    def as_dict(self):
+        with self._lock:
+            return {name: {'ms': round(total * 1000, 1), 'count': count} for name, (total, count) in self.spans.items()}
+
+    def header(self, total=None):
+        metrics = [
+            f'{name};dur={values["ms"]};desc="{values["count"]}x"'
+            for name, values in self.as_dict().items()
+        ]
+        if total is not None:
+            metrics.append(f'total;dur={round(total * 1000, 1)}')
+        return ', '.join(metrics)
+
+
+def begin():
+    timings = RequestTimings()
+    return timings, _current.set(timings)
+
+
+def end(token):
+    _current.reset(token)
+
+
+def current():
+    return _current.get()
+
+
+@contextmanager
+def span(name):
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(name, time.perf_counter() - started)
+
+
+def timed(name):
+    # Decorator form of span()
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def wrap(func):
+    # Runs func in a copy of the caller's context, for work handed to a thread pool.
+    # Each call gets its own copy since a context can't be entered by two threads at once.
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.copy().run(func, *args, **kwargs)
+
+
+def record_query(execute, sql, params, many, context):
+    with span('db'):
+        return execute(sql, params, many, context)
+
+
+def install_query_timing(connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+def install():
+    # Time every query on every connection, including the ones opened by worker threads
+    connection_created.connect(install_query_timing, dispatch_uid='core.timing')
+    for connection in connections.all(initialized_only=True):
+        install_query_timing(connection)
@@ -1,6 +1,7 @@
 from django.contrib import admin
 from django.urls import path, include, re_path
 from django.views.generic import TemplateView
+from .views import metrics
 
 urlpatterns = [
     # Authenticated routes
@@ -13,6 +14,8 @@ urlpatterns = [
     path('public/', include('asset.urls')),
     # Chatbot routes
     path("api/", include("chatbot.urls")),
+    # Prometheus scrape endpoint
+    path("metrics", metrics),
 
 ]
 
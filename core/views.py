@@ -0,0 +1,22 @@
+import hmac
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+
+from .metrics import registry
+
+
+def allowed(request):
+    # Route and upstream names aren't for everyone, see METRICS_ALLOWED_IPS and METRICS_TOKEN
+    if settings.METRICS_TOKEN:
+        scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+        if scheme == 'Bearer' and hmac.compare_digest(token.encode(), settings.METRICS_TOKEN.encode()):
+            return True
+    return request.META.get('REMOTE_ADDR') in settings.METRICS_ALLOWED_IPS
+
+
+def metrics(request):
+    # Prometheus text format, summed over every worker process
+    if not allowed(request):
+        return HttpResponseForbidden()
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
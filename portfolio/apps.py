@@ -1,6 +1,15 @@
 from django.apps import AppConfig
+from django.conf import settings
+from django.core.signals import request_started
 
 
 class PortfolioConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "portfolio"
+
+    def ready(self):
+        # Background refresh of the held tickers' market data, opt in with MARKET_DATA_REFRESHER
+        if settings.MARKET_DATA_REFRESHER:
+            from asset.refresher import start_refresher
+
+            request_started.connect(start_refresher, dispatch_uid='asset.start_refresher')
@@ -0,0 +1,65 @@
+from functools import cache
+
+import numpy as np
+import pandas as pd
+from pandas.tseries.holiday import USFederalHolidayCalendar
+from pandas.tseries.offsets import CustomBusinessDay
+
+from asset.price_store import get_history
+from core.timing import timed
+
+@cache
+def business_day():
+    # Weekdays excluding US federal holidays. Building the calendar takes a
+    # quarter of a second, so it happens on first use rather than at import.
+    return CustomBusinessDay(calendar=USFederalHolidayCalendar())
+
+
+def transactions_frame(transactions):
+    # One row per transaction with the upper-cased ticker, the UTC trade date
+    # and the units signed by direction (sells are negative).
+    frame = pd.DataFrame(
+        list(transactions.values('ticker', 'transaction_type', 'units', 'transaction_date')),
+        columns=['ticker', 'transaction_type', 'units', 'transaction_date'],
+    )
+    frame['ticker'] = frame['ticker'].str.upper()
+    frame['units'] = frame['units'].astype(float) * np.where(frame['transaction_type'] == 'sell', -1, 1)
+    frame['date'] = pd.to_datetime(frame['transaction_date'], utc=True).dt.tz_localize(None).dt.normalize()
+    return frame[['ticker', 'date', 'units']]
+
+
+def holdings_matrix(transactions, dates):
+    # Date x ticker matrix of units held at the end of each date
+    flows = transactions.pivot_table(index='date', columns='ticker', values='units', aggfunc='sum')
+    # Trades on weekends or holidays carry into the next business day
+    holdings = flows.reindex(flows.index.union(dates)).fillna(0).cumsum()
+    return holdings.reindex(dates)
+
+
+@timed('compute.value_over_time')
+def value_over_time(transactions, end_date):
+    # Daily portfolio value at the open, from the first trade up to (excluding) end_date
+    end_date = pd.Timestamp(end_date).normalize()
+    dates = pd.date_range(transactions['date'].min(), end_date, freq=business_day(), inclusive='left')
+    holdings = holdings_matrix(transactions, dates)
+
+    # One history read per distinct ticker, starting at its first trade
+    first_trade = transactions.groupby('ticker')['date'].min()
+    prices = pd.DataFrame(
+        {ticker: get_history(ticker, start=first_trade[ticker], end=end_date)['Open'] for ticker in holdings.columns},
+        columns=holdings.columns,
+    ).reindex(dates)
+
+    values = np.nansum(holdings.to_numpy() * prices.to_numpy(), axis=1)
+
+    # Skip dates with no price for anything held, e.g. before the data starts
+    priced = prices.notna().to_numpy().any(axis=1)
+    return pd.Series(values[priced], index=dates[priced])
+
+
+def dividends_received(trades, events):
+    # Units held going into each ex-date times the dividend paid on it
+    trades = trades.sort_values('date')
+    holdings = np.concatenate([[0.0], trades['units'].cumsum().to_numpy()])
+    trades_before = np.searchsorted(trades['date'].to_numpy(), events.index.to_numpy(), side='left')
+    return float((events.to_numpy() * holdings[trades_before]).sum())
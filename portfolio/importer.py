@@ -0,0 +1,210 @@
+import csv
+import json
+from datetime import timezone as dt_timezone
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction as db_transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .ledger import recompute_assets, replay_lots
+from .models import Asset, Transaction, PortfolioSnapshot, lock_portfolio
+
+BATCH_SIZE = 1000
+MAX_ERRORS = 50
+
+
+class ImportValidationError(ValueError):
+    def __init__(self, errors):
+        super().__init__(f'{len(errors)} invalid rows')
+        self.errors = errors
+
+
+def read_rows(request):
+    # Yields one dict per row without loading the whole upload into memory.
+    # CSV and newline-delimited JSON are streamed, a JSON array is parsed in one go.
+    if request.content_type == 'application/json':
+        rows = json.loads(request.body)
+        if not isinstance(rows, list):
+            raise ImportValidationError([{'row': 0, 'error': 'Expected a JSON array of transactions.'}])
+        yield from rows
+    elif request.content_type in ('application/x-ndjson', 'application/jsonl'):
+        for line in request:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+    else:
+        reader = csv.DictReader(line.decode('utf-8-sig') for line in request)
+        try:
+            yield from reader
+        except csv.Error as e:
+            raise ImportValidationError([{'row': reader.line_num, 'error': f'Malformed CSV: {e}'}])
+
+
+def decimal_limit(field):
+    # Largest magnitude the model field can store, so values that would fail on
+    # save are reported as row errors instead
+    return Decimal(10) ** (field.max_digits - field.decimal_places)
+
+
+# Every column a value ends up in, the average price is derived from the price
+DECIMAL_FIELDS = {
+    'units': [Transaction._meta.get_field('units')],
+    'price': [Transaction._meta.get_field('price'), Asset._meta.get_field('averagePrice')],
+    'fee': [Transaction._meta.get_field('fee')],
+}
+
+
+def parse_decimal(row, field, default=None):
+    value = row.get(field)
+    if value in (None, ''):
+        if default is None:
+            raise ValueError(f"'{field}' is required.")
+        return default
+    if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+        raise ValueError(f"'{field}' must be a number.")
+    try:
+        number = Decimal(str(value))
+    except InvalidOperation:
+        number = None
+    if number is None or not number.is_finite():
+        raise ValueError(f"'{field}' must be a number.")
+
+    model_fields = DECIMAL_FIELDS[field]
+    places = min(model_field.decimal_places for model_field in model_fields)
+    limit = min(decimal_limit(model_field) for model_field in model_fields)
+    if abs(number) >= limit:
+        raise ValueError(f"'{field}' must be less than {limit:,}.")
+    # Rounded the way the database would store it
+    return number.quantize(Decimal(1).scaleb(-places))
+
+
+def parse_text(row, field, model_field, default=None):
+    value = row.get(field)
+    if value in (None, ''):
+        if default is None:
+            raise ValueError(f"'{field}' is required.")
+        return default
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        value = str(value)  # e.g. a numeric ticker in JSON
+    if not isinstance(value, str):
+        raise ValueError(f"'{field}' must be a string.")
+    if len(value) > model_field.max_length:
+        raise ValueError(f"'{field}' must be at most {model_field.max_length} characters.")
+    return value
+
+
+def parse_transaction_date(value):
+    if not value:
+        return timezone.now()
+    if not isinstance(value, str):
+        raise ValueError("'transaction_date' must be an ISO 8601 date.")
+    date = parse_datetime(value)
+    if date is None and parse_date(value) is not None:
+        date = parse_datetime(f'{value}T00:00:00Z')
+    if date is None:
+        raise ValueError("'transaction_date' must be an ISO 8601 date.")
+    if timezone.is_naive(date):
+        date = timezone.make_aware(date, dt_timezone.utc)
+    return date
+
+
+def clean_row(row):
+    if not isinstance(row, dict):
+        raise ValueError('Expected an object per row.')
+    transaction_type = row.get('transaction_type')
+    if not isinstance(transaction_type, str) or transaction_type.lower() not in ('buy', 'sell'):
+        raise ValueError("'transaction_type' must be 'buy' or 'sell'.")
+
+    units = parse_decimal(row, 'units')
+    price = parse_decimal(row, 'price')
+    fee = parse_decimal(row, 'fee', Decimal(0))
+    if units <= 0:
+        raise ValueError("'units' must be positive.")
+    if price < 0 or fee < 0:
+        raise ValueError("'price' and 'fee' cannot be negative.")
+
+    return {
+        'transaction_type': transaction_type.lower(),
+        'asset_name': parse_text(row, 'asset_name', Asset._meta.get_field('name')),
+        'ticker': parse_text(row, 'asset_ticker', Asset._meta.get_field('ticker')),
+        'asset_type': parse_text(row, 'asset_type', Asset._meta.get_field('type'), 'Others'),
+        'asset_sector': parse_text(row, 'asset_sector', Asset._meta.get_field('sector'), 'Others'),
+        'units': units,
+        'price': price,
+        'fee': fee,
+        'transaction_date': parse_transaction_date(row.get('transaction_date')),
+    }
+
+
+def import_transactions(portfolio, rows):
+    # Validates and writes rows in batches inside one atomic block, then
+    # recomputes each touched asset once from its ledger. Any invalid row
+    # rolls the whole import back.
+    touched = set()
+    errors = []
+    batch = []
+    imported = 0
+    fees = Decimal(0)
+
+    with db_transaction.atomic():
+        lock_portfolio(portfolio.id)
+        assets = {asset.name: asset for asset in Asset.objects.filter(portfolio=portfolio)}
+        # Positions entered by hand have no ledger rows, imported rows are replayed on top of them
+        ledgered = set(Transaction.objects.filter(portfolio=portfolio).values_list('asset_name', flat=True))
+        opening = {name: (asset.units, asset.averagePrice) for name, asset in assets.items() if name not in ledgered}
+        try:
+            for number, row in enumerate(rows, start=1):
+                try:
+                    cleaned = clean_row(row)
+                except ValueError as e:
+                    errors.append({'row': number, 'error': str(e)})
+                    if len(errors) >= MAX_ERRORS:
+                        break
+                    continue
+                if errors:
+                    # Keep validating to report errors, but stop writing
+                    continue
+
+                asset = assets.get(cleaned['asset_name'])
+                if asset is None:
+                    asset = Asset.objects.create(
+                        portfolio=portfolio,
+                        name=cleaned['asset_name'],
+                        ticker=cleaned['ticker'],
+                        type=cleaned['asset_type'],
+                        sector=cleaned['asset_sector'],
+                    )
+                    assets[asset.name] = asset
+                touched.add(asset.name)
+                fees += cleaned['fee']
+
+                batch.append(Transaction(
+                    portfolio=portfolio,
+                    asset=asset,
+                    asset_name=cleaned['asset_name'],
+                    ticker=cleaned['ticker'],
+                    transaction_type=cleaned['transaction_type'],
+                    units=cleaned['units'],
+                    price=cleaned['price'],
+                    fee=cleaned['fee'],
+                    transaction_date=cleaned['transaction_date'],
+                ))
+                if len(batch) >= BATCH_SIZE:
+                    Transaction.objects.bulk_create(batch)
+                    imported += len(batch)
+                    batch = []
+        except ImportValidationError as e:
+            # The upload itself is malformed, nothing after this point can be read
+            errors += e.errors
+
+        if errors:
+            raise ImportValidationError(errors)
+
+        Transaction.objects.bulk_create(batch)
+        imported += len(batch)
+        invested_delta = recompute_assets(portfolio, touched, opening)
+        realised_delta = replay_lots(portfolio, touched)
+        PortfolioSnapshot.apply_delta(portfolio.id, invested=invested_delta, fees=fees, realised=realised_delta)
+
+    return {'imported': imported, 'assets': len(touched)}
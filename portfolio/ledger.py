@@ -0,0 +1,165 @@
+from decimal import Decimal
+
+from .models import Asset, Transaction, Lot
+
+CENT = Decimal('0.01')
+UNIT = Decimal('0.00001')
+
+
+def replay_position(transactions, units=Decimal(0), average_price=Decimal(0)):
+    # Average-cost position after applying the transactions in date order to
+    # the opening position, using the same rules as Transaction.save()
+    for transaction in transactions:
+        if transaction.transaction_type == 'buy':
+            average_price = (average_price * units + transaction.units * transaction.price) / (units + transaction.units)
+            units += transaction.units
+        else:
+            units -= transaction.units
+            if units <= 0:
+                # The asset row is deleted at zero units, a later buy starts afresh
+                units = Decimal(0)
+                average_price = Decimal(0)
+    return units, average_price.quantize(CENT)
+
+
+def recompute_assets(portfolio, asset_names, opening=None):
+    # Rebuild units and averagePrice for each named asset from the portfolio's ledger,
+    # starting from opening[name] = (units, averagePrice) where given. Returns the
+    # change in the amount invested in those assets
+    opening = opening or {}
+    transactions = Transaction.objects.filter(portfolio=portfolio, asset_name__in=asset_names).order_by('transaction_date', 'id')
+    ledgers = {name: [] for name in asset_names}
+    for transaction in transactions:
+        ledgers[transaction.asset_name].append(transaction)
+
+    assets = {asset.name: asset for asset in Asset.objects.filter(portfolio=portfolio, name__in=asset_names)}
+    invested_before = Decimal(0)
+    updated = []
+    emptied = []
+    for name, ledger in ledgers.items():
+        asset = assets.get(name)
+        if asset is None or not ledger:
+            # No ledger rows (e.g. entered through AssetView), nothing to rebuild from
+            continue
+        invested_before += asset.value()
+        asset.units, asset.averagePrice = replay_position(ledger, *opening.get(name, ()))
+        if asset.units == 0:
+            emptied.append(asset.id)
+        else:
+            updated.append(asset)
+    Asset.objects.bulk_update(updated, ['units', 'averagePrice'])
+    Asset.objects.filter(id__in=emptied).delete()
+    return sum((asset.value() for asset in updated), Decimal(0)) - invested_before
+
+
+def close_lots(lots, units, price, method):
+    # Takes units out of the open lots (ordered oldest first) and returns the realised P/L
+    units = Decimal(str(units))
+    price = Decimal(str(price))
+    open_lots = [lot for lot in lots if lot.units > 0]
+    held = sum((lot.units for lot in open_lots), Decimal(0))
+    if held <= 0:
+        return Decimal(0)
+    units = min(units, held)
+
+    if method == 'fifo':
+        realised = Decimal(0)
+        remaining = units
+        for lot in open_lots:
+            used = min(lot.units, remaining)
+            realised += (price - lot.price) * used
+            lot.units -= used
+            remaining -= used
+            if remaining == 0:
+                break
+    else:
+        # Average cost: realise against the mean cost and shrink every lot
+        # proportionally so the average of what is left doesn't change
+        average = sum(lot.units * lot.price for lot in open_lots) / held
+        realised = (price - average) * units
+        kept = (held - units) / held
+        for lot in open_lots:
+            lot.units = (lot.units * kept).quantize(UNIT)
+    return realised.quantize(UNIT)
+
+
+def replay_ledger(transactions, method, lot_model=Lot):
+    # Builds the lots and realised P/L for transactions already in date order
+    lots = []
+    open_lots = {}
+    realised = {}
+    for transaction in transactions:
+        if transaction.transaction_type == 'buy':
+            lot = lot_model(
+                portfolio_id=transaction.portfolio_id,
+                transaction=transaction,
+                asset_name=transaction.asset_name,
+                units=transaction.units,
+                price=transaction.price,
+                opened=transaction.transaction_date,
+            )
+            lots.append(lot)
+            open_lots.setdefault(transaction.asset_name, []).append(lot)
+        else:
+            held = open_lots.get(transaction.asset_name, [])
+            realised[transaction.id] = close_lots(held, transaction.units, transaction.price, method)
+    return lots, realised
+
+
+def replay_lots(portfolio, asset_names):
+    # Rebuilds the lots of the named assets from scratch and re-prices every sell,
+    # used when a transaction lands before existing ones or is deleted
+    transactions = list(
+        Transaction.objects.filter(portfolio=portfolio, asset_name__in=asset_names).order_by('transaction_date', 'id')
+    )
+    lots, realised = replay_ledger(transactions, portfolio.cost_basis_method)
+
+    Lot.objects.filter(portfolio=portfolio, asset_name__in=asset_names).delete()
+    Lot.objects.bulk_create(lots)
+
+    changed = []
+    delta = Decimal(0)
+    for transaction in transactions:
+        value = realised.get(transaction.id, Decimal(0))
+        if transaction.realised_pl != value:
+            delta += value - transaction.realised_pl
+            transaction.realised_pl = value
+            changed.append(transaction)
+    Transaction.objects.bulk_update(changed, ['realised_pl'])
+
+    # Change in the total realised P/L of these assets
+    return delta
+
+
+def record_transaction(transaction, adding=True):
+    # Incremental ledger update for a transaction that was just saved
+    later = Transaction.objects.filter(
+        portfolio_id=transaction.portfolio_id,
+        asset_name=transaction.asset_name,
+        transaction_date__gt=transaction.transaction_date,
+    )
+    # Returns the change in the portfolio's realised P/L
+    if not adding or later.exists():
+        delta = replay_lots(transaction.portfolio, [transaction.asset_name])
+        transaction.refresh_from_db(fields=['realised_pl'])
+        return delta
+
+    if transaction.transaction_type == 'buy':
+        Lot.objects.create(
+            portfolio_id=transaction.portfolio_id,
+            transaction=transaction,
+            asset_name=transaction.asset_name,
+            units=transaction.units,
+            price=transaction.price,
+            opened=transaction.transaction_date,
+        )
+        return Decimal(0)
+
+    lots = list(
+        Lot.objects.filter(portfolio_id=transaction.portfolio_id, asset_name=transaction.asset_name, units__gt=0)
+        .order_by('opened', 'id')
+    )
+    transaction.realised_pl = close_lots(lots, transaction.units, transaction.price, transaction.portfolio.cost_basis_method)
+    Lot.objects.bulk_update(lots, ['units'])
+    Transaction.objects.filter(pk=transaction.pk).update(realised_pl=transaction.realised_pl)
+    return transaction.realised_pl
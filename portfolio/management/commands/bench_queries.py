@@ -0,0 +1,140 @@
+import json
+import random
+import statistics
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import Sum
+from django.utils import timezone
+
+from portfolio.models import Asset, Portfolio, Transaction
+
+# The "before" run uses the schema as it was prior to the composite indexes
+BEFORE_MIGRATION = '0007_portfoliosnapshot'
+AFTER_MIGRATION = '0008_asset_unique_name_transaction_indexes'
+
+
+class Command(BaseCommand):
+    help = 'Seed a throwaway database and time the portfolio hot queries with and without the composite indexes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--transactions', type=int, default=100_000)
+        parser.add_argument('--portfolios', type=int, default=20)
+        parser.add_argument('--assets', type=int, default=25, help='Assets per portfolio')
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--json', dest='json_path', help='Also write the results to this file')
+
+    def handle(self, *args, **options):
+        # Never touch the real database, the test database is created and dropped here
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            call_command('migrate', 'portfolio', BEFORE_MIGRATION, verbosity=0)
+            self.seed(options['transactions'], options['portfolios'], options['assets'])
+            results = {}
+            self.analyze()
+            results['before'] = self.run_queries(options['repeat'], unique_name=False)
+            call_command('migrate', 'portfolio', AFTER_MIGRATION, verbosity=0)
+            self.analyze()
+            results['after'] = self.run_queries(options['repeat'], unique_name=True)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        self.report(results)
+        if options['json_path']:
+            with open(options['json_path'], 'w') as f:
+                json.dump(results, f, indent=2)
+
+    def seed(self, n_transactions, n_portfolios, n_assets):
+        random.seed(0)
+        user = get_user_model().objects.create_user(email='bench@example.com', username='bench', password='bench')
+        portfolios = Portfolio.objects.bulk_create(
+            [Portfolio(user=user, name=f'Portfolio {i}') for i in range(n_portfolios)]
+        )
+        assets = Asset.objects.bulk_create([
+            Asset(portfolio=portfolio, name=f'Asset {i}', ticker=f'T{i}', units=100, averagePrice=10)
+            for portfolio in portfolios
+            for i in range(n_assets)
+        ])
+
+        start = timezone.now() - timedelta(days=5 * 365)
+        transactions = []
+        for i in range(n_transactions):
+            asset = random.choice(assets)
+            transactions.append(Transaction(
+                portfolio_id=asset.portfolio_id,
+                transaction_type=random.choice(['buy', 'buy', 'sell']),
+                asset=asset,
+                asset_name=asset.name,
+                ticker=asset.ticker,
+                units=Decimal(random.randint(1, 100)),
+                price=Decimal(random.randint(100, 50000)) / 100,
+                fee=Decimal(random.randint(0, 500)) / 100,
+                transaction_date=start + timedelta(minutes=random.randint(0, 5 * 365 * 24 * 60)),
+                realised_pl=Decimal(random.randint(-10000, 10000)) / 100,
+            ))
+        Transaction.objects.bulk_create(transactions, batch_size=5000)
+
+        self.portfolio = portfolios[len(portfolios) // 2]
+        self.asset = Asset.objects.filter(portfolio=self.portfolio).order_by('id')[n_assets // 2]
+
+    def analyze(self):
+        # Refresh planner statistics so the plans reflect the current indexes
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def run_queries(self, repeat, unique_name):
+        portfolio = self.portfolio
+        asset = self.asset
+        queries = {
+            # GetPortfolioValueOverTime / GetDividendsReceived
+            'transactions_by_date': Transaction.objects.filter(portfolio=portfolio).order_by('transaction_date'),
+            # Transaction.delete / update_asset
+            'asset_by_name': Asset.objects.filter(portfolio=portfolio, name=asset.name),
+            # Ledger replay for one asset
+            'asset_ledger': Transaction.objects.filter(portfolio=portfolio, asset_name=asset.name).order_by('transaction_date', 'id'),
+            # total_RealisedPL
+            'realised_pl_sum': Transaction.objects.filter(portfolio=portfolio).values('portfolio').annotate(total=Sum('realised_pl')),
+        }
+
+        results = {}
+        for label, queryset in queries.items():
+            results[label] = {
+                'plan': queryset.explain(),
+                'median_ms': self.time(lambda: list(queryset.all()), repeat),
+            }
+
+        # create_transaction's asset lookup, the old five column get_or_create
+        # against the (portfolio, name) one it does now
+        fields = {'ticker': asset.ticker, 'type': asset.type, 'sector': asset.sector}
+        if unique_name:
+            run = lambda: Asset.objects.get_or_create(portfolio=portfolio, name=asset.name, defaults=fields)
+        else:
+            run = lambda: Asset.objects.get_or_create(portfolio=portfolio, name=asset.name, **fields)
+        results['asset_get_or_create'] = {'plan': None, 'median_ms': self.time(run, repeat)}
+        return results
+
+    def time(self, run, repeat):
+        run()  # warm up
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            run()
+            timings.append((time.perf_counter() - started) * 1000)
+        return round(statistics.median(timings), 3)
+
+    def report(self, results):
+        for label in results['before']:
+            before = results['before'][label]
+            after = results['after'][label]
+            self.stdout.write(self.style.MIGRATE_HEADING(label))
+            self.stdout.write(f"  before: {before['median_ms']} ms")
+            if before['plan']:
+                self.stdout.write('    ' + before['plan'].replace('\n', '\n    '))
+            self.stdout.write(f"  after:  {after['median_ms']} ms")
+            if after['plan']:
+                self.stdout.write('    ' + after['plan'].replace('\n', '\n    '))
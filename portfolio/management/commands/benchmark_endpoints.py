@@ -0,0 +1,154 @@
+import contextlib
+import io
+import json
+import platform
+import time
+import tracemalloc
+import warnings
+
+import django
+import numpy as np
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+from django.utils import timezone
+
+from core.benchmark import ROUTES, SCALES, Fixture, app_routes, consume, db_queries, seed_portfolio, stub_upstreams, test_database
+
+
+class Command(BaseCommand):
+    help = 'Time every portfolio, asset and chatbot route against synthetic portfolios with faked upstreams'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scales', default=','.join(SCALES), help=f'Comma separated, any of {", ".join(SCALES)}')
+        parser.add_argument('--repeat', type=int, default=20, help='Timed requests per route, after one warm up')
+        parser.add_argument('--routes', help='Only routes containing one of these comma separated strings')
+        parser.add_argument('--latency', type=float, default=0.0, help='Simulated upstream latency in seconds')
+        parser.add_argument('--output', help='Write the results to this JSON file, e.g. as the new baseline')
+        parser.add_argument('--baseline', help='Compare against a JSON file written with --output')
+        parser.add_argument('--threshold', type=float, default=0.25, help='p95 slowdown against the baseline that counts as a regression')
+        parser.add_argument('--min-delta-ms', type=float, default=5.0, help='Ignore p95 slowdowns smaller than this, sub-millisecond routes are noisy')
+
+    def handle(self, *args, **options):
+        scales = options['scales'].split(',')
+        unknown = [scale for scale in scales if scale not in SCALES]
+        if unknown:
+            raise CommandError(f'Unknown scale {", ".join(unknown)}, expected {", ".join(SCALES)}')
+
+        routes = app_routes()
+        if options['routes']:
+            routes = [route for route in routes if any(part in route for part in options['routes'].split(','))]
+        missing = [route for route in routes if route not in ROUTES]
+        for route in missing:
+            self.stderr.write(f'No request recipe for {route} in core/benchmark.py, skipping it')
+
+        results = {
+            'meta': {
+                'date': timezone.now().isoformat(),
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'repeat': options['repeat'],
+                'latency': options['latency'],
+            },
+            'scales': {},
+        }
+
+        with test_database():
+            for scale in scales:
+                call_command('flush', interactive=False, verbosity=0)
+                with stub_upstreams(latency=options['latency']):
+                    self.stdout.write(self.style.MIGRATE_HEADING(
+                        f"{scale}: {SCALES[scale]['assets']} assets, {SCALES[scale]['transactions']} transactions"
+                    ))
+                    fixture = self.seed(SCALES[scale])
+                    results['scales'][scale] = {
+                        route: self.benchmark(route, fixture, options['repeat'])
+                        for route in routes if route in ROUTES
+                    }
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write(f"Results written to {options['output']}")
+
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                baseline = json.load(f)
+            regressions = self.compare(results, baseline, options['threshold'], options['min_delta_ms'])
+            if regressions:
+                raise CommandError(f'{regressions} routes regressed by more than {options["threshold"]:.0%}')
+
+    def seed(self, scale):
+        started = time.perf_counter()
+        user = get_user_model().objects.create_user(email='bench@example.com', username='bench', password='bench')
+        portfolio = seed_portfolio(user, scale['assets'], scale['transactions'])
+        self.stdout.write(f'  seeded in {time.perf_counter() - started:.1f}s')
+        return Fixture(user=user, portfolio=portfolio)
+
+    def request(self, client, route, fixture):
+        request = ROUTES[route](fixture)
+        # The chatbot views print progress, keep it out of the report
+        with contextlib.redirect_stdout(io.StringIO()), warnings.catch_warnings():
+            warnings.simplefilter('ignore')  # Async streams read by the sync client
+            started = time.perf_counter()
+            response = client.generic(request.method, request.path, request.data(), content_type='application/json')
+            consume(response)
+            elapsed = time.perf_counter() - started
+        return response, elapsed
+
+    def benchmark(self, route, fixture, repeat):
+        # Failing views are reported by status rather than stopping the run
+        client = Client(raise_request_exception=False)
+        self.request(client, route, fixture)  # Warm up caches and the price store
+
+        timings = []
+        queries = []
+        statuses = set()
+        for _ in range(repeat):
+            response, elapsed = self.request(client, route, fixture)
+            timings.append(elapsed * 1000)
+            queries.append(db_queries(response))
+            statuses.add(response.status_code)
+
+        # Separate run for memory, tracing allocations slows everything down
+        tracemalloc.start()
+        try:
+            self.request(client, route, fixture)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+        result = {
+            'p50_ms': round(float(np.percentile(timings, 50)), 2),
+            'p95_ms': round(float(np.percentile(timings, 95)), 2),
+            'queries': max(queries),
+            'peak_kib': round(peak / 1024, 1),
+            'status': sorted(statuses),
+        }
+        line = f"  {route:<55} p50 {result['p50_ms']:>9.2f} ms  p95 {result['p95_ms']:>9.2f} ms  {result['queries']:>5} queries  {result['peak_kib']:>10.1f} KiB peak"
+        if any(status >= 400 for status in statuses):
+            self.stdout.write(self.style.WARNING(f"{line}  status {result['status']}"))
+        else:
+            self.stdout.write(line)
+        return result
+
+    def compare(self, results, baseline, threshold, min_delta_ms):
+        self.stdout.write(self.style.MIGRATE_HEADING('Against the baseline'))
+        regressions = 0
+        for scale, routes in results['scales'].items():
+            for route, result in routes.items():
+                before = baseline.get('scales', {}).get(scale, {}).get(route)
+                if before is None:
+                    continue
+                change = result['p95_ms'] / before['p95_ms'] - 1 if before['p95_ms'] else 0
+                slower = change > threshold and result['p95_ms'] - before['p95_ms'] > min_delta_ms
+                if slower or result['queries'] > before['queries']:
+                    regressions += 1
+                    self.stdout.write(self.style.ERROR(
+                        f"  {scale} {route}: p95 {before['p95_ms']} -> {result['p95_ms']} ms ({change:+.0%}), "
+                        f"queries {before['queries']} -> {result['queries']}"
+                    ))
+        if not regressions:
+            self.stdout.write(self.style.SUCCESS('  No regressions'))
+        return regressions
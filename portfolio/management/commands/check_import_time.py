@@ -0,0 +1,69 @@
+import os
+import re
+import subprocess
+import sys
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Loaded on first use only, none of them should show up at startup again
+DEFERRED_MODULES = ('openai', 'pypfopt', 'cvxpy', 'scipy', 'yfinance', 'httpx')
+
+# "import time:       732 |     430231 |   pandas"
+LINE = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \|( +)(\S+)')
+
+
+def import_times(module):
+    # Self and cumulative microseconds per module from a fresh interpreter
+    # importing the app the way a worker's first request does
+    code = f'import django; django.setup(); import {module}'
+    env = {**os.environ, 'DJANGO_SETTINGS_MODULE': os.environ.get('DJANGO_SETTINGS_MODULE', 'core.settings')}
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', code],
+        cwd=settings.BASE_DIR, env=env, capture_output=True, text=True,
+    )
+    if result.returncode:
+        raise CommandError(f'Importing {module} failed:\n{result.stderr[-2000:]}')
+    rows = []
+    for line in result.stderr.splitlines():
+        match = LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            rows.append((name, int(self_us), int(cumulative_us), len(indent) // 2))
+    return rows
+
+
+class Command(BaseCommand):
+    help = 'Time django.setup() plus importing the URLconf with python -X importtime and fail over budget'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--module', default=settings.ROOT_URLCONF, help='What to import after django.setup()')
+        parser.add_argument('--budget-ms', type=float, default=getattr(settings, 'IMPORT_TIME_BUDGET_MS', 1500))
+        parser.add_argument('--repeat', type=int, default=3, help='Fresh interpreters to run, the fastest counts')
+        parser.add_argument('--top', type=int, default=10, help='Packages to list by import time')
+
+    def handle(self, *args, **options):
+        # The fastest run is the least disturbed by whatever else the machine is doing
+        runs = [import_times(options['module']) for _ in range(options['repeat'])]
+        rows = min(runs, key=lambda rows: sum(row[2] for row in rows if row[3] == 0))
+        total_ms = sum(row[2] for row in rows if row[3] == 0) / 1000
+
+        # Self time added up per top level package
+        packages = defaultdict(int)
+        for name, self_us, _, _ in rows:
+            packages[name.split('.')[0]] += self_us
+        self.stdout.write(f"django.setup() + import {options['module']}: {total_ms:.0f} ms (budget {options['budget_ms']:.0f} ms)")
+        for package, self_us in sorted(packages.items(), key=lambda item: -item[1])[:options['top']]:
+            self.stdout.write(f'  {package:<30} {self_us / 1000:>8.1f} ms')
+
+        errors = []
+        loaded = {name.split('.')[0] for name, _, _, _ in rows}
+        eager = [module for module in DEFERRED_MODULES if module in loaded]
+        if eager:
+            errors.append(f'{", ".join(eager)} imported at startup, import them where they are used')
+        if total_ms > options['budget_ms']:
+            errors.append(f"Startup took {total_ms:.0f} ms, over the {options['budget_ms']:.0f} ms budget")
+        if errors:
+            raise CommandError('\n'.join(errors))
+        self.stdout.write(self.style.SUCCESS('Within budget'))
@@ -0,0 +1,250 @@
+import asyncio
+import contextlib
+import io
+import json
+import random
+import threading
+import time
+import warnings
+from collections import Counter, defaultdict
+from types import SimpleNamespace
+
+import httpx
+import numpy as np
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.core.servers.basehttp import ThreadedWSGIServer
+from django.db import connections
+from django.test.testcases import QuietWSGIRequestHandler
+
+# Imported up front, loading them runs django.setup() which resets logging
+from core.asgi import application as asgi_application
+from core.benchmark import ROUTES, SCALES, SCENARIOS, Fixture, seed_portfolio, stub_upstreams, test_database
+from core.metrics import registry
+from core.wsgi import application as wsgi_application
+
+MODES = ('wsgi', 'asgi', 'http')
+
+
+def parse_mix(value):
+    # "dashboard=6,transaction=3,chat=1" -> {'dashboard': 6.0, ...}
+    mix = {}
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        if name not in SCENARIOS:
+            raise CommandError(f'Unknown scenario {name}, expected {", ".join(SCENARIOS)}')
+        try:
+            mix[name] = float(weight or 1)
+        except ValueError:
+            raise CommandError(f'Weight for {name} should be a number, got {weight}')
+    if not any(mix.values()):
+        raise CommandError('The mix needs at least one scenario with a positive weight')
+    return mix
+
+
+def upstream_counts():
+    # Upstream calls and cache lookups of this process so far, from core.metrics
+    counts = Counter()
+    for name, labels, value in registry.snapshot()['counters']:
+        labels = dict(labels)
+        if name == 'upstream_requests_total':
+            counts['upstream', labels['provider']] += value
+        elif name in ('cache_hits_total', 'cache_misses_total'):
+            counts[name.split('_')[1], labels['cache']] += value
+    return counts
+
+
+class Command(BaseCommand):
+    help = 'Drive the app with concurrent clients running a mix of dashboard, transaction and chat traffic'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--mode', choices=MODES, default='wsgi',
+                            help='wsgi and asgi call core.wsgi/core.asgi in process, http serves core.wsgi on localhost')
+        parser.add_argument('--url', help='Load an already running server instead, e.g. http://localhost:8000')
+        parser.add_argument('--user-id', type=int, help='With --url, the user whose portfolio is loaded')
+        parser.add_argument('--portfolio-id', type=int, help='With --url, the portfolio to load')
+        parser.add_argument('--clients', type=int, default=8, help='Concurrent clients')
+        parser.add_argument('--duration', type=float, default=20.0, help='Seconds to run for')
+        parser.add_argument('--mix', default='dashboard=6,transaction=3,chat=1',
+                            help=f'Scenario weights, any of {", ".join(SCENARIOS)}')
+        parser.add_argument('--scale', choices=SCALES, default='small', help='Size of the seeded portfolio')
+        parser.add_argument('--latency', type=float, default=0.05, help='Simulated upstream latency in seconds')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='Write the results to this JSON file')
+
+    def handle(self, *args, **options):
+        mix = parse_mix(options['mix'])
+
+        if options['url']:
+            if not options['user_id'] or not options['portfolio_id']:
+                raise CommandError('--url needs --user-id and --portfolio-id of existing data')
+            # The server brings its own database and upstreams
+            fixture = Fixture(user=SimpleNamespace(id=options['user_id']), portfolio=SimpleNamespace(id=options['portfolio_id']))
+            results = self.run('url', options['url'].rstrip('/'), fixture, mix, options)
+        else:
+            # Concurrent writers need a database file to wait on each other like they do in production
+            with test_database(on_disk=True), stub_upstreams(latency=options['latency'], seed=options['seed']):
+                fixture = self.seed(SCALES[options['scale']], options['seed'])
+                before = upstream_counts()
+                if options['mode'] == 'http':
+                    with self.serve() as url:
+                        results = self.run('http', url, fixture, mix, options)
+                else:
+                    results = self.run(options['mode'], 'http://testserver', fixture, mix, options)
+                results['upstream'] = upstream_counts() - before
+
+        self.report(results, options)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(self.summary(results, options), f, indent=2)
+            self.stdout.write(f"Results written to {options['output']}")
+
+    def seed(self, scale, seed):
+        started = time.perf_counter()
+        user = get_user_model().objects.create_user(email='load@example.com', username='load', password='load')
+        portfolio = seed_portfolio(user, scale['assets'], scale['transactions'], seed=seed)
+        self.stdout.write(f"Seeded {scale['assets']} assets, {scale['transactions']} transactions in {time.perf_counter() - started:.1f}s")
+        return Fixture(user=user, portfolio=portfolio)
+
+    @contextlib.contextmanager
+    def serve(self):
+        # Real sockets on an ephemeral port, one thread per connection like runserver
+        server = ThreadedWSGIServer(('127.0.0.1', 0), QuietWSGIRequestHandler, allow_reuse_address=False)
+        server.set_app(wsgi_application)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            yield f'http://127.0.0.1:{server.server_address[1]}'
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join()
+
+    def client_fixture(self, fixture, index):
+        # Each client chats in its own thread, like separate users would
+        return Fixture(user=fixture.user, portfolio=fixture.portfolio, symbol=fixture.symbol, thread_id=f'thread_load_{index}')
+
+    def run(self, mode, base_url, fixture, mix, options):
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f"{mode}: {options['clients']} clients for {options['duration']:.0f}s, mix {options['mix']}"
+        ))
+        samples = []
+        started = time.perf_counter()
+        deadline = started + options['duration']
+        # The chatbot views print progress, keep it out of the report
+        with contextlib.redirect_stdout(io.StringIO()), warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            if mode == 'asgi':
+                asyncio.run(self.run_async(base_url, fixture, mix, options, deadline, samples))
+            else:
+                threads = [
+                    threading.Thread(target=self.run_client, args=(mode, base_url, fixture, mix, options, deadline, samples, index))
+                    for index in range(options['clients'])
+                ]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+        return {'mode': mode, 'elapsed': time.perf_counter() - started, 'samples': samples}
+
+    def run_client(self, mode, base_url, fixture, mix, options, deadline, samples, index):
+        transport = httpx.WSGITransport(app=wsgi_application) if mode == 'wsgi' else None
+        rng = random.Random(options['seed'] + index)
+        fixture = self.client_fixture(fixture, index)
+        try:
+            with httpx.Client(base_url=base_url, transport=transport, timeout=60) as client:
+                while time.perf_counter() < deadline:
+                    scenario = rng.choices(list(mix), weights=list(mix.values()))[0]
+                    for route in SCENARIOS[scenario]:
+                        request = ROUTES[route](fixture)
+                        started = time.perf_counter()
+                        try:
+                            response = client.request(
+                                request.method, request.path, content=request.data(), headers={'Content-Type': 'application/json'},
+                            )
+                            status = response.status_code
+                        except Exception as e:
+                            status = type(e).__name__  # Timeouts and dropped connections count as errors
+                        samples.append((scenario, route, status, time.perf_counter() - started))
+        finally:
+            connections.close_all()
+
+    async def run_async(self, base_url, fixture, mix, options, deadline, samples):
+        # One event loop like uvicorn, sync views share its thread_sensitive executor
+        async with httpx.AsyncClient(base_url=base_url, transport=httpx.ASGITransport(app=asgi_application), timeout=60) as client:
+            async def run_client(index):
+                rng = random.Random(options['seed'] + index)
+                client_fixture = self.client_fixture(fixture, index)
+                while time.perf_counter() < deadline:
+                    scenario = rng.choices(list(mix), weights=list(mix.values()))[0]
+                    for route in SCENARIOS[scenario]:
+                        request = ROUTES[route](client_fixture)
+                        started = time.perf_counter()
+                        try:
+                            response = await client.request(
+                                request.method, request.path, content=request.data(), headers={'Content-Type': 'application/json'},
+                            )
+                            status = response.status_code
+                        except Exception as e:
+                            status = type(e).__name__
+                        samples.append((scenario, route, status, time.perf_counter() - started))
+
+            await asyncio.gather(*(run_client(index) for index in range(options['clients'])))
+
+    def summary(self, results, options):
+        samples = results['samples']
+        elapsed = results['elapsed']
+        by_route = defaultdict(list)
+        for scenario, route, status, seconds in samples:
+            by_route[scenario, route].append((status, seconds))
+
+        def stats(rows):
+            latencies = np.array([seconds for _, seconds in rows]) * 1000
+            errors = Counter(str(status) for status, _ in rows if not isinstance(status, int) or status >= 400)
+            return {
+                'requests': len(rows),
+                'errors': sum(errors.values()),
+                'error_rate': round(sum(errors.values()) / len(rows), 4),
+                'p50_ms': round(float(np.percentile(latencies, 50)), 1),
+                'p95_ms': round(float(np.percentile(latencies, 95)), 1),
+                'p99_ms': round(float(np.percentile(latencies, 99)), 1),
+                'max_ms': round(float(latencies.max()), 1),
+                'statuses': dict(errors),
+            }
+
+        return {
+            'mode': results['mode'],
+            'clients': options['clients'],
+            'mix': options['mix'],
+            'scale': options['scale'],
+            'latency': options['latency'],
+            'elapsed_s': round(elapsed, 2),
+            'throughput_rps': round(len(samples) / elapsed, 1),
+            'total': stats([(status, seconds) for _, _, status, seconds in samples]) if samples else None,
+            'routes': {f'{scenario} {route}': stats(rows) for (scenario, route), rows in sorted(by_route.items())},
+            'upstream': {f'{kind} {name}': value for (kind, name), value in sorted(results.get('upstream', {}).items())},
+        }
+
+    def report(self, results, options):
+        summary = self.summary(results, options)
+        if not summary['total']:
+            raise CommandError('No requests completed, try a longer --duration')
+
+        self.stdout.write(f"{summary['total']['requests']} requests in {summary['elapsed_s']}s, {summary['throughput_rps']} req/s")
+        self.stdout.write(f"  {'':<60} {'count':>6} {'errors':>7} {'p50':>9} {'p95':>9} {'p99':>9} {'max':>9}")
+        for name, row in [*summary['routes'].items(), ('total', summary['total'])]:
+            line = (
+                f"  {name:<60} {row['requests']:>6} {row['error_rate']:>7.1%} {row['p50_ms']:>6.1f} ms"
+                f" {row['p95_ms']:>6.1f} ms {row['p99_ms']:>6.1f} ms {row['max_ms']:>6.1f} ms"
+            )
+            if row['errors']:
+                statuses = ', '.join(f'{status} x{count}' for status, count in row['statuses'].items())
+                self.stdout.write(self.style.WARNING(f'{line}  {statuses}'))
+            else:
+                self.stdout.write(line)
+
+        if summary['upstream']:
+            # More upstream calls than requests need means concurrent requests fetched the same thing
+            self.stdout.write('Upstream calls and cache lookups')
+            for name, value in summary['upstream'].items():
+                self.stdout.write(f"  {name:<30} {value:>8.0f}  {value / summary['total']['requests']:>6.2f} per request")
@@ -0,0 +1,34 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from asset.refresher import BENCHMARK_TICKERS, held_tickers, refresh_history
+
+
+class Command(BaseCommand):
+    help = (
+        'Refresh price history and dividends for every held ticker in the shared price store. '
+        'Quotes live in each worker\'s memory, MARKET_DATA_REFRESHER keeps those warm.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tickers', help='Comma separated, instead of every held ticker')
+        parser.add_argument('--loop', action='store_true', help='Keep refreshing every --interval seconds')
+        parser.add_argument('--interval', type=float, default=settings.MARKET_DATA_REFRESH_HISTORY_EVERY)
+
+    def handle(self, *args, **options):
+        while True:
+            started = time.perf_counter()
+            if options['tickers']:
+                tickers = [ticker.upper() for ticker in options['tickers'].split(',')]
+            else:
+                tickers = [*held_tickers(), *BENCHMARK_TICKERS]
+                connection.close()  # Not needed again until the next round
+            refreshed = refresh_history(tickers)
+            line = f'Refreshed history for {refreshed}/{len(tickers)} tickers in {time.perf_counter() - started:.1f}s'
+            self.stdout.write(self.style.SUCCESS(line) if refreshed == len(tickers) else self.style.WARNING(line))
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,145 @@
+# Generated by Django 5.0.1 on 2026-10-18 07:52
+
+from decimal import Decimal
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+# Frozen copy of portfolio.ledger as of this migration, later changes to the
+# ledger must not change what this backfill does
+UNIT = Decimal("0.00001")
+
+
+def close_lots(lots, units, price, method):
+    open_lots = [lot for lot in lots if lot.units > 0]
+    held = sum((lot.units for lot in open_lots), Decimal(0))
+    if held <= 0:
+        return Decimal(0)
+    units = min(units, held)
+
+    if method == "fifo":
+        realised = Decimal(0)
+        remaining = units
+        for lot in open_lots:
+            used = min(lot.units, remaining)
+            realised += (price - lot.price) * used
+            lot.units -= used
+            remaining -= used
+            if remaining == 0:
+                break
+    else:
+        average = sum(lot.units * lot.price for lot in open_lots) / held
+        realised = (price - average) * units
+        kept = (held - units) / held
+        for lot in open_lots:
+            lot.units = (lot.units * kept).quantize(UNIT)
+    return realised.quantize(UNIT)
+
+
+def backfill_ledger(apps, schema_editor):
+    Portfolio = apps.get_model("portfolio", "Portfolio")
+    Transaction = apps.get_model("portfolio", "Transaction")
+    Lot = apps.get_model("portfolio", "Lot")
+
+    for portfolio in Portfolio.objects.all():
+        transactions = list(
+            Transaction.objects.filter(portfolio=portfolio).order_by(
+                "transaction_date", "id"
+            )
+        )
+        lots = []
+        open_lots = {}
+        for transaction in transactions:
+            if transaction.transaction_type == "buy":
+                lot = Lot(
+                    portfolio_id=transaction.portfolio_id,
+                    transaction=transaction,
+                    asset_name=transaction.asset_name,
+                    units=transaction.units,
+                    price=transaction.price,
+                    opened=transaction.transaction_date,
+                )
+                lots.append(lot)
+                open_lots.setdefault(transaction.asset_name, []).append(lot)
+                transaction.realised_pl = 0
+            else:
+                transaction.realised_pl = close_lots(
+                    open_lots.get(transaction.asset_name, []),
+                    transaction.units,
+                    transaction.price,
+                    portfolio.cost_basis_method,
+                )
+        Lot.objects.bulk_create(lots)
+        Transaction.objects.bulk_update(transactions, ["realised_pl"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("portfolio", "0005_alter_asset_units"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Lot",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("asset_name", models.CharField(max_length=200)),
+                ("units", models.DecimalField(decimal_places=5, max_digits=20)),
+                ("price", models.DecimalField(decimal_places=2, max_digits=12)),
+                ("opened", models.DateTimeField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name="portfolio",
+            name="cost_basis_method",
+            field=models.CharField(
+                choices=[("average", "Average cost"), ("fifo", "FIFO")],
+                default="average",
+                max_length=10,
+            ),
+        ),
+        migrations.AddField(
+            model_name="transaction",
+            name="realised_pl",
+            field=models.DecimalField(decimal_places=5, default=0, max_digits=20),
+        ),
+        migrations.AddIndex(
+            model_name="transaction",
+            index=models.Index(
+                fields=["portfolio", "realised_pl"],
+                name="portfolio_t_portfol_ff2cac_idx",
+            ),
+        ),
+        migrations.AddField(
+            model_name="lot",
+            name="portfolio",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE, to="portfolio.portfolio"
+            ),
+        ),
+        migrations.AddField(
+            model_name="lot",
+            name="transaction",
+            field=models.OneToOneField(
+                on_delete=django.db.models.deletion.CASCADE, to="portfolio.transaction"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="lot",
+            index=models.Index(
+                fields=["portfolio", "asset_name", "opened"],
+                name="portfolio_l_portfol_c03f19_idx",
+            ),
+        ),
+        migrations.RunPython(backfill_ledger, migrations.RunPython.noop),
+    ]
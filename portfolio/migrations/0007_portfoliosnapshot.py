@@ -0,0 +1,78 @@
+# Generated by Django 5.0.1 on 2026-10-18 07:54
+
+import django.db.models.deletion
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import F, Sum
+
+
+def build_snapshots(apps, schema_editor):
+    Portfolio = apps.get_model("portfolio", "Portfolio")
+    Asset = apps.get_model("portfolio", "Asset")
+    Transaction = apps.get_model("portfolio", "Transaction")
+    PortfolioSnapshot = apps.get_model("portfolio", "PortfolioSnapshot")
+
+    snapshots = []
+    for portfolio in Portfolio.objects.all():
+        invested = Asset.objects.filter(portfolio=portfolio).aggregate(
+            total=Sum(F("units") * F("averagePrice"))
+        )["total"]
+        totals = Transaction.objects.filter(portfolio=portfolio).aggregate(
+            fees=Sum("fee"), realised=Sum("realised_pl")
+        )
+        snapshots.append(
+            PortfolioSnapshot(
+                portfolio=portfolio,
+                amount_invested=invested or Decimal(0),
+                total_fees=totals["fees"] or Decimal(0),
+                realised_pl=totals["realised"] or Decimal(0),
+            )
+        )
+    PortfolioSnapshot.objects.bulk_create(snapshots)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("portfolio", "0006_lot_ledger"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="PortfolioSnapshot",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "amount_invested",
+                    models.DecimalField(decimal_places=5, default=0, max_digits=30),
+                ),
+                (
+                    "total_fees",
+                    models.DecimalField(decimal_places=5, default=0, max_digits=30),
+                ),
+                (
+                    "realised_pl",
+                    models.DecimalField(decimal_places=5, default=0, max_digits=30),
+                ),
+                ("updated", models.DateTimeField(auto_now=True)),
+                (
+                    "portfolio",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="snapshot",
+                        to="portfolio.portfolio",
+                    ),
+                ),
+            ],
+        ),
+        migrations.RunPython(build_snapshots, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,100 @@
+# Generated by Django 5.0.1 on 2026-10-18 07:55
+
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import Count, F, Min, Sum
+
+
+def replay_position(transactions):
+    # Frozen copy of portfolio.ledger.replay_position as of this migration
+    units = Decimal(0)
+    average_price = Decimal(0)
+    for transaction in transactions:
+        if transaction.transaction_type == "buy":
+            average_price = (
+                average_price * units + transaction.units * transaction.price
+            ) / (units + transaction.units)
+            units += transaction.units
+        else:
+            units -= transaction.units
+            if units <= 0:
+                units = Decimal(0)
+                average_price = Decimal(0)
+    return units, average_price.quantize(Decimal("0.01"))
+
+
+def merge_duplicate_assets(apps, schema_editor):
+    # create_transaction used to match assets on five columns, so a portfolio
+    # can hold several rows with the same name. Fold them into the oldest row.
+    Asset = apps.get_model("portfolio", "Asset")
+    Transaction = apps.get_model("portfolio", "Transaction")
+    PortfolioSnapshot = apps.get_model("portfolio", "PortfolioSnapshot")
+
+    duplicates = list(
+        Asset.objects.values("portfolio", "name")
+        .annotate(count=Count("id"), keep=Min("id"))
+        .filter(count__gt=1)
+    )
+    for duplicate in duplicates:
+        assets = Asset.objects.filter(
+            portfolio=duplicate["portfolio"], name=duplicate["name"]
+        )
+        Transaction.objects.filter(asset__in=assets).update(asset=duplicate["keep"])
+        assets.exclude(id=duplicate["keep"]).delete()
+
+        ledger = Transaction.objects.filter(
+            portfolio=duplicate["portfolio"], asset_name=duplicate["name"]
+        ).order_by("transaction_date", "id")
+        units, average_price = replay_position(ledger)
+        Asset.objects.filter(id=duplicate["keep"]).update(
+            units=units, averagePrice=average_price
+        )
+
+    # The snapshots built by 0007 summed the duplicate rows, rebuild them
+    for portfolio_id in {duplicate["portfolio"] for duplicate in duplicates}:
+        invested = Asset.objects.filter(portfolio=portfolio_id).aggregate(
+            total=Sum(F("units") * F("averagePrice"))
+        )["total"]
+        totals = Transaction.objects.filter(portfolio=portfolio_id).aggregate(
+            fees=Sum("fee"), realised=Sum("realised_pl")
+        )
+        PortfolioSnapshot.objects.update_or_create(
+            portfolio_id=portfolio_id,
+            defaults={
+                "amount_invested": invested or Decimal(0),
+                "total_fees": totals["fees"] or Decimal(0),
+                "realised_pl": totals["realised"] or Decimal(0),
+            },
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("portfolio", "0007_portfoliosnapshot"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="transaction",
+            index=models.Index(
+                fields=["portfolio", "transaction_date"],
+                name="portfolio_t_portfol_7a5ee5_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="transaction",
+            index=models.Index(
+                fields=["portfolio", "asset_name", "transaction_date"],
+                name="portfolio_t_portfol_63c73a_idx",
+            ),
+        ),
+        migrations.RunPython(merge_duplicate_assets, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="asset",
+            constraint=models.UniqueConstraint(
+                fields=("portfolio", "name"), name="unique_asset_name_per_portfolio"
+            ),
+        ),
+    ]
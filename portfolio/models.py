@@ -1,35 +1,97 @@
 from django.utils import timezone
 from django.db import models
+from django.db import transaction as db_transaction
 from django.conf import settings
-from django.db.models import F
+from django.db.models import F, Sum, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
 from decimal import Decimal
 
+TOTAL_FIELD = models.DecimalField(max_digits=30, decimal_places=5)
+
+
+def asset_value_sum():
+    return Sum(F('units') * F('averagePrice'), output_field=TOTAL_FIELD)
+
+
+def fee_sum():
+    return Sum('fee', output_field=TOTAL_FIELD)
+
+
+def realised_pl_sum():
+    return Sum('realised_pl', output_field=TOTAL_FIELD)
+
+
+def total_subquery(queryset, aggregate):
+    # Correlated per-portfolio aggregate, 0 when the portfolio has no rows
+    totals = queryset.filter(portfolio=OuterRef('pk')).values('portfolio').annotate(total=aggregate).values('total')
+    return Coalesce(Subquery(totals, output_field=TOTAL_FIELD), Value(Decimal(0)), output_field=TOTAL_FIELD)
+
+
+COST_BASIS_METHODS = [('average', 'Average cost'), ('fifo', 'FIFO')]
+
+
+def invested_in(portfolio_id, asset_name):
+    # Amount invested in one asset of a portfolio, 0 once the asset row is gone
+    assets = Asset.objects.filter(portfolio_id=portfolio_id, name=asset_name)
+    return assets.aggregate(total=Coalesce(asset_value_sum(), Decimal(0)))['total']
+
+
+def lock_portfolio(portfolio_id):
+    # Serialises ledger writes to one portfolio, call it inside atomic() before
+    # reading anything. SQLite ignores select_for_update, touching the snapshot
+    # takes its write lock up front instead of failing to upgrade a read later
+    PortfolioSnapshot.objects.filter(portfolio_id=portfolio_id).update(updated=timezone.now())
+    return Portfolio.objects.select_for_update().get(pk=portfolio_id)
+
+
+class PortfolioQuerySet(models.QuerySet):
+    def with_totals(self):
+        # Computes every portfolio's totals in the same query that loads the portfolios
+        return self.annotate(
+            annotated_value=total_subquery(Asset.objects.all(), asset_value_sum()),
+            annotated_fees=total_subquery(Transaction.objects.all(), fee_sum()),
+            annotated_realised_pl=total_subquery(Transaction.objects.all(), realised_pl_sum()),
+        )
+
+
 class Portfolio(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     name = models.CharField(max_length=200)
     remarks = models.TextField(blank=True, null=True)
     dateCreated = models.DateTimeField(default=timezone.now)
+    cost_basis_method = models.CharField(max_length=10, choices=COST_BASIS_METHODS, default='average')
+
+    objects = PortfolioQuerySet.as_manager()
 
     def __str__(self):
         return self.name
+
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        super().save(*args, **kwargs)
+        if adding:
+            PortfolioSnapshot.objects.create(portfolio=self)
+
+    def get_snapshot(self):
+        try:
+            return self.snapshot
+        except PortfolioSnapshot.DoesNotExist:
+            return PortfolioSnapshot.rebuild(self)
     
     def total_value(self):
-        total = 0
-        for asset in self.asset_set.all():
-            total += asset.units * asset.averagePrice
-        return total
+        if hasattr(self, 'annotated_value'):
+            return self.annotated_value
+        return self.asset_set.aggregate(total=Coalesce(asset_value_sum(), Decimal(0)))['total']
     
     def total_fees(self):
-        total = 0
-        for transaction in self.transaction_set.all():
-            total += transaction.fee
-        return total
+        if hasattr(self, 'annotated_fees'):
+            return self.annotated_fees
+        return self.transaction_set.aggregate(total=Coalesce(fee_sum(), Decimal(0)))['total']
     
     def total_RealisedPL(self):
-        total = 0
-        for transaction in self.transaction_set.all():
-            total += transaction.realisedPL()
-        return total
+        if hasattr(self, 'annotated_realised_pl'):
+            return self.annotated_realised_pl
+        return self.transaction_set.aggregate(total=Coalesce(realised_pl_sum(), Decimal(0)))['total']
 
 class Asset(models.Model):
     portfolio = models.ForeignKey(Portfolio, on_delete=models.CASCADE)
@@ -40,6 +102,12 @@ class Asset(models.Model):
     units = models.DecimalField(max_digits=20, decimal_places=3, default=0)
     averagePrice = models.DecimalField(max_digits=10, decimal_places=2, default=0)
 
+    class Meta:
+        constraints = [
+            # An asset is identified by its name within a portfolio, see Transaction.save()
+            models.UniqueConstraint(fields=['portfolio', 'name'], name='unique_asset_name_per_portfolio'),
+        ]
+
     def __str__(self):
         return self.ticker
     
@@ -57,18 +125,59 @@ class Transaction(models.Model):
     price = models.DecimalField(max_digits=12, decimal_places=2)
     fee = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     transaction_date = models.DateTimeField(default=timezone.now)
+    # Realised P/L of a sell against the lots it closed, set by the lot ledger when the sell is saved
+    realised_pl = models.DecimalField(max_digits=20, decimal_places=5, default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['portfolio', 'realised_pl']),
+            # Portfolio history and ledger replays read transactions in date order
+            models.Index(fields=['portfolio', 'transaction_date']),
+            models.Index(fields=['portfolio', 'asset_name', 'transaction_date']),
+        ]
 
     def realisedPL(self):
-        if self.transaction_type == 'buy':
-            return 0
-        else:
-            return (self.price - self.asset.averagePrice) * self.units
+        return self.realised_pl
         
 
     def save(self, *args, **kwargs):
-        # Call the "real" save() method.
-        super().save(*args, **kwargs)
+        from .ledger import recompute_assets, record_transaction, replay_lots
+
+        with db_transaction.atomic():
+            # Concurrent writes to the same portfolio would open the same lots twice
+            lock_portfolio(self.portfolio_id)
+            adding = self._state.adding
+            invested_before = invested_in(self.portfolio_id, self.asset_name)
+            previous_name = None if adding else Transaction.objects.filter(pk=self.pk).values_list('asset_name', flat=True).first()
+
+            # Call the "real" save() method.
+            super().save(*args, **kwargs)
 
+            # Open or close lots and persist the realised P/L of a sell
+            realised_delta = record_transaction(self, adding)
+
+            if adding:
+                self.update_asset()
+            else:
+                # An edit can change any field, rebuild the asset(s) it belongs to from the ledger
+                asset_names = {self.asset_name}
+                if previous_name is not None and previous_name != self.asset_name:
+                    asset_names.add(previous_name)
+                    replay_lots(self.portfolio, [previous_name])
+                recompute_assets(self.portfolio, asset_names)
+
+            # Keep the portfolio snapshot current with this transaction's deltas
+            if adding:
+                PortfolioSnapshot.apply_delta(
+                    self.portfolio_id,
+                    invested=invested_in(self.portfolio_id, self.asset_name) - invested_before,
+                    fees=self.fee,
+                    realised=realised_delta,
+                )
+            else:
+                PortfolioSnapshot.rebuild(self.portfolio)
+
+    def update_asset(self):
         # Check if the asset exists in the portfolio.
         if self.asset is not None:
             asset, created = Asset.objects.get_or_create(
@@ -98,31 +207,104 @@ class Transaction(models.Model):
 
                         
     def delete(self, *args, **kwargs):
-        # Check if the asset exists in the transaction.
-        if self.asset is not None:
-            asset = Asset.objects.get(name=self.asset.name, portfolio=self.portfolio)
-            if asset:
-                if self.transaction_type == 'buy':
-                    asset.units = F('units') - self.units
-                    asset.save()
-                    asset.refresh_from_db()
-                    if asset.units > 0:
-                        asset.averagePrice = (asset.averagePrice * asset.units - self.units * self.price) / asset.units
-                    else:
-                        asset.averagePrice = 0
-                else:  # sell
-                    asset.units = F('units') + self.units
+        with db_transaction.atomic():
+            lock_portfolio(self.portfolio_id)
+            # A replay by another writer may have re-priced this sell since it was loaded
+            self.refresh_from_db(fields=['realised_pl'])
+            invested_before = invested_in(self.portfolio_id, self.asset_name)
+
+            # Check if the asset exists in the transaction.
+            if self.asset is not None:
+                asset = Asset.objects.get(name=self.asset.name, portfolio=self.portfolio)
+                if asset:
+                    if self.transaction_type == 'buy':
+                        asset.units = F('units') - self.units
+                        asset.save()
+                        asset.refresh_from_db()
+                        if asset.units > 0:
+                            asset.averagePrice = (asset.averagePrice * asset.units - self.units * self.price) / asset.units
+                        else:
+                            asset.averagePrice = 0
+                    else:  # sell
+                        asset.units = F('units') + self.units
+                        asset.save()
+                        asset.refresh_from_db()
+                        if asset.units > 0:
+                            asset.averagePrice = (asset.averagePrice * asset.units + self.units * self.price) / asset.units
+                        else:
+                            asset.averagePrice = 0
                     asset.save()
-                    asset.refresh_from_db()
-                    if asset.units > 0:
-                        asset.averagePrice = (asset.averagePrice * asset.units + self.units * self.price) / asset.units
-                    else:
-                        asset.averagePrice = 0
-                asset.save()
-                if asset.units == Decimal('0.000'):
-                    asset.delete()
+                    if asset.units == Decimal('0.000'):
+                        asset.delete()
                     
 
-        # Call the "real" delete() method.
-        super().delete(*args, **kwargs)
-            
+            # Call the "real" delete() method.
+            result = super().delete(*args, **kwargs)
+
+            # Later sells may have closed lots opened by this transaction
+            from .ledger import replay_lots
+            realised_delta = replay_lots(self.portfolio, [self.asset_name]) - self.realised_pl
+
+            PortfolioSnapshot.apply_delta(
+                self.portfolio_id,
+                invested=invested_in(self.portfolio_id, self.asset_name) - invested_before,
+                fees=-Decimal(str(self.fee)),
+                realised=realised_delta,
+            )
+            return result
+
+
+class Lot(models.Model):
+    # Units opened by a buy transaction that are still held
+    portfolio = models.ForeignKey(Portfolio, on_delete=models.CASCADE)
+    transaction = models.OneToOneField(Transaction, on_delete=models.CASCADE)
+    asset_name = models.CharField(max_length=200)
+    units = models.DecimalField(max_digits=20, decimal_places=5)
+    price = models.DecimalField(max_digits=12, decimal_places=2)
+    opened = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['portfolio', 'asset_name', 'opened']),
+        ]
+
+    def __str__(self):
+        return f'{self.asset_name} {self.units} @ {self.price}'
+
+
+class PortfolioSnapshot(models.Model):
+    # Running totals for a portfolio, kept current by delta updates whenever a
+    # transaction is saved or deleted so reads don't scan the transaction history
+    portfolio = models.OneToOneField(Portfolio, on_delete=models.CASCADE, related_name='snapshot')
+    amount_invested = models.DecimalField(max_digits=30, decimal_places=5, default=0)
+    total_fees = models.DecimalField(max_digits=30, decimal_places=5, default=0)
+    realised_pl = models.DecimalField(max_digits=30, decimal_places=5, default=0)
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'Snapshot of {self.portfolio}'
+
+    @classmethod
+    def apply_delta(cls, portfolio_id, invested=0, fees=0, realised=0):
+        updated = cls.objects.filter(portfolio_id=portfolio_id).update(
+            amount_invested=F('amount_invested') + Decimal(str(invested)),
+            total_fees=F('total_fees') + Decimal(str(fees)),
+            realised_pl=F('realised_pl') + Decimal(str(realised)),
+            updated=timezone.now(),
+        )
+        if not updated:
+            cls.rebuild(Portfolio.objects.get(id=portfolio_id))
+
+    @classmethod
+    def rebuild(cls, portfolio):
+        # Full recompute from the ledger, for edits and missing rows
+        totals = Portfolio.objects.with_totals().get(id=portfolio.id)
+        snapshot, created = cls.objects.update_or_create(
+            portfolio=portfolio,
+            defaults={
+                'amount_invested': totals.total_value(),
+                'total_fees': totals.total_fees(),
+                'realised_pl': totals.total_RealisedPL(),
+            },
+        )
+        return snapshot
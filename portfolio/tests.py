@@ -1,3 +1,269 @@
-from django.test import TestCase
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+import pandas as pd
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, TestCase
+
+from .holdings import dividends_received, holdings_matrix, value_over_time
+from .importer import ImportValidationError, import_transactions
+from .ledger import close_lots, recompute_assets
+from .models import Asset, Lot, Portfolio, PortfolioSnapshot, Transaction
+from .views import create_transaction
+
+
+def trades(*rows):
+    return pd.DataFrame(
+        [(ticker, pd.Timestamp(date), units) for ticker, date, units in rows],
+        columns=['ticker', 'date', 'units'],
+    )
+
+
+class HoldingsTests(SimpleTestCase):
+    # AAA is bought on a Saturday, so it is held from the next business day
+    # (January 1st is a holiday), BBB is bought later and part of AAA sold
+    def setUp(self):
+        self.trades = trades(
+            ('AAA', '2023-12-30', 10),
+            ('BBB', '2024-01-03', 5),
+            ('AAA', '2024-01-04', -4),
+        )
+        self.opens = {
+            'AAA': pd.Series([100.0, 101.0, 102.0, 103.0], index=pd.to_datetime(['2024-01-02', '2024-01-03', '2024-01-04', '2024-01-05'])),
+            'BBB': pd.Series([20.0, 20.0, 20.0], index=pd.to_datetime(['2024-01-03', '2024-01-04', '2024-01-05'])),
+        }
+
+    def get_history(self, ticker, start=None, end=None):
+        opens = self.opens[ticker]
+        return pd.DataFrame({'Open': opens[(opens.index >= start) & (opens.index < end)]})
+
+    def test_holdings_matrix(self):
+        dates = pd.to_datetime(['2024-01-02', '2024-01-03', '2024-01-04', '2024-01-05'])
+        holdings = holdings_matrix(self.trades, dates)
+
+        self.assertEqual(holdings['AAA'].tolist(), [10, 10, 6, 6])
+        self.assertEqual(holdings['BBB'].tolist(), [0, 5, 5, 5])
+
+    def test_value_over_time(self):
+        with mock.patch('portfolio.holdings.get_history', side_effect=self.get_history) as get_history:
+            values = value_over_time(self.trades, '2024-01-06')
+
+        self.assertEqual(list(values.index.strftime('%Y-%m-%d')), ['2024-01-02', '2024-01-03', '2024-01-04', '2024-01-05'])
+        # 10 x 100, 10 x 101 + 5 x 20, 6 x 102 + 5 x 20, 6 x 103 + 5 x 20
+        self.assertEqual(values.tolist(), [1000.0, 1110.0, 712.0, 718.0])
+        # Each ticker's history is read from its first trade
+        starts = {call.args[0]: call.kwargs['start'] for call in get_history.call_args_list}
+        self.assertEqual(starts, {'AAA': pd.Timestamp('2023-12-30'), 'BBB': pd.Timestamp('2024-01-03')})
+
+    def test_end_date_is_excluded(self):
+        with mock.patch('portfolio.holdings.get_history', side_effect=self.get_history):
+            values = value_over_time(self.trades, '2024-01-04')
+        self.assertEqual(values.tolist(), [1000.0, 1110.0])
+
+    def test_dividends_use_units_held_going_into_the_ex_date(self):
+        aaa = self.trades[self.trades['ticker'] == 'AAA']
+        events = pd.Series([0.5, 0.5], index=pd.to_datetime(['2024-01-04', '2024-01-05']))
+        # The sale on the 4th doesn't count for that day's dividend: 10 x 0.5 + 6 x 0.5
+        self.assertEqual(dividends_received(aaa, events), 8.0)
+
+
+def row(**overrides):
+    return {
+        'transaction_type': 'buy', 'asset_name': 'Apple', 'asset_ticker': 'AAPL', 'units': '10',
+        'price': '100', 'fee': '1', 'transaction_date': '2024-01-02T00:00:00Z', **overrides,
+    }
+
+
+class ImportTransactionsTests(TestCase):
+    def setUp(self):
+        user = get_user_model().objects.create_user(email='user@example.com', username='user', password='password')
+        self.portfolio = Portfolio.objects.create(user=user, name='Portfolio')
+
+    def errors(self, rows):
+        with self.assertRaises(ImportValidationError) as raised:
+            import_transactions(self.portfolio, rows)
+        return raised.exception.errors
+
+    def test_valid_rows_are_imported(self):
+        result = import_transactions(self.portfolio, [row(), row(transaction_type='SELL', units='4', price='120')])
+
+        self.assertEqual(result, {'imported': 2, 'assets': 1})
+        asset = Asset.objects.get(portfolio=self.portfolio)
+        self.assertEqual(asset.units, Decimal('6'))
+        self.assertEqual(Transaction.objects.get(transaction_type='sell').realised_pl, Decimal('80'))
+
+    def test_import_adds_to_a_position_entered_by_hand(self):
+        # The way AssetView creates it, with no ledger rows behind it
+        Asset.objects.create(portfolio=self.portfolio, name='Apple', ticker='AAPL', units=5, averagePrice=80)
+
+        import_transactions(self.portfolio, [row()])
+        asset = Asset.objects.get(portfolio=self.portfolio)
+        self.assertEqual((asset.units, asset.averagePrice), (Decimal('15'), Decimal('93.33')))
+
+    def test_recompute_leaves_assets_without_ledger_rows_alone(self):
+        Asset.objects.create(portfolio=self.portfolio, name='Apple', ticker='AAPL', units=5, averagePrice=80)
+
+        self.assertEqual(recompute_assets(self.portfolio, ['Apple']), Decimal(0))
+        asset = Asset.objects.get(portfolio=self.portfolio)
+        self.assertEqual((asset.units, asset.averagePrice), (Decimal('5'), Decimal('80')))
+
+    def test_one_bad_row_rolls_back_the_whole_import(self):
+        rows = [row(), row(units='-1'), *[row() for _ in range(1500)]]
+        self.assertEqual(self.errors(rows), [{'row': 2, 'error': "'units' must be positive."}])
+
+        self.assertFalse(Transaction.objects.exists())
+        self.assertFalse(Asset.objects.exists())
+        snapshot = PortfolioSnapshot.objects.filter(portfolio=self.portfolio).first()
+        self.assertTrue(snapshot is None or snapshot.amount_invested == 0)
+
+    def test_wrong_types_are_row_errors(self):
+        errors = self.errors([
+            row(transaction_type=1),
+            row(transaction_date=123),
+            row(transaction_date='2024-02-30'),
+            row(asset_ticker=['AAPL']),
+            row(price=True),
+            row(units={'value': 1}),
+        ])
+        self.assertEqual([error['row'] for error in errors], [1, 2, 3, 4, 5, 6])
+
+    def test_values_beyond_the_model_fields_are_row_errors(self):
+        errors = self.errors([
+            row(price='100000000'),  # Fits the transaction, not the asset's average price
+            row(fee='1e20'),
+            row(asset_ticker='T' * 11),
+            row(asset_name='A' * 201),
+        ])
+        self.assertEqual([error['row'] for error in errors], [1, 2, 3, 4])
+        self.assertIn('less than', errors[0]['error'])
+
+    def test_extra_decimal_places_are_rounded_like_the_database(self):
+        import_transactions(self.portfolio, [row(price='100.456')])
+        self.assertEqual(Transaction.objects.get().price, Decimal('100.46'))
+
+    def test_malformed_csv_is_a_row_error(self):
+        body = 'transaction_type,asset_name,asset_ticker,units,price\nbuy,Apple,AAPL,1,"' + 'x' * 200000 + '"\n'
+        response = self.client.post(f'/portfolio/{self.portfolio.id}/import-transactions/', body, content_type='text/csv')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Malformed CSV', response.json()['errors'][0]['error'])
+        self.assertFalse(Transaction.objects.exists())
+
+
+class LedgerTests(TestCase):
+    def setUp(self):
+        user = get_user_model().objects.create_user(email='user@example.com', username='user', password='password')
+        self.portfolio = Portfolio.objects.create(user=user, name='Portfolio')
+
+    def lots(self):
+        return [Lot(units=Decimal(10), price=Decimal(100)), Lot(units=Decimal(10), price=Decimal(120))]
+
+    def trade(self, transaction_type, units, price, date):
+        return create_transaction(self.portfolio.id, transaction_type, 'Apple', 'AAPL', 'Stock', 'Tech', units, price, 0, date)
+
+    def test_existing_asset_keeps_its_type_and_sector(self):
+        self.trade('buy', 10, 100, '2024-01-02T00:00:00Z')
+        create_transaction(self.portfolio.id, 'buy', 'Apple', 'AAPL', 'Others', 'Others', 5, 110, 0, '2024-01-03T00:00:00Z')
+
+        asset = Asset.objects.get(portfolio=self.portfolio)
+        self.assertEqual((asset.type, asset.sector, asset.units), ('Stock', 'Tech', 15))
+
+    def test_fifo_closes_the_oldest_lots_first(self):
+        lots = self.lots()
+        # 10 x (130 - 100) + 5 x (130 - 120)
+        self.assertEqual(close_lots(lots, 15, 130, 'fifo'), Decimal(350))
+        self.assertEqual([lot.units for lot in lots], [0, 5])
+
+    def test_average_cost_shrinks_every_lot(self):
+        lots = self.lots()
+        # 15 x (130 - 110)
+        self.assertEqual(close_lots(lots, 15, 130, 'average'), Decimal(300))
+        self.assertEqual([lot.units for lot in lots], [Decimal('2.5'), Decimal('2.5')])
+
+    def test_selling_more_than_is_held_only_closes_what_is_held(self):
+        lots = self.lots()
+        self.assertEqual(close_lots(lots, 25, 130, 'fifo'), Decimal(400))
+        self.assertEqual(close_lots(lots, 1, 130, 'fifo'), 0)
+
+    def test_back_dated_buy_reprices_later_sells(self):
+        self.trade('buy', 10, 100, '2024-01-02T00:00:00Z')
+        sell = self.trade('sell', 5, 150, '2024-01-10T00:00:00Z')
+        self.assertEqual(sell.realised_pl, Decimal(250))
+
+        # Average cost becomes (10 x 50 + 10 x 100) / 20 = 75
+        self.trade('buy', 10, 50, '2024-01-01T00:00:00Z')
+        sell.refresh_from_db()
+        self.assertEqual(sell.realised_pl, Decimal(375))
+        self.assertEqual(sum(lot.units for lot in Lot.objects.all()), 15)
+        self.assertEqual(PortfolioSnapshot.objects.get(portfolio=self.portfolio).realised_pl, 375)
+
+    def test_deleting_a_buy_reprices_later_sells(self):
+        buy = self.trade('buy', 10, 50, '2024-01-01T00:00:00Z')
+        self.trade('buy', 10, 100, '2024-01-02T00:00:00Z')
+        sell = self.trade('sell', 5, 150, '2024-01-10T00:00:00Z')
+
+        Transaction.objects.get(id=buy.id).delete()
+        sell.refresh_from_db()
+        self.assertEqual(sell.realised_pl, Decimal(250))
+        self.assertFalse(Lot.objects.filter(transaction_id=buy.id).exists())
+        self.assertEqual(PortfolioSnapshot.objects.get(portfolio=self.portfolio).realised_pl, 250)
+
+    def test_deleting_a_sell_uses_its_current_realised_pl(self):
+        self.trade('buy', 10, 100, '2024-01-02T00:00:00Z')
+        sell = Transaction.objects.get(id=self.trade('sell', 5, 150, '2024-01-10T00:00:00Z').id)
+        # Re-prices the sell to 375 after it was loaded
+        self.trade('buy', 10, 50, '2024-01-01T00:00:00Z')
+
+        sell.delete()
+        self.assertEqual(PortfolioSnapshot.objects.get(portfolio=self.portfolio).realised_pl, 0)
+
+    def test_editing_a_transaction_rebuilds_the_asset(self):
+        self.trade('buy', 10, 100, '2024-01-02T00:00:00Z')
+        buy = Transaction.objects.get(id=self.trade('buy', 10, 50, '2024-01-03T00:00:00Z').id)
+
+        buy.units = Decimal(20)
+        buy.save()
+        asset = Asset.objects.get(portfolio=self.portfolio)
+        self.assertEqual((asset.units, asset.averagePrice), (Decimal(30), Decimal('66.67')))
+        self.assertEqual(PortfolioSnapshot.objects.get(portfolio=self.portfolio).amount_invested, Decimal('2000.10'))
+
+
+class PortfolioSnapshotTests(TestCase):
+    def setUp(self):
+        user = get_user_model().objects.create_user(email='user@example.com', username='user', password='password')
+        self.portfolio = Portfolio.objects.create(user=user, name='Portfolio')
+
+    def assertSnapshotMatchesRebuild(self):
+        snapshot = PortfolioSnapshot.objects.get(portfolio=self.portfolio)
+        delta = (snapshot.amount_invested, snapshot.total_fees, snapshot.realised_pl)
+        rebuilt = PortfolioSnapshot.rebuild(self.portfolio)
+        self.assertEqual(delta, (rebuilt.amount_invested, rebuilt.total_fees, rebuilt.realised_pl))
+
+    def test_delta_updates_match_a_rebuild(self):
+        trades = [
+            ('buy', 'Apple', 10, 100, 1, '2024-01-02T00:00:00Z'),
+            ('buy', 'Tesla', 3, 250, 2, '2024-01-03T00:00:00Z'),
+            ('sell', 'Apple', 4, 130, 1, '2024-01-05T00:00:00Z'),
+            ('buy', 'Apple', 5, 90, 0.5, '2024-01-01T00:00:00Z'),  # Back-dated
+            ('sell', 'Tesla', 3, 200, 2, '2024-01-06T00:00:00Z'),  # Closes the position
+        ]
+        for transaction_type, name, units, price, fee, date in trades:
+            create_transaction(self.portfolio.id, transaction_type, name, name[:4].upper(), 'Stock', 'Tech', units, price, fee, date)
+            self.assertSnapshotMatchesRebuild()
+
+        for transaction in Transaction.objects.filter(transaction_type='sell'):
+            transaction.delete()
+            self.assertSnapshotMatchesRebuild()
+
+    def test_import_updates_match_a_rebuild(self):
+        create_transaction(self.portfolio.id, 'buy', 'Apple', 'AAPL', 'Stock', 'Tech', 10, 100, 1, '2024-01-02T00:00:00Z')
+        import_transactions(self.portfolio, [row(transaction_type='sell', units='3', price='120'), row(asset_name='Tesla', asset_ticker='TSLA')])
+        self.assertSnapshotMatchesRebuild()
+
+
+class AsyncViewTests(TestCase):
+    def test_unknown_portfolio_is_not_found(self):
+        for path in ['/portfolio/999/assets/async/', '/portfolio/portfolio-value/999/async/',
+                     '/portfolio/999/portfolionews/async/', '/portfolio/999/portfoliometrics/async/']:
+            with self.subTest(path=path):
+                self.assertEqual(self.client.get(path).status_code, 404)
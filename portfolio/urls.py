@@ -5,14 +5,19 @@ from .views import (
     UpdatePortfolio,
     DeletePortfolio,
     CreateTransaction,
+    ImportTransactions,
     GetAssets,
+    AsyncGetAssets,
     GetTransactions,
     DeleteTransaction,
     GetPortfolioValue,
+    AsyncGetPortfolioValue,
     GetDividendsReceived,
     GetPortfolioValueOverTime,
     GetPortfolioNews,
+    AsyncGetPortfolioNews,
     GetPortfolioMetrics,
+    AsyncGetPortfolioMetrics,
     GetSPMetrics
 )
 
@@ -23,13 +28,18 @@ urlpatterns = [
     path('delete/<int:portfolio_id>/', DeletePortfolio.as_view()),
 
     path('create-transaction/', CreateTransaction.as_view()),
+    path('<int:portfolio_id>/import-transactions/', ImportTransactions.as_view()),
     path('<int:portfolio_id>/assets/', GetAssets.as_view()),
+    path('<int:portfolio_id>/assets/async/', AsyncGetAssets.as_view()),
     path('<int:portfolio_id>/transactions/', GetTransactions.as_view()),
     path('transaction/<int:transaction_id>/delete/', DeleteTransaction.as_view()),
     path('portfolio-value/<int:portfolio_id>/', GetPortfolioValue.as_view()),
+    path('portfolio-value/<int:portfolio_id>/async/', AsyncGetPortfolioValue.as_view()),
     path('<int:portfolio_id>/dividends/', GetDividendsReceived.as_view()),
     path('<int:portfolio_id>/portfoliovalue/', GetPortfolioValueOverTime.as_view()),
     path('<int:portfolio_id>/portfolionews/', GetPortfolioNews.as_view()),
+    path('<int:portfolio_id>/portfolionews/async/', AsyncGetPortfolioNews.as_view()),
     path('<int:portfolio_id>/portfoliometrics/', GetPortfolioMetrics.as_view()),
+    path('<int:portfolio_id>/portfoliometrics/async/', AsyncGetPortfolioMetrics.as_view()),
     path('spmetrics/', GetSPMetrics.as_view()),
 ]
\ No newline at end of file
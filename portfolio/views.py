@@ -1,26 +1,36 @@
 from decimal import Decimal
+import asyncio
 import json
-from django.shortcuts import get_object_or_404
+from django.shortcuts import aget_object_or_404, get_object_or_404
 from django.views import View
 from django.http import JsonResponse, HttpResponseBadRequest, HttpResponseServerError
 import pytz
 import os
-import requests
-from .models import Portfolio, Asset, Transaction
+from core import http_client
+from core.timing import timed, wrap
+from .models import Portfolio, Asset, Transaction, PortfolioSnapshot, COST_BASIS_METHODS, lock_portfolio
 from django.contrib.auth import get_user_model
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
 from django.utils import timezone
+from django.db import transaction as db_transaction
+from asgiref.sync import sync_to_async
 from .serializers import TransactionSerializer
 from .serializers import AssetSerializer
-import yfinance as yf
+from asset.quote_cache import get_quotes
+from asset.price_store import get_history, get_closes
+from asset.dividend_store import get_dividends
+from asset.async_client import market_data
+from .holdings import transactions_frame, value_over_time, dividends_received
+from .importer import read_rows, import_transactions, ImportValidationError
+from .ledger import replay_lots
 import pandas as pd
 import numpy as np
 from django.utils.dateparse import parse_datetime
-from pandas.tseries.offsets import CustomBusinessDay
-from pandas.tseries.holiday import USFederalHolidayCalendar
 from datetime import datetime, timedelta
-from django.test.client import RequestFactory
+from django.core.serializers.json import DjangoJSONEncoder
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
 
 User = get_user_model()
 
@@ -45,8 +55,8 @@ class CreatePortfolio(View):
 @method_decorator(csrf_exempt, name='dispatch')
 class GetAllPortfolios(View):
     def get(self, request, user_id):
-        portfolios = Portfolio.objects.filter(user_id=user_id)
-        portfolios_list = [{'id': p.id, 'name': p.name, 'remarks': p.remarks, 'value': p.total_value()} for p in portfolios]
+        portfolios = Portfolio.objects.filter(user_id=user_id).select_related('snapshot')
+        portfolios_list = [{'id': p.id, 'name': p.name, 'remarks': p.remarks, 'value': p.get_snapshot().amount_invested} for p in portfolios]
         return JsonResponse(portfolios_list, safe=False)
     
 @method_decorator(csrf_exempt, name='dispatch')
@@ -56,12 +66,26 @@ class UpdatePortfolio(View):
         portfolio = Portfolio.objects.get(id=portfolio_id)
         portfolio.name = data.get('name', portfolio.name)
         portfolio.remarks = data.get('remarks', portfolio.remarks)
+        cost_basis_method = data.get('cost_basis_method', portfolio.cost_basis_method)
+        if cost_basis_method not in dict(COST_BASIS_METHODS):
+            return HttpResponseBadRequest("'cost_basis_method' must be 'average' or 'fifo'.")
+        method_changed = cost_basis_method != portfolio.cost_basis_method
+        portfolio.cost_basis_method = cost_basis_method
         portfolio.save()
+
+        # Realised P/L of every sell depends on the cost basis method
+        if method_changed:
+            with db_transaction.atomic():
+                lock_portfolio(portfolio.id)
+                asset_names = Transaction.objects.filter(portfolio=portfolio).values_list('asset_name', flat=True).distinct()
+                realised_delta = replay_lots(portfolio, list(asset_names))
+                PortfolioSnapshot.apply_delta(portfolio.id, realised=realised_delta)
         return JsonResponse({
             'id': portfolio.id,
             'user_id': portfolio.user.id,
             'name': portfolio.name,
             'remarks': portfolio.remarks,
+            'cost_basis_method': portfolio.cost_basis_method,
         }, status=200)
     
 @method_decorator(csrf_exempt, name='dispatch')
@@ -98,29 +122,30 @@ class AssetView(View):
         }, status=201)
 
 def create_transaction(portfolio_id, transaction_type, asset_name, asset_ticker, asset_type, asset_sector, units, price, fee=0, transaction_date=None):
-    portfolio = Portfolio.objects.get(id=portfolio_id)
     transaction_date = parse_datetime(transaction_date) if transaction_date else timezone.now()
 
-    # Get or create the Asset instance
-    asset, created = Asset.objects.get_or_create(
-        portfolio=portfolio,
-        name=asset_name, 
-        ticker=asset_ticker,
-        type=asset_type,
-        sector=asset_sector,
-    )
-
-    transaction = Transaction.objects.create(
-        portfolio=portfolio, 
-        transaction_type=transaction_type, 
-        asset=asset,  # Use the Asset instance
-        asset_name=asset_name,
-        ticker=asset_ticker,
-        units=float(units), 
-        price=float(price), 
-        fee=float(fee), 
-        transaction_date=transaction_date
-    )
+    # The asset and its transaction are written together, one portfolio at a time
+    with db_transaction.atomic():
+        portfolio = lock_portfolio(portfolio_id)
+
+        # Get or create the Asset instance on (portfolio, name), an existing asset keeps its type and sector
+        asset, created = Asset.objects.get_or_create(
+            portfolio=portfolio,
+            name=asset_name,
+            defaults={'ticker': asset_ticker, 'type': asset_type, 'sector': asset_sector},
+        )
+
+        transaction = Transaction.objects.create(
+            portfolio=portfolio, 
+            transaction_type=transaction_type, 
+            asset=asset,  # Use the Asset instance
+            asset_name=asset_name,
+            ticker=asset_ticker,
+            units=float(units), 
+            price=float(price), 
+            fee=float(fee), 
+            transaction_date=transaction_date
+        )
     return transaction
 
 @method_decorator(csrf_exempt, name='dispatch')        
@@ -151,6 +176,42 @@ class CreateTransaction(View):
             'transaction_date': transaction.transaction_date,
         }, status=201)
     
+@timed('compute.valuation')
+def value_assets(assets_data, quotes):
+    # Vectorised valuation of a list of Asset.values() rows against the get_quotes() frame
+    frame = pd.DataFrame(assets_data)
+    units = frame['units'].to_numpy(dtype=float)
+    average_price = frame['averagePrice'].to_numpy(dtype=float)
+    quotes = quotes.reindex(frame['ticker'].str.upper())
+    current_price = quotes['regularMarketOpen'].to_numpy().round(2)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        percentage_change = ((current_price - average_price) / average_price * 100).round(2)
+
+    valuation = pd.DataFrame({
+        'currentPrice': current_price,
+        'currentValue': (current_price * units).round(2),
+        'profit': ((current_price - average_price) * units).round(2),
+        'percentageChange': np.where(average_price != 0, percentage_change, 0),
+    })
+    # Tickers without a quote are reported as null rather than NaN
+    return valuation.astype(object).where(valuation.notna(), None)
+
+@method_decorator(csrf_exempt, name='dispatch')
+class ImportTransactions(View):
+    def post(self, request, portfolio_id):
+        portfolio = get_object_or_404(Portfolio, id=portfolio_id)
+
+        # Rows are validated as they stream in, nothing is written unless every row is valid
+        try:
+            result = import_transactions(portfolio, read_rows(request))
+        except ImportValidationError as e:
+            return JsonResponse({'errors': e.errors}, status=400)
+        except (json.JSONDecodeError, UnicodeDecodeError) as e:
+            return JsonResponse({'errors': [{'row': None, 'error': str(e)}]}, status=400)
+
+        return JsonResponse(result, status=201)
+
 @method_decorator(csrf_exempt, name='dispatch')
 class GetAssets(View):
     def get(self, request, portfolio_id):
@@ -163,31 +224,29 @@ class GetAssets(View):
         # Serialize the assets into a list of dictionaries
         assets_data = list(assets.values())
 
-        # Get the current price for each asset and add it to the asset's data
-        for asset_data in assets_data:
-            ticker = asset_data['ticker']
-            units = float(asset_data['units'])
-            averagePrice = float(asset_data['averagePrice'])
-            info = yf.Ticker(ticker).info
-            currentPrice = round(info.get('regularMarketOpen'), 2)
-            asset_data['currentPrice'] = currentPrice
-
-            # Compute the value of the asset
-            asset_data['currentValue'] = round(currentPrice * units, 2)
-
-            # Compute the profit
-            profit = round(((currentPrice - averagePrice) * units), 2)
-            asset_data['profit'] = profit
-
-            # Compute the percentage change
-            if averagePrice != 0:
-                percentageChange = round(((currentPrice - averagePrice) / averagePrice) * 100, 2)
-            else:
-                percentageChange = 0
-            asset_data['percentageChange'] = percentageChange
+        # Get the current price for every asset in one batched call and add it to the asset's data
+        if assets_data:
+            quotes = get_quotes([asset_data['ticker'] for asset_data in assets_data])
+            valuation = value_assets(assets_data, quotes)
+            for asset_data, values in zip(assets_data, valuation.to_dict('records')):
+                asset_data.update(values)
 
         # Return the data as JSON
         return JsonResponse(assets_data, safe=False)
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncGetAssets(View):
+    async def get(self, request, portfolio_id):
+        portfolio = await aget_object_or_404(Portfolio, id=portfolio_id)
+        assets_data = [asset_data async for asset_data in Asset.objects.filter(portfolio=portfolio).values()]
+
+        if assets_data:
+            quotes = await market_data.get_quotes([asset_data['ticker'] for asset_data in assets_data])
+            valuation = value_assets(assets_data, quotes)
+            for asset_data, values in zip(assets_data, valuation.to_dict('records')):
+                asset_data.update(values)
+
+        return JsonResponse(assets_data, safe=False)
     
 @method_decorator(csrf_exempt, name='dispatch')
 class GetTransactions(View):
@@ -215,63 +274,87 @@ class DeleteTransaction(View):
         except Transaction.DoesNotExist:
             return JsonResponse({'error': 'Transaction not found'}, status=404)
         
+@timed('compute.portfolio_value')
+def portfolio_value_summary(snapshot, holdings, quotes):
+    # Value, profit and dividend figures from the snapshot, a ticker/units frame and the get_quotes() frame
+    quotes = quotes.reindex(holdings['ticker'].str.upper())
+    units = holdings['units'].to_numpy(dtype=float)
+    portfolio_value = float(np.nansum(quotes['regularMarketOpen'].to_numpy() * units))
+    annual_dividends = float(np.nansum(quotes['trailingAnnualDividendRate'].to_numpy() * units))
+
+    # Calculate the amount invested
+    amount_invested = float(snapshot.amount_invested)  # Convert amount_invested to float
+
+    # Calculate the percentage change
+    percentage_change = ((portfolio_value - amount_invested) / amount_invested) * 100 if amount_invested != 0 else 0
+
+    realisedPL = float(snapshot.realised_pl)
+    total_fees = float(snapshot.total_fees)
+
+    # Calculate the profit
+    profit = portfolio_value - amount_invested + realisedPL - total_fees
+
+    # Calculate the profit percentage change
+    profit_percentage_change = (profit / (amount_invested + total_fees)) * 100 if (amount_invested + total_fees) != 0 else 0
+
+    # Calculate the monthly dividends
+    monthly_dividends = annual_dividends / 12
+
+    return {
+        'portfolio value': round(portfolio_value, 2),
+        'Amount invested': round(amount_invested, 2),
+        'Percentage change': round(percentage_change, 2),
+        'Realised P/L': round(realisedPL, 2),
+        'Total fees': round(total_fees, 2),
+        'Profit': round(profit, 2),
+        'Profit percentage change': round(profit_percentage_change, 2),
+        'Annual dividends': round(annual_dividends, 2),
+        'Monthly dividends': round(monthly_dividends, 2)
+    }
+
 @method_decorator(csrf_exempt, name='dispatch')
 class GetPortfolioValue(View):
     def get(self, request, portfolio_id):
-        # Fetch the portfolio
-        portfolio = get_object_or_404(Portfolio, id=portfolio_id)
+        # Fetch the portfolio along with its snapshot of invested amount, fees and realised P/L
+        portfolio = get_object_or_404(Portfolio.objects.select_related('snapshot'), id=portfolio_id)
+        snapshot = portfolio.get_snapshot()
 
         # Fetch all the assets in the portfolio
         assets = Asset.objects.filter(portfolio=portfolio)
 
-        # Serialize the assets into a list of tickers
-        serializer = AssetSerializer(assets, many=True)
-
-        # Use the yfinance API to get asset information for each ticker
-        portfolio_value = 0
-        annual_dividends = 0
-        for asset in serializer.data:
-            ticker = asset['ticker']
-            units = float(asset['units'])  # Convert units to float
-            info = yf.Ticker(ticker).info
-            regular_market_open = info.get('regularMarketOpen')
-            trailing_annual_dividend_rate = info.get('trailingAnnualDividendRate')
-            if regular_market_open is not None:
-                value = regular_market_open * units
-                portfolio_value += value
-            if trailing_annual_dividend_rate is not None:
-                annual_dividends += trailing_annual_dividend_rate * units
-
-        # Calculate the amount invested
-        amount_invested = float(portfolio.total_value())  # Convert amount_invested to float
-
-        # Calculate the percentage change
-        percentage_change = ((portfolio_value - amount_invested) / amount_invested) * 100 if amount_invested != 0 else 0
+        # Get the current price and dividend rate for every asset in one batched call
+        holdings = pd.DataFrame(list(assets.values('ticker', 'units')), columns=['ticker', 'units'])
+        quotes = get_quotes(holdings['ticker'])
 
-        realisedPL = float(portfolio.total_RealisedPL())
-        total_fees = float(portfolio.total_fees())
+        # Return the portfolio value, amount invested, and percentage change as JSON
+        return JsonResponse(portfolio_value_summary(snapshot, holdings, quotes))
 
-        # Calculate the profit
-        profit = portfolio_value - amount_invested + realisedPL - total_fees
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncGetPortfolioValue(View):
+    async def get(self, request, portfolio_id):
+        portfolio = await aget_object_or_404(Portfolio.objects.select_related('snapshot'), id=portfolio_id)
+        snapshot = await sync_to_async(portfolio.get_snapshot)()
+
+        holdings = pd.DataFrame(
+            [holding async for holding in Asset.objects.filter(portfolio=portfolio).values('ticker', 'units')],
+            columns=['ticker', 'units'],
+        )
+        quotes = await market_data.get_quotes(holdings['ticker'])
+        return JsonResponse(portfolio_value_summary(snapshot, holdings, quotes))
 
-        # Calculate the profit percentage change
-        profit_percentage_change = (profit / (amount_invested + total_fees)) * 100 if (amount_invested + total_fees) != 0 else 0
+@timed('compute.dividends')
+def portfolio_dividends(transactions):
+    # Dividends received per ticker from a transactions_frame(), sells reduce the holding from their date onwards
 
-        # Calculate the monthly dividends
-        monthly_dividends = annual_dividends / 12
+    # Fetch each ticker's dividends once and join them against the holdings on every ex-date
+    dividends = {}
+    current_date = pd.Timestamp(timezone.now().astimezone(pytz.UTC).date())
+    for ticker, trades in transactions.groupby('ticker'):
+        events = get_dividends(ticker)
+        dividends[ticker] = dividends_received(trades, events[events.index <= current_date])
 
-        # Return the portfolio value, amount invested, and percentage change as JSON
-        return JsonResponse({
-            'portfolio value': round(portfolio_value, 2),
-            'Amount invested': round(amount_invested, 2),
-            'Percentage change': round(percentage_change, 2),
-            'Realised P/L': round(realisedPL, 2),
-            'Total fees': round(total_fees, 2),
-            'Profit': round(profit, 2),
-            'Profit percentage change': round(profit_percentage_change, 2),
-            'Annual dividends': round(annual_dividends, 2),
-            'Monthly dividends': round(monthly_dividends, 2)
-        })
+    # Filter out assets with dividends <= 0 and format the dividends to 2 decimal places
+    return {ticker.upper(): '{:.2f}'.format(dividend) for ticker, dividend in dividends.items() if dividend > 0}
 
 @method_decorator(csrf_exempt, name='dispatch')
 class GetDividendsReceived(View):
@@ -280,47 +363,10 @@ class GetDividendsReceived(View):
         portfolio = Portfolio.objects.get(id=portfolio_id)
 
         # Fetch all transactions related to this portfolio
-        transactions = Transaction.objects.filter(portfolio=portfolio)
-
-        # Initialize a dictionary to store the total dividends for each asset
-        dividends = {}
-
-        # Iterate through the transactions
-        for transaction in transactions:
-            # Fetch the dividends data for the asset
-            stock = yf.Ticker(transaction.ticker)
-            data = stock.dividends
-
-            # Convert the transaction date and the current date to timezone-aware datetime objects
-            transaction_date = transaction.transaction_date.replace(tzinfo=pytz.UTC)
-            current_date = timezone.now().astimezone(pytz.UTC)
-
-            # Check if data is a pandas Series
-            if isinstance(data, pd.Series):
-                # Convert the index of the dividends data to UTC
-                data.index = data.index.tz_convert('UTC')
-
-                # Filter the dividends data to only include dividends from the transaction date to the current date
-                data = data[(data.index >= transaction_date) & (data.index <= current_date)]
-
-                # Calculate the total dividends during this period
-                total_dividends = Decimal(sum(data.values)) * transaction.units
-            else:
-                total_dividends = 0
-
-            # If the transaction is a "buy" transaction, add the total dividends to the total dividends for the asset
-            if transaction.transaction_type == 'buy':
-                dividends[transaction.ticker] = dividends.get(transaction.ticker, 0) + total_dividends
-
-            # If the transaction is a "sell" transaction, subtract the total dividends from the total dividends for the asset
-            elif transaction.transaction_type == 'sell':
-                dividends[transaction.ticker] = dividends.get(transaction.ticker, 0) - total_dividends
-
-        # Filter out assets with dividends <= 0 and format the dividends to 2 decimal places
-        dividends = {ticker.upper(): '{:.2f}'.format(dividend) for ticker, dividend in dividends.items() if dividend > 0}
+        transactions = transactions_frame(Transaction.objects.filter(portfolio=portfolio))
 
         # Return the total dividends for each asset
-        return JsonResponse(dividends)
+        return JsonResponse(portfolio_dividends(transactions))
     
 @method_decorator(csrf_exempt, name='dispatch')
 class GetPortfolioValueOverTime(View):
@@ -331,63 +377,37 @@ class GetPortfolioValueOverTime(View):
         # Subtract one day
         end_date = current_date - timedelta(days=1)
 
-        # Get all transactions for the portfolio excluding those made today, sorted by date
-        transactions = Transaction.objects.filter(portfolio_id=portfolio_id).order_by('transaction_date')
+        # Get all transactions for the portfolio
+        transactions = Transaction.objects.filter(portfolio_id=portfolio_id)
     
         # If there are no transactions, return an empty JSON response
         if not transactions.exists():
             return JsonResponse({})
 
-        # Initialize a list to store the dataframes
-        dfs = []
-
-        # Define a custom business day Calendar
-        custom_business_day = CustomBusinessDay(calendar=USFederalHolidayCalendar())
-
-        # For each transaction
-        for transaction in transactions:
-            # Get the date of the transaction without the time segment
-            start_date = transaction.transaction_date.astimezone(pytz.UTC).replace(hour=0, minute=0, second=0, microsecond=0)
-
-            # Fetch all the historical price data for the asset from the transaction date to the current date
-            data = yf.Ticker(transaction.ticker)
-            historical_data = data.history(start=start_date.strftime('%Y-%m-%d'), end=end_date.strftime('%Y-%m-%d'))[['Open']]
-
-            # Remove weekends and holidays
-            historical_data = historical_data[historical_data.index.to_series().map(custom_business_day.is_on_offset)]
-            
-            # Check if 'Open' column exists in the DataFrame
-            if 'Open' in historical_data.columns:
-                # Multiply the opening price by the number of units in the transaction
-                historical_data['Open'] *= float(transaction.units)
-
-                # If the transaction is a sell, multiply the opening price by -1
-                if transaction.transaction_type == 'sell':
-                    historical_data['Open'] *= -1
+        # Build the date x ticker holdings matrix and value it against each ticker's opening prices
+        portfolio_value_over_time = value_over_time(transactions_frame(transactions), end_date)
 
-                # Add the dataframe to the list
-                dfs.append(historical_data)
-            else:
-                # Handle the case when 'Open' column does not exist
-                # You might want to log an error message or throw an exception
-                print(f"No 'Open' column in historical data for transaction {transaction.id}")
-
-        # Concatenate all the dataframes
-        portfolio_value_over_time = pd.concat(dfs)
-
-        # Convert the index to a DatetimeIndex in UTC
-        portfolio_value_over_time.index = pd.to_datetime(portfolio_value_over_time.index, utc=True)
-
-        # Group by date and sum up the opening prices
-        portfolio_value_over_time = portfolio_value_over_time.groupby(portfolio_value_over_time.index.date).sum()
-
-        # Convert the dataframe to a dictionary and convert the Timestamp keys to strings
-        portfolio_value_over_time = portfolio_value_over_time['Open'].to_dict()
-        portfolio_value_over_time = {str(k): v for k, v in portfolio_value_over_time.items()}
+        # Convert the series to a dictionary keyed by date strings
+        portfolio_value_over_time = {str(date.date()): float(value) for date, value in portfolio_value_over_time.items()}
 
         # Return the portfolio value over time as a JSON response
         return JsonResponse(portfolio_value_over_time)
     
+NEWS_URL = 'https://api.marketaux.com/v1/news/all'
+
+def news_params(tickers, api_key):
+    return {'symbols': ','.join(tickers), 'language': 'en', "api_token": api_key, "filter_entities":"true"}
+
+def news_response(response):
+    # Works for both requests and httpx responses
+    if response.status_code == 200:
+        data = response.json()
+        response = JsonResponse(data)  # Create the JsonResponse
+        response["Access-Control-Allow-Origin"] = "*"  # Add the header to the response
+        return response
+    else:
+        return HttpResponseBadRequest('API request failed.')
+
 @method_decorator(csrf_exempt, name='dispatch')
 class GetPortfolioNews(View):
     def get(self, request, portfolio_id):
@@ -401,21 +421,82 @@ class GetPortfolioNews(View):
         serializer = AssetSerializer(assets, many=True)
         tickers = [asset['ticker'] for asset in serializer.data]
 
-        # Convert the list of tickers into a comma-separated string
-        tickers_string = ','.join(tickers)
-
         api_key = os.getenv('NEWS_API_KEY')
         if api_key is None:
             return HttpResponseServerError("NEWS_API_KEY is not set.")
         
-        response = requests.get('https://api.marketaux.com/v1/news/all', params={'symbols': tickers_string, 'language': 'en', "api_token": api_key, "filter_entities":"true"})
-        if response.status_code == 200:
-            data = response.json()
-            response = JsonResponse(data)  # Create the JsonResponse
-            response["Access-Control-Allow-Origin"] = "*"  # Add the header to the response
-            return response
-        else:
-            return HttpResponseBadRequest('API request failed.')
+        return news_response(http_client.get('marketaux', NEWS_URL, params=news_params(tickers, api_key)))
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncGetPortfolioNews(View):
+    async def get(self, request, portfolio_id):
+        portfolio = await aget_object_or_404(Portfolio, id=portfolio_id)
+        tickers = [ticker async for ticker in Asset.objects.filter(portfolio=portfolio).values_list('ticker', flat=True)]
+
+        api_key = os.getenv('NEWS_API_KEY')
+        if api_key is None:
+            return HttpResponseServerError("NEWS_API_KEY is not set.")
+
+        return news_response(await market_data.get('marketaux', NEWS_URL, params=news_params(tickers, api_key)))
+
+@timed('compute.metrics')
+def portfolio_metrics(tickers, units, stock_data, quotes):
+    # Allocation, risk and return figures from the price history and the get_quotes() frame
+
+    # Calculate the percentage change for each asset and drop the NaN values
+    stock_returns = stock_data.pct_change().dropna()
+
+    # Calculate the asset allocation of the portfolio
+    quotes = quotes.reindex([ticker.upper() for ticker in tickers])
+    values = quotes['regularMarketOpen'].to_numpy() * np.array(units, dtype=float)
+    values = values[~np.isnan(values)]
+    portfolio_value = values.sum()
+    allocations = np.round(values / portfolio_value, 3).tolist()
+
+    # Create a dictionary mapping tickers to allocations
+    allocations_dict = dict(zip(tickers, allocations))
+
+    portfolio_returns = stock_returns.copy()
+
+    # Calculate the returns for each asset
+    for asset, allocation in zip(portfolio_returns.columns, allocations):
+        portfolio_returns[asset] = portfolio_returns[asset] * allocation
+
+    # Calculate portfolio return
+    portfolio_returns['Portfolio_Return'] = portfolio_returns.sum(axis=1)
+
+    # Assume a risk-free rate of 0
+    risk_free_rate = 0
+
+    # Calculate Sharpe Ratio and annualize it
+    sharpe_ratio = (portfolio_returns['Portfolio_Return'].mean() - risk_free_rate) / portfolio_returns['Portfolio_Return'].std()
+    sharpe_ratio = round(sharpe_ratio * np.sqrt(255), 2)
+
+    # Calculate downside deviation
+    downside_returns = portfolio_returns.loc[portfolio_returns['Portfolio_Return'] < risk_free_rate]
+    downside_deviation = downside_returns.std()['Portfolio_Return']
+
+    # Calculate Sortino Ratio and annualize it
+    sortino_ratio = (portfolio_returns['Portfolio_Return'].mean() - risk_free_rate) / downside_deviation
+    sortino_ratio = round(sortino_ratio * np.sqrt(255), 2)
+
+    # Calculate expected annual return
+    expected_annual_return = round(portfolio_returns['Portfolio_Return'].mean() * 255 * 100, 2)
+
+    # Calculate annual volatility
+    annual_volatility = round(portfolio_returns['Portfolio_Return'].std() * np.sqrt(255) * 100, 2)
+
+    # Calculate correlation matrix
+    corr_matrix = stock_returns.corr()
+
+    return {
+        "Portfolio Allocation": allocations_dict,
+        "Sharpe Ratio": sharpe_ratio,
+        "Sortino Ratio": sortino_ratio,
+        "Expected Annual Return": expected_annual_return,
+        "Annual Volatility": annual_volatility,
+        "Correlation Matrix": corr_matrix.to_dict(),
+    }
 
 @method_decorator(csrf_exempt, name='dispatch')
 class GetPortfolioMetrics(View):
@@ -429,149 +510,159 @@ class GetPortfolioMetrics(View):
         # Serialize the assets into a list of tickers
         serializer = AssetSerializer(assets, many=True)
         tickers = [asset['ticker'] for asset in serializer.data]
+        units = [asset['units'] for asset in serializer.data]
 
-        # Use the yfinance API to get asset information for each ticker
-        stock_data = yf.download(' '.join(tickers), period="5y")[['Adj Close']]
+        # Read five years of adjusted closes for each ticker from the local price store
+        stock_data = get_closes(tickers, start=timezone.now() - pd.DateOffset(years=5))
         stock_data = stock_data.dropna()
 
-        # Calculate the percentage change for each asset and drop the NaN values
-        stock_returns = stock_data.pct_change().dropna()
-
-        # Only remove the first level of the MultiIndex from the columns if there is more than one level
-        if stock_returns.columns.nlevels > 1:
-            stock_returns.columns = stock_returns.columns.droplevel(0)
-
-        # Calculate the asset allocation of the portfolio
-        portfolio_value = 0
-        values = []
-        allocations = []
-        for asset in serializer.data:
-            ticker = asset['ticker']
-            units = float(asset['units'])  # Convert units to float
-            info = yf.Ticker(ticker).info
-            regular_market_open = info.get('regularMarketOpen')
-            if regular_market_open is not None:
-                value = regular_market_open * units
-                portfolio_value += value
-                values.append(value)
-        
-        for value in values:
-            allocations.append(round(value/portfolio_value, 3))
-
-        # Create a dictionary mapping tickers to allocations
-        allocations_dict = dict(zip(tickers, allocations))
+        return JsonResponse(portfolio_metrics(tickers, units, stock_data, get_quotes(tickers)))
 
-        portfolio_returns = stock_returns.copy()
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncGetPortfolioMetrics(View):
+    async def get(self, request, portfolio_id):
+        portfolio = await aget_object_or_404(Portfolio, id=portfolio_id)
+        holdings = [holding async for holding in Asset.objects.filter(portfolio=portfolio).values_list('ticker', 'units')]
+        tickers = [ticker for ticker, _ in holdings]
+        units = [units for _, units in holdings]
+
+        # History reads for every ticker and the quotes run concurrently
+        stock_data, quotes = await asyncio.gather(
+            market_data.get_closes(tickers, start=timezone.now() - pd.DateOffset(years=5)),
+            market_data.get_quotes(tickers),
+        )
+        return JsonResponse(portfolio_metrics(tickers, units, stock_data.dropna(), quotes))
 
-        # Calculate the returns for each asset
-        for asset, allocation in zip(portfolio_returns.columns, allocations):
-            portfolio_returns[asset] = portfolio_returns[asset] * allocation
+@timed('compute.sp500')
+def sp500_metrics():
+    # Get the S&P 500 data
+    sp500 = get_history('^GSPC', start=timezone.now() - pd.DateOffset(years=5), adjusted=False)[['Adj Close']]
+    sp500 = sp500.dropna()
 
-        # Calculate portfolio return
-        portfolio_returns['Portfolio_Return'] = portfolio_returns.sum(axis=1)
+    # Calculate the percentage change
+    sp500_returns = sp500.pct_change().dropna()
 
-        # Assume a risk-free rate of 0
-        risk_free_rate = 0
+    # Assume a risk-free rate of 0
+    risk_free_rate = 0
 
-        # Calculate Sharpe Ratio and annualize it
-        sharpe_ratio = (portfolio_returns['Portfolio_Return'].mean() - risk_free_rate) / portfolio_returns['Portfolio_Return'].std()
-        sharpe_ratio = round(sharpe_ratio * np.sqrt(255), 2)
+    # Calculate Sharpe Ratio and annualize it
+    sharpe_ratio = (sp500_returns.mean() - risk_free_rate) / sp500_returns.std()
+    sharpe_ratio = round(sharpe_ratio.iloc[0] * np.sqrt(255), 2)
 
-        # Calculate downside deviation
-        downside_returns = portfolio_returns.loc[portfolio_returns['Portfolio_Return'] < risk_free_rate]
-        downside_deviation = downside_returns.std()['Portfolio_Return']
+    # Calculate downside deviation
+    downside_returns = sp500_returns.loc[sp500_returns['Adj Close'] < risk_free_rate]
+    downside_deviation = downside_returns.std()['Adj Close']
 
-        # Calculate Sortino Ratio and annualize it
-        sortino_ratio = (portfolio_returns['Portfolio_Return'].mean() - risk_free_rate) / downside_deviation
-        sortino_ratio = round(sortino_ratio * np.sqrt(255), 2)
+    # Calculate Sortino Ratio and annualize it
+    sortino_ratio = (sp500_returns.mean() - risk_free_rate) / downside_deviation
+    sortino_ratio = round(sortino_ratio.iloc[0] * np.sqrt(255), 2)
 
-        # Calculate expected annual return
-        expected_annual_return = round(portfolio_returns['Portfolio_Return'].mean() * 255 * 100, 2)
+    # Calculate the expected annual return
+    expected_annual_return = round(sp500_returns.mean().iloc[0] * 255 * 100, 2)
 
-        # Calculate annual volatility
-        annual_volatility = round(portfolio_returns['Portfolio_Return'].std() * np.sqrt(255) * 100, 2)
+    # Calculate the annual volatility
+    annual_volatility = round(sp500_returns.std().iloc[0] * np.sqrt(255) * 100, 2)
 
-        # Calculate correlation matrix
-        corr_matrix = stock_returns.corr()
-
-        return JsonResponse({
-            "Portfolio Allocation": allocations_dict,
-            "Sharpe Ratio": sharpe_ratio,
-            "Sortino Ratio": sortino_ratio,
-            "Expected Annual Return": expected_annual_return,
-            "Annual Volatility": annual_volatility,
-            "Correlation Matrix": corr_matrix.to_dict(),
-        })
+    return {
+        "Sharpe Ratio": sharpe_ratio,
+        "Sortino Ratio": sortino_ratio,
+        "Expected Annual Return": expected_annual_return,
+        "Annual Volatility": annual_volatility
+    }
 
 @method_decorator(csrf_exempt, name='dispatch')
 class GetSPMetrics(View):
     def get(self, request):
-        # Get the S&P 500 data
-        sp500 = yf.download('^GSPC', period="5y")[['Adj Close']]
-        sp500 = sp500.dropna()
-
-        # Calculate the percentage change
-        sp500_returns = sp500.pct_change().dropna()
-
-        # Assume a risk-free rate of 0
-        risk_free_rate = 0
-
-        # Calculate Sharpe Ratio and annualize it
-        sharpe_ratio = (sp500_returns.mean() - risk_free_rate) / sp500_returns.std()
-        sharpe_ratio = round(sharpe_ratio.iloc[0] * np.sqrt(255), 2)
-
-        # Calculate downside deviation
-        downside_returns = sp500_returns.loc[sp500_returns['Adj Close'] < risk_free_rate]
-        downside_deviation = downside_returns.std()['Adj Close']
-
-        # Calculate Sortino Ratio and annualize it
-        sortino_ratio = (sp500_returns.mean() - risk_free_rate) / downside_deviation
-        sortino_ratio = round(sortino_ratio.iloc[0] * np.sqrt(255), 2)
-
-        # Calculate the expected annual return
-        expected_annual_return = round(sp500_returns.mean().iloc[0] * 255 * 100, 2)
-
-        # Calculate the annual volatility
-        annual_volatility = round(sp500_returns.std().iloc[0] * np.sqrt(255) * 100, 2)
-
-        return JsonResponse({
-            "Sharpe Ratio": sharpe_ratio,
-            "Sortino Ratio": sortino_ratio,
-            "Expected Annual Return": expected_annual_return,
-            "Annual Volatility": annual_volatility
-        })
+        return JsonResponse(sp500_metrics())
     
+class PortfolioContext:
+    # Everything the assistant's portfolio sections need, read from the database
+    # once per call. The sections themselves only touch market data.
+
+    def __init__(self, pid):
+        self.portfolio = Portfolio.objects.select_related('user', 'snapshot').get(id=pid)
+        self.snapshot = self.portfolio.get_snapshot()
+        self.assets = list(Asset.objects.filter(portfolio=self.portfolio).values())
+        self.tickers = [asset['ticker'] for asset in self.assets]
+        self.transactions = transactions_frame(Transaction.objects.filter(portfolio=self.portfolio))
+        # One batched quote fetch shared by the value, metrics and asset sections
+        self.quotes = get_quotes(self.tickers)
+
+    def portfolio_value(self):
+        holdings = pd.DataFrame(self.assets, columns=['ticker', 'units'])
+        return portfolio_value_summary(self.snapshot, holdings, self.quotes)
+
+    def metrics(self):
+        stock_data = get_closes(self.tickers, start=timezone.now() - pd.DateOffset(years=5)).dropna()
+        return portfolio_metrics(self.tickers, [asset['units'] for asset in self.assets], stock_data, self.quotes)
+
+    def assets_data(self):
+        assets_data = [dict(asset) for asset in self.assets]
+        if assets_data:
+            valuation = value_assets(assets_data, self.quotes)
+            for asset_data, values in zip(assets_data, valuation.to_dict('records')):
+                asset_data.update(values)
+        # Exclude 'id' and 'portfolio_id' fields
+        for item in assets_data:
+            item.pop('id', None)
+            item.pop('portfolio_id', None)
+        return assets_data
+
+    def dividends(self):
+        return portfolio_dividends(self.transactions)
+
+# Sections of the assistant's portfolio file, in order, with their subheaders
+CONTEXT_SECTIONS = [
+    ('**Portfolio value, dividends and fees**', lambda context: context.portfolio_value()),
+    ('**Portfolio asset allocation and Metrics**', lambda context: context.metrics()),
+    ('**S&P 500 metrics for comparison with portfolio metrics**', lambda context: sp500_metrics()),
+    ('**Assets in portfolio**', lambda context: context.assets_data()),
+    ('**Total dividends received from each stock**', lambda context: context.dividends()),
+]
+
+def portfolio_context_text(pid):
+    context = PortfolioContext(pid)
+    portfolio = context.portfolio
+    lines = [
+        'Portfolio Information:',  # Add header
+        f'User ID (uid): {portfolio.user.id}',
+        f'Portfolio ID (pid): {portfolio.id}',
+        f'Name: {portfolio.name}',
+        f'Notes: {portfolio.remarks}',
+        f'Date Created: {portfolio.dateCreated}',
+    ]
+
+    # The sections share the context and only wait on market data, so compute them side by side
+    with ThreadPoolExecutor(max_workers=len(CONTEXT_SECTIONS)) as pool:
+        results = list(pool.map(wrap(lambda section: section[1](context)), CONTEXT_SECTIONS))
+
+    for (header, _), data in zip(CONTEXT_SECTIONS, results):
+        lines.append(f'\n{header}')  # Add custom subheader
+        lines.append(json.dumps(data, indent=4, cls=DjangoJSONEncoder))
+    return '\n'.join(lines) + '\n'
+
+def portfolio_ledger_hash(pid):
+    # sha256 of what the portfolio context file is built from in the database.
+    # Quotes move all day and would make every sync a new upload, so the file's
+    # market figures are refreshed once a day or when the portfolio changes.
+    portfolio = Portfolio.objects.get(id=pid)
+    ledger = {
+        'as_of': timezone.now().date(),
+        'portfolio': [portfolio.user_id, portfolio.id, portfolio.name, portfolio.remarks, portfolio.dateCreated, portfolio.cost_basis_method],
+        'assets': list(
+            Asset.objects.filter(portfolio=portfolio).order_by('id')
+            .values_list('name', 'ticker', 'type', 'sector', 'units', 'averagePrice')
+        ),
+        'transactions': list(
+            Transaction.objects.filter(portfolio=portfolio).order_by('id')
+            .values_list('transaction_type', 'asset_name', 'ticker', 'units', 'price', 'fee', 'transaction_date')
+        ),
+    }
+    return hashlib.sha256(json.dumps(ledger, cls=DjangoJSONEncoder).encode()).hexdigest()
+
 def write_view_outputs_to_file(pid, filename):
-    factory = RequestFactory()
-    view_data = [(GetPortfolioValue, {'portfolio_id': pid}),
-                 (GetPortfolioMetrics, {'portfolio_id': pid}),
-                 (GetSPMetrics, {}),
-                 (GetAssets, {'portfolio_id': pid}),
-                 (GetDividendsReceived, {'portfolio_id': pid})]
-    headers = {GetAssets: '**Assets in portfolio**', 
-               GetPortfolioValue: '**Portfolio value, dividends and fees**', 
-               GetDividendsReceived: '**Total dividends received from each stock**',
-               GetPortfolioMetrics: '**Portfolio asset allocation and Metrics**',
-               GetSPMetrics: '**S&P 500 metrics for comparison with portfolio metrics**'}
+    # Writes the portfolio context file
+    content = portfolio_context_text(pid)
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
     with open(filename, 'w') as f:
-        f.write('Portfolio Information:\n')  # Add header
-        portfolio = Portfolio.objects.get(id=pid)
-        f.write(f'User ID (uid): {portfolio.user.id}\n')
-        f.write(f'Portfolio ID (pid): {portfolio.id}\n')
-        f.write(f'Name: {portfolio.name}\n')
-        f.write(f'Notes: {portfolio.remarks}\n')
-        f.write(f'Date Created: {portfolio.dateCreated}\n')
-
-        for view_class, kwargs in view_data:
-            f.write(f'\n{headers[view_class]}\n')  # Add custom subheader
-            request = factory.get('/')
-            view_instance = view_class()
-            response = view_instance.get(request, **kwargs)
-            data = json.loads(response.content)
-            # Exclude 'id' and 'portfolio_id' fields for GetAssets view
-            if view_class == GetAssets:
-                for item in data:
-                    item.pop('id', None)
-                    item.pop('portfolio_id', None)
-            f.write(json.dumps(data, indent=4))
-            f.write('\n')
+        f.write(content)